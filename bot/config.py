@@ -12,5 +12,92 @@ ADMIN_IDS = [
 ]
 GUARD_CHANNEL_ID = -1003679118381
 
+# Настройки соединений SQLite (применяются к каждому соединению из пула)
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "16384"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(64 * 1024 * 1024)))
+# Запись дольше этого порога логируется как ожидание блокировки
+SQLITE_LOCK_WAIT_WARN_MS = int(os.getenv("SQLITE_LOCK_WAIT_WARN_MS", "200"))
+
+# Рассылки родителям (лимиты Telegram: ~30 сообщений/с на бота, ~1/с в один чат)
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "8"))
+BROADCAST_RATE_PER_SECOND = float(os.getenv("BROADCAST_RATE_PER_SECOND", "25"))
+BROADCAST_PER_CHAT_INTERVAL_SECONDS = float(os.getenv("BROADCAST_PER_CHAT_INTERVAL_SECONDS", "1.0"))
+BROADCAST_MAX_RETRIES = int(os.getenv("BROADCAST_MAX_RETRIES", "3"))
+BROADCAST_PROGRESS_INTERVAL_SECONDS = float(os.getenv("BROADCAST_PROGRESS_INTERVAL_SECONDS", "3"))
+
+# Очередь исходящих уведомлений (outbox)
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_POLL_INTERVAL_SECONDS = float(os.getenv("OUTBOX_POLL_INTERVAL_SECONDS", "5"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+
+# Авто-просрочка заявок на выдачу (фоновый sweeper)
+PICKUP_EXPIRE_AFTER_MINUTES = int(os.getenv("PICKUP_EXPIRE_AFTER_MINUTES", "120"))
+PICKUP_EXPIRY_SWEEP_INTERVAL_SECONDS = float(os.getenv("PICKUP_EXPIRY_SWEEP_INTERVAL_SECONDS", "300"))
+PICKUP_EXPIRY_BATCH_SIZE = int(os.getenv("PICKUP_EXPIRY_BATCH_SIZE", "200"))
+
+# Минимальный интервал между правками одного сообщения в канале охраны
+GUARD_EDIT_MIN_INTERVAL_SECONDS = float(os.getenv("GUARD_EDIT_MIN_INTERVAL_SECONDS", "3"))
+
+# Доска выдачи: одно закреплённое сообщение в канале охраны со всеми активными
+# заявками вместо отдельного сообщения на каждую заявку
+PICKUP_BOARD_ENABLED = os.getenv("PICKUP_BOARD_ENABLED", "0") == "1"
+PICKUP_BOARD_EDIT_INTERVAL_SECONDS = float(os.getenv("PICKUP_BOARD_EDIT_INTERVAL_SECONDS", "3"))
+PICKUP_BOARD_PAGE_SIZE = int(os.getenv("PICKUP_BOARD_PAGE_SIZE", "8"))
+
+# FSM-состояния в БД: изменения копятся в памяти и пишутся пачкой раз в интервал,
+# брошенные диалоги удаляются через FSM_STATE_TTL_HOURS без активности
+FSM_FLUSH_INTERVAL_SECONDS = float(os.getenv("FSM_FLUSH_INTERVAL_SECONDS", "1"))
+FSM_STATE_TTL_HOURS = float(os.getenv("FSM_STATE_TTL_HOURS", "24"))
+FSM_GC_INTERVAL_SECONDS = int(os.getenv("FSM_GC_INTERVAL_SECONDS", "3600"))
+# Кэш недавних FSM-ключей в памяти (без запроса к БД на каждый апдейт);
+# 0 — отключить, если с одной БД работают несколько процессов бота
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+
+# Режим получения апдейтов: "polling" (по умолчанию) или "webhook".
+# Для webhook нужен публичный HTTPS-адрес WEBHOOK_BASE_URL (например, за nginx),
+# сам бот слушает WEBAPP_HOST:WEBAPP_PORT
+BOT_RUN_MODE = os.getenv("BOT_RUN_MODE", "polling").strip().lower()
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+# Секрет проверяется в заголовке X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or None
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "127.0.0.1")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", "8080"))
+
+# Апдейты, накопившиеся пока бот был остановлен:
+# "drain" — обработать по приоритету (выдача детей, затем действия, затем отчёты),
+# "skip" — отбросить все
+STARTUP_BACKLOG_MODE = os.getenv("STARTUP_BACKLOG_MODE", "drain").strip().lower()
+# Более старые апдейты своей категории при разборе очереди отбрасываются
+BACKLOG_MAX_AGE_PICKUP_SECONDS = int(os.getenv("BACKLOG_MAX_AGE_PICKUP_SECONDS", "900"))
+BACKLOG_MAX_AGE_ACTIONS_SECONDS = int(os.getenv("BACKLOG_MAX_AGE_ACTIONS_SECONDS", "3600"))
+BACKLOG_MAX_AGE_REPORTS_SECONDS = int(os.getenv("BACKLOG_MAX_AGE_REPORTS_SECONDS", "300"))
+
+# Полосы выполнения апдейтов: у каждой категории свой лимит одновременных хэндлеров.
+# Пока идёт автоозвучка и в полосе выдачи детей не меньше LANE_PICKUP_SHED_THRESHOLD
+# апдейтов, отчёты не выполняются — пользователю предлагается повторить позже
+LANE_PICKUP_CONCURRENCY = int(os.getenv("LANE_PICKUP_CONCURRENCY", "16"))
+LANE_ACTIONS_CONCURRENCY = int(os.getenv("LANE_ACTIONS_CONCURRENCY", "8"))
+LANE_REPORTS_CONCURRENCY = int(os.getenv("LANE_REPORTS_CONCURRENCY", "4"))
+LANE_PICKUP_SHED_THRESHOLD = int(os.getenv("LANE_PICKUP_SHED_THRESHOLD", "4"))
+
+# Апдейты одного пользователя выполняются строго по очереди, разных — параллельно,
+# но не больше UPDATE_WORKERS одновременно. Повтор того же нажатия
+# (та же кнопка того же сообщения) в пределах окна отбрасывается
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "32"))
+DUPLICATE_CALLBACK_WINDOW_SECONDS = float(os.getenv("DUPLICATE_CALLBACK_WINDOW_SECONDS", "1.5"))
+
+# Метрики Prometheus на локальном HTTP-сервере (GET /metrics)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+# Запросы дольше порога пишутся в лог с «отпечатком» (текст без значений)
+METRICS_SLOW_QUERY_MS = float(os.getenv("METRICS_SLOW_QUERY_MS", "100"))
+# Больше запросов к БД за один апдейт/проход задачи — предупреждение о возможном N+1
+METRICS_QUERY_BUDGET = int(os.getenv("METRICS_QUERY_BUDGET", "25"))
+
 if not BOT_TOKEN:
     raise RuntimeError("BOT_TOKEN не найден. Проверь файл .env")
@@ -1,7 +1,13 @@
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import declarative_base, sessionmaker
 
+from bot.db.sqlite_tuning import install_sqlite_tuning
+
 DB_URL = "sqlite:///./school.db"
+# Тот же файл БД, но через асинхронный драйвер aiosqlite:
+# запросы из хэндлеров не блокируют event loop.
+ASYNC_DB_URL = DB_URL.replace("sqlite://", "sqlite+aiosqlite://", 1)
 
 engine = create_engine(
     DB_URL,
@@ -9,6 +15,16 @@ engine = create_engine(
     future=True,
 )
 
+async_engine = create_async_engine(
+    ASYNC_DB_URL,
+    future=True,
+)
+
+# WAL, busy_timeout, synchronous, cache_size и mmap_size
+# для каждого соединения обоих движков
+install_sqlite_tuning(engine)
+install_sqlite_tuning(async_engine.sync_engine)
+
 # ВАЖНО: чтобы после commit не было DetachedInstanceError
 SessionLocal = sessionmaker(
     bind=engine,
@@ -18,4 +34,14 @@ SessionLocal = sessionmaker(
     future=True,
 )
 
+# Асинхронная фабрика сессий для хэндлеров, middleware и фоновых задач.
+# expire_on_commit=False обязателен: ленивую подгрузку атрибутов
+# после commit AsyncSession выполнить не может.
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False,
+)
+
 Base = declarative_base()
@@ -0,0 +1,288 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from sqlalchemy import delete
+from sqlalchemy.dialects.sqlite import insert
+
+from bot.config import (
+    FSM_FLUSH_INTERVAL_SECONDS,
+    FSM_STATE_TTL_HOURS,
+    FSM_GC_INTERVAL_SECONDS,
+    FSM_CACHE_SIZE,
+)
+from bot.db.database import AsyncSessionLocal
+from bot.db.models import FsmState
+
+
+logger = logging.getLogger(__name__)
+
+
+_UNSET: Any = object()
+
+
+@dataclass
+class _PendingWrite:
+    """Ещё не записанное изменение ключа; _UNSET — поле не менялось."""
+
+    state: Any = _UNSET
+    data: Any = _UNSET
+
+
+def _serialize_key(key: StorageKey) -> str:
+    return ":".join(
+        str(part) if part is not None else ""
+        for part in (
+            key.bot_id,
+            key.chat_id,
+            key.user_id,
+            key.thread_id,
+            key.business_connection_id,
+            key.destiny,
+        )
+    )
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM-хранилище aiogram в таблице fsm_states.
+
+    - запись: изменения копятся в памяти (_pending) и раз в
+      FSM_FLUSH_INTERVAL_SECONDS пишутся одной транзакцией; несколько
+      set_state/update_data за одно обновление дают одну запись в БД;
+    - чтение: сначала ещё не записанные изменения, затем кэш недавних
+      ключей (LRU на FSM_CACHE_SIZE записей, обновляется при каждой записи),
+      затем БД; FSMContextMiddleware читает состояние на каждом апдейте,
+      и активный пользователь не платит за это запросом к БД;
+    - несколько процессов с общей БД: кэш нужно отключить
+      (FSM_CACHE_SIZE=0), тогда процессы видят состояние друг друга
+      с задержкой не больше интервала записи;
+    - ключи без состояния и данных удаляются, брошенные диалоги —
+      через FSM_STATE_TTL_HOURS без активности (collect_garbage).
+    """
+
+    def __init__(
+        self,
+        flush_interval_seconds: float = FSM_FLUSH_INTERVAL_SECONDS,
+        cache_size: int = FSM_CACHE_SIZE,
+    ):
+        self.flush_interval = flush_interval_seconds
+        self.cache_size = cache_size
+        # Последнее известное значение ключа (после записи или чтения из БД)
+        self._cache: "OrderedDict[str, _PendingWrite]" = OrderedDict()
+        self._pending: Dict[str, _PendingWrite] = {}
+        # Пачка, которая прямо сейчас пишется в БД (видна чтению до commit)
+        self._flushing: Dict[str, _PendingWrite] = {}
+        self._dirty = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self.flushes = 0
+        self.coalesced = 0
+        self.cache_hits = 0
+        self.db_reads = 0
+
+    # ---------- BaseStorage ----------
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        key = _serialize_key(key)
+        self._write(key).state = value
+        cached = self._cached(key)
+        if cached is not None:
+            cached.state = value
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._read(_serialize_key(key), need_data=False)
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        key = _serialize_key(key)
+        self._write(key).data = dict(data)
+        cached = self._cached(key)
+        if cached is not None:
+            cached.data = dict(data)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._read(_serialize_key(key), need_data=True)
+        return dict(data)
+
+    async def close(self) -> None:
+        await self.flush()
+
+    # ---------- очередь записи ----------
+
+    def _write(self, key: str) -> _PendingWrite:
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = _PendingWrite()
+        else:
+            self.coalesced += 1
+        self._dirty.set()
+        return pending
+
+    def _cached(self, key: str) -> Optional[_PendingWrite]:
+        """Запись кэша для ключа (создаётся при необходимости); None — кэш выключен."""
+        if self.cache_size <= 0:
+            return None
+        cached = self._cache.get(key)
+        if cached is None:
+            cached = self._cache[key] = _PendingWrite()
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(key)
+        return cached
+
+    def _lookup(self, key: str):
+        """Значения из очереди записи и кэша; _UNSET — нужно читать БД."""
+        state = data = _UNSET
+        for layer in (self._pending, self._flushing, self._cache):
+            pending = layer.get(key)
+            if pending is None:
+                continue
+            if state is _UNSET:
+                state = pending.state
+            if data is _UNSET:
+                data = pending.data
+        return state, data
+
+    async def _read(self, key: str, need_data: bool):
+        state, data = self._lookup(key)
+        if state is _UNSET or (need_data and data is _UNSET):
+            self.db_reads += 1
+            row = await self._load(key)
+            row_state = row.state if row else None
+            row_data = json.loads(row.data) if row else {}
+            cached = self._cached(key)
+            if cached is not None:
+                if cached.state is _UNSET:
+                    cached.state = row_state
+                if cached.data is _UNSET:
+                    cached.data = row_data
+            # Запись, пришедшая во время чтения из БД, новее прочитанной строки
+            state, data = self._lookup(key)
+            if state is _UNSET:
+                state = row_state
+            if data is _UNSET:
+                data = row_data
+        else:
+            self.cache_hits += 1
+            if key in self._cache:
+                self._cache.move_to_end(key)
+        return state, (data if data is not _UNSET else {})
+
+    async def _load(self, key: str) -> Optional[FsmState]:
+        session = AsyncSessionLocal()
+        try:
+            return await session.get(FsmState, key)
+        finally:
+            await session.close()
+
+    async def flush(self) -> int:
+        """Пишет накопленные изменения одной транзакцией; возвращает число ключей."""
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            self._flushing = batch
+            try:
+                await self._flush_batch(batch)
+            except Exception:
+                # Возвращаем пачку в очередь, не затирая более свежие изменения
+                for key, pending in batch.items():
+                    newer = self._pending.setdefault(key, _PendingWrite())
+                    if newer.state is _UNSET:
+                        newer.state = pending.state
+                    if newer.data is _UNSET:
+                        newer.data = pending.data
+                raise
+            finally:
+                self._flushing = {}
+            self.flushes += 1
+            return len(batch)
+
+    async def _flush_batch(self, batch: Dict[str, _PendingWrite]) -> None:
+        now = datetime.utcnow()
+        session = AsyncSessionLocal()
+        try:
+            for key, pending in batch.items():
+                values: Dict[str, Any] = {"updated_at": now}
+                if pending.state is not _UNSET:
+                    values["state"] = pending.state
+                if pending.data is not _UNSET:
+                    values["data"] = json.dumps(pending.data, ensure_ascii=False)
+                await session.execute(
+                    insert(FsmState)
+                    .values(key=key, **values)
+                    .on_conflict_do_update(index_elements=[FsmState.key], set_=values)
+                )
+
+            # state.clear(): ни состояния, ни данных — строка не нужна
+            await session.execute(
+                delete(FsmState)
+                .where(
+                    FsmState.key.in_(list(batch)),
+                    FsmState.state.is_(None),
+                    FsmState.data == "{}",
+                )
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+        finally:
+            await session.close()
+
+    # ---------- фоновые задачи ----------
+
+    async def collect_garbage(self, now: Optional[datetime] = None) -> int:
+        """Удаляет состояния без активности дольше FSM_STATE_TTL_HOURS."""
+        cutoff = (now or datetime.utcnow()) - timedelta(hours=FSM_STATE_TTL_HOURS)
+        session = AsyncSessionLocal()
+        try:
+            result = await session.execute(
+                delete(FsmState)
+                .where(FsmState.updated_at < cutoff)
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+        finally:
+            await session.close()
+
+        removed = result.rowcount or 0
+        if removed:
+            # Удалённые ключи могли остаться в кэше со старым состоянием
+            self._cache.clear()
+            logger.info("FSM: удалено брошенных состояний: %s", removed)
+        return removed
+
+    async def run(self) -> None:
+        """Фоновая запись изменений и периодическая чистка устаревших состояний."""
+        loop = asyncio.get_running_loop()
+        next_gc_at = loop.time()
+        while True:
+            if loop.time() >= next_gc_at:
+                try:
+                    await self.collect_garbage()
+                except Exception:
+                    logger.exception("Ошибка чистки FSM-состояний")
+                next_gc_at = loop.time() + FSM_GC_INTERVAL_SECONDS
+
+            try:
+                await asyncio.wait_for(self._dirty.wait(), timeout=max(next_gc_at - loop.time(), 0))
+            except asyncio.TimeoutError:
+                continue
+            self._dirty.clear()
+
+            # Даём накопиться изменениям соседних обновлений
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Ошибка записи FSM-состояний")
+                self._dirty.set()
@@ -0,0 +1,323 @@
+from __future__ import annotations
+
+import logging
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import OperationalError
+
+from bot.db.database import engine as default_engine, Base
+from bot.db import models  # noqa: F401  (регистрирует таблицы в Base.metadata)
+
+
+logger = logging.getLogger(__name__)
+
+
+# =========================
+# ШАГИ МИГРАЦИЙ
+# =========================
+#
+# Каждый шаг получает соединение с уже открытой транзакцией.
+# Новые шаги добавляются только в конец списка MIGRATIONS
+# со следующим номером версии. Шаги пишут DDL явно, а не берут его
+# из моделей: модели меняются, а шаг должен делать то же, что и при выпуске.
+
+
+def _table_columns(conn: Connection, table: str) -> List[str]:
+    rows = conn.exec_driver_sql(f"PRAGMA table_info({table})").fetchall()
+    return [row[1] for row in rows]
+
+
+def _add_column_if_missing(conn: Connection, table: str, column: str, ddl: str) -> None:
+    if column not in _table_columns(conn, table):
+        conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+        logger.info("Column %s.%s added", table, column)
+
+
+# Схема на момент перехода на миграции: таблицы, которые ensure_sqlite_schema()
+# создавала через create_all. Зафиксирована текстом — шаг не зависит от
+# текущих моделей и на старой БД всегда делает одно и то же.
+_LEGACY_TABLES = (
+    """CREATE TABLE IF NOT EXISTS subjects (
+        id INTEGER NOT NULL,
+        name VARCHAR NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id),
+        UNIQUE (name)
+    )""",
+    """CREATE TABLE IF NOT EXISTS users (
+        id INTEGER NOT NULL,
+        telegram_id INTEGER NOT NULL,
+        full_name VARCHAR NOT NULL,
+        phone VARCHAR,
+        role VARCHAR,
+        is_verified BOOLEAN,
+        is_blocked BOOLEAN,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id),
+        UNIQUE (telegram_id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS children (
+        id INTEGER NOT NULL,
+        parent_id INTEGER NOT NULL,
+        full_name VARCHAR NOT NULL,
+        class_name VARCHAR NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id),
+        FOREIGN KEY(parent_id) REFERENCES users (id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS teachers (
+        id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        subject_id INTEGER,
+        status VARCHAR,
+        is_verified BOOLEAN,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id),
+        UNIQUE (user_id),
+        FOREIGN KEY(user_id) REFERENCES users (id),
+        FOREIGN KEY(subject_id) REFERENCES subjects (id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS attendance (
+        id INTEGER NOT NULL,
+        child_id INTEGER NOT NULL,
+        teacher_id INTEGER NOT NULL,
+        date DATE NOT NULL,
+        status VARCHAR NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id),
+        CONSTRAINT uq_attendance_child_date UNIQUE (child_id, date),
+        FOREIGN KEY(child_id) REFERENCES children (id),
+        FOREIGN KEY(teacher_id) REFERENCES teachers (id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS comments (
+        id INTEGER NOT NULL,
+        child_id INTEGER NOT NULL,
+        teacher_id INTEGER NOT NULL,
+        comment_type VARCHAR NOT NULL,
+        text TEXT NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id),
+        FOREIGN KEY(child_id) REFERENCES children (id),
+        FOREIGN KEY(teacher_id) REFERENCES teachers (id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS grades (
+        id INTEGER NOT NULL,
+        child_id INTEGER NOT NULL,
+        teacher_id INTEGER NOT NULL,
+        subject_id INTEGER NOT NULL,
+        grade INTEGER NOT NULL,
+        comment VARCHAR,
+        date DATE DEFAULT CURRENT_TIMESTAMP NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id),
+        FOREIGN KEY(child_id) REFERENCES children (id),
+        FOREIGN KEY(teacher_id) REFERENCES teachers (id),
+        FOREIGN KEY(subject_id) REFERENCES subjects (id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS homework (
+        id INTEGER NOT NULL,
+        teacher_id INTEGER NOT NULL,
+        class_name VARCHAR NOT NULL,
+        subject_id INTEGER NOT NULL,
+        text TEXT NOT NULL,
+        due_date DATE NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id),
+        FOREIGN KEY(teacher_id) REFERENCES teachers (id),
+        FOREIGN KEY(subject_id) REFERENCES subjects (id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS pickup_requests (
+        id INTEGER NOT NULL,
+        parent_id INTEGER,
+        child_id INTEGER,
+        arrival_minutes INTEGER,
+        status VARCHAR,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id),
+        FOREIGN KEY(parent_id) REFERENCES users (id),
+        FOREIGN KEY(child_id) REFERENCES children (id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS teacher_classes (
+        id INTEGER NOT NULL,
+        teacher_id INTEGER NOT NULL,
+        class_name VARCHAR NOT NULL,
+        PRIMARY KEY (id),
+        CONSTRAINT uq_teacher_class UNIQUE (teacher_id, class_name),
+        FOREIGN KEY(teacher_id) REFERENCES teachers (id)
+    )""",
+)
+
+
+def _m001_legacy_columns(conn: Connection) -> None:
+    """
+    Бывшая ensure_sqlite_schema():
+    - недостающие таблицы (схема того времени, _LEGACY_TABLES)
+    - users.is_blocked
+    - поля автоповторов и передачи в pickup_requests
+    """
+    for ddl in _LEGACY_TABLES:
+        conn.exec_driver_sql(ddl)
+
+    _add_column_if_missing(conn, "users", "is_blocked", "BOOLEAN DEFAULT 0")
+
+    _add_column_if_missing(conn, "pickup_requests", "updated_at", "DATETIME")
+    _add_column_if_missing(conn, "pickup_requests", "last_announce_at", "DATETIME")
+    _add_column_if_missing(conn, "pickup_requests", "next_announce_at", "DATETIME")
+    _add_column_if_missing(conn, "pickup_requests", "announce_count", "INTEGER DEFAULT 0")
+    _add_column_if_missing(conn, "pickup_requests", "handed_over_at", "DATETIME")
+    _add_column_if_missing(conn, "pickup_requests", "handed_over_by", "INTEGER")
+    _add_column_if_missing(conn, "pickup_requests", "channel_message_id", "INTEGER")
+
+
+def _m002_hot_query_indexes(conn: Connection) -> None:
+    """Индексы для горячих фильтров (create_all не добавляет их к старым таблицам)."""
+    for ddl in (
+        "CREATE INDEX IF NOT EXISTS ix_users_phone ON users (phone)",
+        "CREATE INDEX IF NOT EXISTS ix_children_parent_id ON children (parent_id)",
+        "CREATE INDEX IF NOT EXISTS ix_children_class_name ON children (class_name)",
+        "CREATE INDEX IF NOT EXISTS ix_comments_child_created ON comments (child_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_grades_child_date ON grades (child_id, date)",
+        "CREATE INDEX IF NOT EXISTS ix_homework_class_due ON homework (class_name, due_date)",
+        "CREATE INDEX IF NOT EXISTS ix_pickup_status_next_announce ON pickup_requests (status, next_announce_at)",
+        "CREATE INDEX IF NOT EXISTS ix_pickup_parent_child_status ON pickup_requests (parent_id, child_id, status)",
+        "CREATE INDEX IF NOT EXISTS ix_pickup_status_created ON pickup_requests (status, created_at)",
+    ):
+        conn.exec_driver_sql(ddl)
+
+
+def _m003_outbox(conn: Connection) -> None:
+    """Таблица исходящих уведомлений (вместе с индексом)."""
+    conn.exec_driver_sql(
+        """CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            status VARCHAR NOT NULL,
+            attempts INTEGER NOT NULL,
+            next_attempt_at DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL,
+            last_error VARCHAR,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            sent_at DATETIME,
+            PRIMARY KEY (id)
+        )"""
+    )
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_outbox_status_next_attempt ON outbox (status, next_attempt_at)"
+    )
+
+
+def _m004_bot_state(conn: Connection) -> None:
+    """Таблица служебных значений (id закреплённой доски выдачи и т.п.)."""
+    conn.exec_driver_sql(
+        """CREATE TABLE IF NOT EXISTS bot_state (
+            "key" VARCHAR NOT NULL,
+            value VARCHAR,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY ("key")
+        )"""
+    )
+
+
+def _m005_fsm_states(conn: Connection) -> None:
+    """Таблица FSM-состояний (переживают перезапуск бота)."""
+    conn.exec_driver_sql(
+        """CREATE TABLE IF NOT EXISTS fsm_states (
+            "key" VARCHAR NOT NULL,
+            state VARCHAR,
+            data TEXT NOT NULL,
+            updated_at DATETIME NOT NULL,
+            PRIMARY KEY ("key")
+        )"""
+    )
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_fsm_states_updated_at ON fsm_states (updated_at)")
+
+
+def _m006_outbox_reply_markup(conn: Connection) -> None:
+    """Клавиатура у уведомлений outbox (меню учителя после подтверждения)."""
+    _add_column_if_missing(conn, "outbox", "reply_markup", "TEXT")
+
+
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "legacy columns", _m001_legacy_columns),
+    (2, "hot query indexes", _m002_hot_query_indexes),
+    (3, "notification outbox", _m003_outbox),
+    (4, "bot state", _m004_bot_state),
+    (5, "fsm states", _m005_fsm_states),
+    (6, "outbox reply markup", _m006_outbox_reply_markup),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+# =========================
+# ДВИЖОК МИГРАЦИЙ
+# =========================
+
+def _read_version(conn: Connection) -> Optional[int]:
+    """Текущая версия схемы или None, если таблицы schema_version ещё нет."""
+    try:
+        return conn.exec_driver_sql("SELECT version FROM schema_version").scalar()
+    except OperationalError:
+        return None
+
+
+def _is_empty_database(conn: Connection) -> bool:
+    row = conn.exec_driver_sql(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name='users'"
+    ).first()
+    return row is None
+
+
+def run_migrations(engine: Engine = default_engine) -> int:
+    """
+    Приводит схему БД к LATEST_VERSION и возвращает итоговую версию.
+
+    - если сохранённая версия совпадает с последней, выполняется
+      ровно один SELECT и никакой интроспекции;
+    - новая БД создаётся через create_all и сразу получает последнюю версию;
+    - существующая БД без schema_version считается версией 0;
+    - все шаги и запись версии выполняются в одной транзакции.
+    """
+    # AUTOCOMMIT отключает неявные транзакции драйвера sqlite3,
+    # чтобы BEGIN/COMMIT (включая DDL) управлялись здесь явно.
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        current = _read_version(conn)
+        if current == LATEST_VERSION:
+            return current
+
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+        try:
+            # Повторная проверка под блокировкой записи:
+            # другой процесс мог успеть выполнить миграции.
+            current = _read_version(conn)
+            if current == LATEST_VERSION:
+                conn.exec_driver_sql("COMMIT")
+                return current
+
+            if current is None:
+                conn.exec_driver_sql(
+                    "CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"
+                )
+                if _is_empty_database(conn):
+                    Base.metadata.create_all(conn)
+                    logger.info("Schema created from models")
+                    current = LATEST_VERSION
+                else:
+                    current = 0
+                conn.exec_driver_sql("INSERT INTO schema_version (version) VALUES (0)")
+
+            for version, description, step in MIGRATIONS:
+                if version <= current:
+                    continue
+                step(conn)
+                logger.info("Migration %s applied: %s", version, description)
+                current = version
+
+            conn.exec_driver_sql("UPDATE schema_version SET version = ?", (current,))
+            conn.exec_driver_sql("COMMIT")
+        except Exception:
+            conn.exec_driver_sql("ROLLBACK")
+            raise
+
+    return current
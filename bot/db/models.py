@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, UniqueConstraint, Float, Text, Date
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, UniqueConstraint, Float, Text, Date, Index
 from sqlalchemy.sql import func
 from bot.db.database import Base
 
@@ -9,7 +9,7 @@ class User(Base):
     id = Column(Integer, primary_key=True)
     telegram_id = Column(Integer, unique=True, nullable=False)
     full_name = Column(String, nullable=False)
-    phone = Column(String, nullable=True)
+    phone = Column(String, nullable=True, index=True)
     role = Column(String, default="parent")  # parent / admin / teacher
     is_verified = Column(Boolean, default=False)
     is_blocked = Column(Boolean, default=False)
@@ -20,9 +20,9 @@ class Child(Base):
     __tablename__ = "children"
 
     id = Column(Integer, primary_key=True)
-    parent_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    parent_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     full_name = Column(String, nullable=False)
-    class_name = Column(String, nullable=False)
+    class_name = Column(String, nullable=False, index=True)
     created_at = Column(DateTime, server_default=func.now())
 
 
@@ -51,6 +51,15 @@ class PickupRequest(Base):
     # Сообщение в канале охраны, которое нужно уметь редактировать
     channel_message_id = Column(Integer, nullable=True)
 
+    __table_args__ = (
+        # Поиск заявок, которым пора повторить озвучку
+        Index("ix_pickup_status_next_announce", "status", "next_announce_at"),
+        # Анти-дубли в pickup_choose_time
+        Index("ix_pickup_parent_child_status", "parent_id", "child_id", "status"),
+        # Авто-просрочка старых заявок
+        Index("ix_pickup_status_created", "status", "created_at"),
+    )
+
 
 class Subject(Base):
     __tablename__ = "subjects"
@@ -110,6 +119,10 @@ class Grade(Base):
     date = Column(Date, nullable=False, server_default=func.now())
     created_at = Column(DateTime, server_default=func.now())
 
+    __table_args__ = (
+        Index("ix_grades_child_date", "child_id", "date"),
+    )
+
 
 class Comment(Base):
     __tablename__ = "comments"
@@ -121,6 +134,10 @@ class Comment(Base):
     text = Column(Text, nullable=False)
     created_at = Column(DateTime, server_default=func.now())
 
+    __table_args__ = (
+        Index("ix_comments_child_created", "child_id", "created_at"),
+    )
+
 
 class Homework(Base):
     __tablename__ = "homework"
@@ -133,8 +150,61 @@ class Homework(Base):
     due_date = Column(Date, nullable=False)
     created_at = Column(DateTime, server_default=func.now())
 
+    __table_args__ = (
+        Index("ix_homework_class_due", "class_name", "due_date"),
+    )
 
 
+class OutboxMessage(Base):
+    """
+    Исходящее уведомление в Telegram.
 
+    Пишется в той же транзакции, что и изменение данных,
+    и отправляется фоновым воркером (bot/services/outbox.py).
+    """
 
+    __tablename__ = "outbox"
 
+    id = Column(Integer, primary_key=True)
+    chat_id = Column(Integer, nullable=False)
+    text = Column(Text, nullable=False)
+    # Клавиатура сообщения в JSON (необязательно)
+    reply_markup = Column(Text, nullable=True)
+    # PENDING - ждёт отправки, SENT - доставлено, DEAD - попытки исчерпаны
+    status = Column(String, nullable=False, default="PENDING")
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, server_default=func.now())
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, server_default=func.now())
+    sent_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # Выборка следующей пачки воркером
+        Index("ix_outbox_status_next_attempt", "status", "next_attempt_at"),
+    )
+
+
+class BotState(Base):
+    """Служебные значения бота, которые должны пережить перезапуск (ключ — значение)."""
+
+    __tablename__ = "bot_state"
+
+    key = Column(String, primary_key=True)
+    value = Column(String, nullable=True)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+
+class FsmState(Base):
+    """Состояние и данные FSM aiogram для одного ключа (бот, чат, пользователь)."""
+
+    __tablename__ = "fsm_states"
+
+    key = Column(String, primary_key=True)
+    state = Column(String, nullable=True)
+    # JSON-словарь данных FSMContext
+    data = Column(Text, nullable=False, default="{}")
+    updated_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_fsm_states_updated_at", "updated_at"),
+    )
@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import logging
+import time
+from dataclasses import dataclass
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from bot.config import (
+    SQLITE_JOURNAL_MODE,
+    SQLITE_BUSY_TIMEOUT_MS,
+    SQLITE_SYNCHRONOUS,
+    SQLITE_CACHE_SIZE_KB,
+    SQLITE_MMAP_SIZE,
+    SQLITE_LOCK_WAIT_WARN_MS,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+# Операторы, которым нужна блокировка записи SQLite
+_WRITE_PREFIXES = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+
+
+@dataclass
+class LockWaitStats:
+    """
+    Статистика времени выполнения записей.
+
+    В SQLite блокировка записи берётся на первом изменяющем запросе
+    транзакции, поэтому его длительность включает ожидание в busy_timeout.
+    """
+
+    writes: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+    slow_writes: int = 0
+    lock_errors: int = 0
+
+
+_stats = LockWaitStats()
+
+
+def get_lock_wait_stats() -> LockWaitStats:
+    return _stats
+
+
+def _apply_pragmas(dbapi_connection, connection_record) -> None:
+    """Настраивает каждое новое соединение пула."""
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        # Отрицательное значение cache_size задаётся в килобайтах
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    finally:
+        cursor.close()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if statement.lstrip()[:7].upper().startswith(_WRITE_PREFIXES):
+        conn.info.setdefault("write_started_at", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("write_started_at")
+    if not started or not statement.lstrip()[:7].upper().startswith(_WRITE_PREFIXES):
+        return
+
+    elapsed_ms = (time.perf_counter() - started.pop()) * 1000
+    _stats.writes += 1
+    _stats.total_ms += elapsed_ms
+    _stats.max_ms = max(_stats.max_ms, elapsed_ms)
+
+    if elapsed_ms >= SQLITE_LOCK_WAIT_WARN_MS:
+        _stats.slow_writes += 1
+        logger.warning(
+            "SQLite: запись ждала блокировку %.0f мс: %s",
+            elapsed_ms,
+            statement.split("\n", 1)[0][:120],
+        )
+
+
+def _handle_error(exception_context) -> None:
+    conn = exception_context.connection
+    statement = exception_context.statement or ""
+    if conn is None:
+        return
+    started = conn.info.get("write_started_at")
+    if started and statement.lstrip()[:7].upper().startswith(_WRITE_PREFIXES):
+        started.pop()
+    if "database is locked" in str(exception_context.original_exception):
+        _stats.lock_errors += 1
+
+
+def install_sqlite_tuning(engine: Engine) -> None:
+    """
+    Подключает настройку соединений и учёт ожидания блокировок к движку.
+
+    Для AsyncEngine нужно передавать async_engine.sync_engine.
+    """
+    event.listen(engine, "connect", _apply_pragmas)
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
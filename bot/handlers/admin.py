@@ -2,9 +2,30 @@ from aiogram import Router
 from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command
 from bot.config import ADMIN_IDS
-from bot.db.database import SessionLocal
+from sqlalchemy import select, func, update
+from bot.db.database import AsyncSessionLocal
 from bot.db.models import User, PickupRequest, Child
-from bot.keyboards.admin import approve_user_keyboard
+from bot.db.sqlite_tuning import get_lock_wait_stats
+from bot.keyboards.admin import approve_user_keyboard, guard_group_keyboard
+from bot.services import (
+    identity_cache,
+    roster_cache,
+    invalidate_identity,
+    enqueue_notification,
+    notify_outbox,
+    get_outbox_stats,
+    cancel_announce,
+    discard_announcement,
+    announce_queue,
+    get_expiry_stats,
+    guard_messages,
+    render_pickup_message,
+    pickup_board,
+    expiry_cutoff,
+    handled_callbacks,
+    update_lanes,
+    user_serial,
+)
 from datetime import datetime, date
 
 router = Router()
@@ -20,11 +41,11 @@ async def approve_list(message: Message):
         await message.answer("У вас нет доступа.")
         return
 
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
-        users = session.query(User).filter(
+        users = (await session.scalars(select(User).where(
             User.is_verified == False
-        ).all()
+        ))).all()
 
         if not users:
             await message.answer("Нет заявок на подтверждение.")
@@ -37,7 +58,64 @@ async def approve_list(message: Message):
                 reply_markup=approve_user_keyboard(user.id)
             )
     finally:
-        session.close()
+        await session.close()
+
+@router.message(Command("dbstats"))
+async def db_stats(message: Message):
+    """Статистика ожидания блокировок SQLite"""
+    if not is_admin(message.from_user.id):
+        await message.answer("У вас нет доступа.")
+        return
+
+    stats = get_lock_wait_stats()
+    avg_ms = stats.total_ms / stats.writes if stats.writes else 0.0
+    cache = identity_cache.stats()
+    roster = roster_cache.stats()
+    outbox = get_outbox_stats()
+    pa = announce_queue.metrics()
+    expiry = get_expiry_stats()
+    lanes = update_lanes.metrics()
+    serial = user_serial.metrics()
+    await message.answer(
+        "🗄 SQLite: ожидание блокировок записи\n"
+        f"Записей: {stats.writes}\n"
+        f"Среднее: {avg_ms:.1f} мс\n"
+        f"Максимум: {stats.max_ms:.1f} мс\n"
+        f"Медленных: {stats.slow_writes}\n"
+        f"Ошибок «database is locked»: {stats.lock_errors}\n\n"
+        "👤 Кэш пользователей\n"
+        f"Попаданий: {cache['hits']}, промахов: {cache['misses']} "
+        f"({cache['hit_rate'] * 100:.1f}%)\n"
+        f"Записей: {cache['size']}\n\n"
+        "🏫 Кэш составов классов\n"
+        f"Попаданий: {roster['hits']}, промахов: {roster['misses']} "
+        f"({roster['hit_rate'] * 100:.1f}%)\n"
+        f"Классов: {roster['size']}\n\n"
+        "📬 Outbox уведомлений\n"
+        f"Отправлено: {outbox.sent}, повторов: {outbox.retried}, "
+        f"не доставлено: {outbox.dead}\n\n"
+        "🔊 Очередь озвучки\n"
+        f"В очереди: {pa['depth']}, озвучено: {pa['played']}, ошибок: {pa['failed']}\n"
+        f"Объединено: {pa['coalesced']}, отменено: {pa['dropped']}\n"
+        f"Ожидание: среднее {pa['wait_avg_ms']:.0f} мс, максимум {pa['wait_max_ms']:.0f} мс\n\n"
+        "⌛ Просроченные заявки\n"
+        f"Проходов: {expiry.runs}, просрочено всего: {expiry.expired_total} "
+        f"(за последний: {expiry.last_expired})\n\n"
+        "📋 Доска выдачи\n"
+        f"Заявок: {len(pickup_board)}, правок: {pickup_board.edits}\n\n"
+        "🚦 Полосы выполнения\n"
+        + "\n".join(
+            f"{name}: выполнено {lane['processed']}, сейчас {lane['active']}/{lane['waiting']} "
+            f"(работают/ждут), ожидание макс. {lane['wait_max_ms']:.0f} мс, сброшено {lane['shed']}"
+            for name, lane in lanes.items()
+        )
+        + "\n\n👥 Очереди пользователей\n"
+        f"Пользователей в очереди: {serial['users']}, апдейтов: {serial['queued']}, "
+        f"самая длинная: {serial['longest']} (за всё время: {serial['longest_ever']})\n"
+        f"Выполняется: {serial['active']}/{serial['workers']}, "
+        f"отброшено повторных нажатий: {serial['duplicates']}"
+    )
+
 
 @router.callback_query(lambda c: c.data.startswith("approve_user:"))
 async def approve_user(callback: CallbackQuery):
@@ -47,33 +125,32 @@ async def approve_user(callback: CallbackQuery):
 
     user_id = int(callback.data.split(":")[1])
 
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
-        user = session.query(User).filter(User.id == user_id).first()
+        user = await session.scalar(select(User).where(User.id == user_id))
 
         if not user:
             await callback.answer("Пользователь не найден", show_alert=True)
             return
 
         user.is_verified = True
-        session.commit()
+        # уведомляем родителя (через outbox, в той же транзакции)
+        enqueue_notification(
+            session,
+            user.telegram_id,
+            "Ваша регистрация подтверждена. Теперь вы можете пользоваться ботом."
+        )
+        await session.commit()
+        notify_outbox()
+        invalidate_identity(user.telegram_id)
 
         await callback.message.edit_text(
             f"Пользователь {user.full_name} подтверждён."
         )
 
-        # уведомляем родителя
-        try:
-            await callback.bot.send_message(
-                user.telegram_id,
-                "Ваша регистрация подтверждена. Теперь вы можете пользоваться ботом."
-            )
-        except:
-            pass
-
         await callback.answer("Готово")
     finally:
-        session.close()
+        await session.close()
 
 
 @router.callback_query(lambda c: c.data.startswith("pickup_done:"))
@@ -83,53 +160,133 @@ async def pickup_done(callback: CallbackQuery):
         await callback.answer("Нет доступа", show_alert=True)
         return
 
+    # Повторная доставка того же нажатия — уже обработано, только убираем «часики»
+    if not handled_callbacks.first_seen(callback.id):
+        await callback.answer()
+        return
+
     pickup_id = int(callback.data.split(":")[1])
 
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
-        pickup = session.query(PickupRequest).filter(PickupRequest.id == pickup_id).first()
+        pickup = await session.scalar(select(PickupRequest).where(PickupRequest.id == pickup_id))
         if not pickup:
+            pickup_board.remove(pickup_id)
             await callback.answer("Заявка не найдена.", show_alert=True)
             return
 
         # Если уже отмечено как переданный — ничего не делаем
         if pickup.status == "HANDED_OVER":
+            pickup_board.remove(pickup_id)
             await callback.answer("Ученик уже отмечен как переданный.")
             return
 
-        # Получаем данные о родителе и ребёнке
-        parent = session.query(User).filter(User.id == pickup.parent_id).first()
-        child = session.query(Child).filter(Child.id == pickup.child_id).first()
-
-        if not parent or not child:
-            await callback.answer("Ошибка: данные не найдены.", show_alert=True)
+        if not await _hand_over(callback, session, [pickup]):
             return
+    except Exception:
+        # Передача не состоялась — повторная доставка нажатия должна её выполнить
+        handled_callbacks.forget(callback.id)
+        raise
+    finally:
+        await session.close()
 
-        now = datetime.utcnow()
-        pickup.status = "HANDED_OVER"
-        pickup.updated_at = now
-        pickup.handed_over_at = now
-        pickup.handed_over_by = callback.from_user.id
-        session.commit()
-
-        # Формируем обновлённое сообщение с сохранением всей информации
-        new_text = (
-            "📌 Выдача ученика\n"
-            "🟢 РЕБЕНОК ПЕРЕДАН\n"
-            f"Родитель: {parent.full_name}\n"
-            f"Ученик: {child.full_name} ({child.class_name})\n"
-            f"Ожидался через: {pickup.arrival_minutes} мин."
-        )
+    await callback.answer("Готово.")
+
+
+@router.callback_query(lambda c: c.data.startswith("pickup_done_all:"))
+async def pickup_done_all(callback: CallbackQuery):
+    """Кнопка «Переданы все» в общем сообщении на нескольких детей"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа", show_alert=True)
+        return
+
+    if not handled_callbacks.first_seen(callback.id):
+        # Повторная доставка того же нажатия: только убираем «часики»
+        await callback.answer()
+        return
+
+    parent_id = int(callback.data.split(":")[1])
 
-        # Обновляем сообщение, убирая клавиатуру
-        await callback.message.edit_text(new_text, reply_markup=None)
+    session = AsyncSessionLocal()
+    try:
+        # Только дети этого сообщения: у родителя могут быть заявки
+        # и в других сообщениях охраны
+        pickups = (await session.scalars(
+            select(PickupRequest).where(
+                PickupRequest.parent_id == parent_id,
+                PickupRequest.channel_message_id == callback.message.message_id,
+                PickupRequest.status.in_(["PENDING", "ANNOUNCED"]),
+                PickupRequest.created_at >= expiry_cutoff(),
+            )
+        )).all()
+        if not pickups:
+            await callback.answer("Ученики уже отмечены как переданные.")
+            return
+
+        if not await _hand_over(callback, session, pickups):
+            return
+    except Exception:
+        handled_callbacks.forget(callback.id)
+        raise
     finally:
-        session.close()
+        await session.close()
 
-    # Отправляем уведомление родителю
+    await callback.answer("Готово.")
+
+
+async def _hand_over(callback: CallbackQuery, session, pickups) -> bool:
+    """
+    Отмечает заявки одного родителя переданными и обновляет сообщение охраны.
+
+    Передача — условный UPDATE (compare-and-set по статусу): из нескольких
+    одновременных нажатий заявку передаёт только одно, и только оно
+    уведомляет родителя. Передача и уведомление фиксируются одной транзакцией.
+    Возвращает False, если callback уже отвечен.
+    """
+    # Получаем данные о родителе и детях
+    parent = await session.scalar(select(User).where(User.id == pickups[0].parent_id))
+    children = {
+        child.id: child
+        for child in (await session.scalars(
+            select(Child).where(Child.id.in_([p.child_id for p in pickups]))
+        )).all()
+    }
+
+    if not parent or len(children) < len({p.child_id for p in pickups}):
+        await callback.answer("Ошибка: данные не найдены.", show_alert=True)
+        return False
+
+    now = datetime.utcnow()
+    handed_over = []
+    for pickup in pickups:
+        result = await session.execute(
+            update(PickupRequest)
+            .where(
+                PickupRequest.id == pickup.id,
+                PickupRequest.status != "HANDED_OVER",
+            )
+            .values(
+                status="HANDED_OVER",
+                updated_at=now,
+                handed_over_at=now,
+                handed_over_by=callback.from_user.id,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 1:
+            handed_over.append(pickup)
+
+    if not handed_over:
+        # Другой охранник успел раньше; транзакция пустая — просто закрываем
+        await session.commit()
+        pickup_board.remove(*[pickup.id for pickup in pickups])
+        await callback.answer("Ученик уже отмечен как переданный.")
+        return False
+    pickups = handed_over
+
+    # Уведомление родителю
     farewell = ""
-    today = date.today()
-    weekday = today.weekday()  # 0 = Пн, 6 = Вс
+    weekday = date.today().weekday()  # 0 = Пн, 6 = Вс
 
     if weekday <= 3:  # Пн–Чт
         farewell = "Всего доброго! Ждём вас завтра."
@@ -139,29 +296,8 @@ async def pickup_done(callback: CallbackQuery):
         # Сб–Вс: отправляем только основное сообщение без фразы про завтра
         farewell = ""
 
-    # Проверяем, есть ли у родителя несколько детей,
-    # для которых сегодня оформлены заявки на выдачу.
-    siblings_requests_today = 1
-    try:
-        session = SessionLocal()
-        try:
-            today_start = datetime.combine(today, datetime.min.time())
-            today_end = datetime.combine(today, datetime.max.time())
-            siblings_requests_today = (
-                session.query(PickupRequest)
-                .filter(
-                    PickupRequest.parent_id == parent.id,
-                    PickupRequest.created_at >= today_start,
-                    PickupRequest.created_at <= today_end,
-                )
-                .count()
-            )
-        finally:
-            session.close()
-    except Exception:
-        siblings_requests_today = 1
-
-    if siblings_requests_today > 1:
+    # Число детей известно из самой передачи — отдельный запрос не нужен
+    if len(pickups) > 1:
         base_text = "Ваши дети благополучно переданы. Спасибо!"
     else:
         base_text = "Ваш ребёнок благополучно передан. Спасибо!"
@@ -171,12 +307,59 @@ async def pickup_done(callback: CallbackQuery):
     else:
         text_to_parent = base_text
 
-    try:
-        await callback.bot.send_message(parent.telegram_id, text_to_parent)
-    except Exception:
-        # Если не смогли уведомить родителя — не падаем.
-        pass
-
-    await callback.answer("Готово.")
-
+    enqueue_notification(session, parent.telegram_id, text_to_parent)
+    await session.commit()
+    notify_outbox()
+    for pickup in pickups:
+        cancel_announce(pickup.id)
+        discard_announcement(pickup.id)
+        pickup_board.remove(pickup.id)
+
+    # Кнопка нажата на доске выдачи — доска перерисуется сама
+    if pickup_board.is_board_message(callback.message.message_id):
+        names = ", ".join(children[p.child_id].full_name for p in pickups)
+        await callback.answer(f"Передан: {names}")
+        return False
+
+    # Все заявки общего сообщения: часть детей может быть ещё не передана.
+    # populate_existing — статусы в сессии устарели после UPDATE выше.
+    group = (await session.execute(
+        select(PickupRequest, Child)
+        .join(Child, Child.id == PickupRequest.child_id)
+        .where(PickupRequest.channel_message_id == callback.message.message_id)
+        .order_by(Child.id)
+        .execution_options(populate_existing=True)
+    )).all()
+    if not group:
+        group = [(p, children[p.child_id]) for p in pickups]
+    handed_ids = {p.id for p in pickups}
+
+    def is_handed_over(p) -> bool:
+        return p.id in handed_ids or p.status == "HANDED_OVER"
+
+    waiting = [(p.id, child.full_name) for p, child in group if not is_handed_over(p) and p.status != "EXPIRED"]
+    new_text = render_pickup_message(
+        parent.full_name,
+        group[0][0].arrival_minutes,
+        [(child.full_name, child.class_name, is_handed_over(p)) for p, child in group],
+    )
+
+    # Обновляем сообщение (у оставшихся детей кнопки сохраняются); отложенная
+    # правка «ожидает передачи» не должна вернуть кнопку обратно
+    guard_messages.forget(callback.message.message_id)
+    await callback.message.edit_text(
+        new_text,
+        reply_markup=guard_group_keyboard(parent.id, waiting) if waiting else None,
+    )
+    return True
+
+
+@router.callback_query(lambda c: c.data.startswith("board_page:"))
+async def pickup_board_page(callback: CallbackQuery):
+    """Листание закреплённой доски выдачи"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа", show_alert=True)
+        return
 
+    pickup_board.set_page(int(callback.data.split(":")[1]))
+    await callback.answer()
@@ -3,10 +3,21 @@ from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.filters import Command
 
-from bot.db.database import SessionLocal
+from sqlalchemy import select, delete, func
+
+from bot.db.database import AsyncSessionLocal
 from bot.db.models import User, Child, PickupRequest, Teacher, Grade, Attendance, Comment, Homework
 from bot.config import ADMIN_IDS
 from bot.states.admin_manage import AdminManageParentState
+from bot.services import (
+    invalidate_identity,
+    invalidate_roster,
+    cancel_announce,
+    discard_announcement,
+    pickup_board,
+    enqueue_notification,
+    notify_outbox,
+)
 
 from bot.keyboards.teacher import teacher_main_keyboard
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
@@ -45,23 +56,23 @@ async def admin_find_parent(message: Message, state: FSMContext):
         await message.answer("Пустой запрос. Отправьте телефон или Telegram ID.")
         return
 
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
         parent = None
 
         # По Telegram ID
         if q.isdigit():
-            parent = session.query(User).filter(
+            parent = await session.scalar(select(User).where(
                 User.telegram_id == int(q),
                 User.role == "parent"
-            ).first()
+            ))
 
         # По телефону
         if not parent:
-            parent = session.query(User).filter(
+            parent = await session.scalar(select(User).where(
                 User.phone == q,
                 User.role == "parent"
-            ).first()
+            ).limit(1))
 
         if not parent:
             await message.answer("Родитель не найден. Проверьте телефон/Telegram ID.")
@@ -72,7 +83,7 @@ async def admin_find_parent(message: Message, state: FSMContext):
         status = "ЗАБЛОКИРОВАН" if bool(getattr(parent, "is_blocked", False)) else "АКТИВЕН"
         
         # Подсчитываем количество детей
-        children_count = session.query(Child).filter(Child.parent_id == parent.id).count()
+        children_count = await session.scalar(select(func.count()).select_from(Child).where(Child.parent_id == parent.id))
 
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [
@@ -100,7 +111,7 @@ async def admin_find_parent(message: Message, state: FSMContext):
             reply_markup=keyboard
         )
     finally:
-        session.close()
+        await session.close()
 
 
 @router.message(Command("block"))
@@ -113,18 +124,19 @@ async def admin_block_parent(message: Message, state: FSMContext):
         await message.answer("Сначала найдите родителя через /admin.")
         return
 
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
-        parent = session.query(User).filter(User.id == parent_id, User.role == "parent").first()
+        parent = await session.scalar(select(User).where(User.id == parent_id, User.role == "parent"))
         if not parent:
             await message.answer("Родитель не найден.")
             return
 
         parent.is_blocked = True
-        session.commit()
+        await session.commit()
+        invalidate_identity(parent.telegram_id)
         await message.answer("Готово: родитель заблокирован.")
     finally:
-        session.close()
+        await session.close()
 
 
 @router.message(Command("unblock"))
@@ -137,18 +149,19 @@ async def admin_unblock_parent(message: Message, state: FSMContext):
         await message.answer("Сначала найдите родителя через /admin.")
         return
 
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
-        parent = session.query(User).filter(User.id == parent_id, User.role == "parent").first()
+        parent = await session.scalar(select(User).where(User.id == parent_id, User.role == "parent"))
         if not parent:
             await message.answer("Родитель не найден.")
             return
 
         parent.is_blocked = False
-        session.commit()
+        await session.commit()
+        invalidate_identity(parent.telegram_id)
         await message.answer("Готово: родитель разблокирован.")
     finally:
-        session.close()
+        await session.close()
 
 
 @router.message(Command("delete"))
@@ -180,9 +193,9 @@ async def admin_delete_parent_callback(callback: CallbackQuery):
 
 async def delete_parent_by_id(message_or_callback, parent_id, callback=None, bot=None):
     """Функция удаления родителя и всех связанных данных"""
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
-        parent = session.query(User).filter(User.id == parent_id, User.role == "parent").first()
+        parent = await session.scalar(select(User).where(User.id == parent_id, User.role == "parent"))
         if not parent:
             text = "Родитель не найден."
             if callback:
@@ -195,26 +208,35 @@ async def delete_parent_by_id(message_or_callback, parent_id, callback=None, bot
         parent_tg_id = parent.telegram_id
 
         # Получаем ID всех детей родителя
-        children = session.query(Child).filter(Child.parent_id == parent.id).all()
+        children = (await session.scalars(select(Child).where(Child.parent_id == parent.id))).all()
         child_ids = [child.id for child in children]
 
         # Удаляем все связанные данные
         if child_ids:
             # Удаляем оценки детей
-            session.query(Grade).filter(Grade.child_id.in_(child_ids)).delete()
+            await session.execute(delete(Grade).where(Grade.child_id.in_(child_ids)))
             # Удаляем посещаемость детей
-            session.query(Attendance).filter(Attendance.child_id.in_(child_ids)).delete()
+            await session.execute(delete(Attendance).where(Attendance.child_id.in_(child_ids)))
             # Удаляем комментарии к детям
-            session.query(Comment).filter(Comment.child_id.in_(child_ids)).delete()
+            await session.execute(delete(Comment).where(Comment.child_id.in_(child_ids)))
 
-        # Удаляем заявки на вывоз
-        session.query(PickupRequest).filter(PickupRequest.parent_id == parent.id).delete()
+        # Удаляем заявки на вывоз (id нужны, чтобы убрать их из озвучки и доски)
+        pickup_ids = (
+            await session.scalars(select(PickupRequest.id).where(PickupRequest.parent_id == parent.id))
+        ).all()
+        await session.execute(delete(PickupRequest).where(PickupRequest.parent_id == parent.id))
         # Удаляем детей
-        session.query(Child).filter(Child.parent_id == parent.id).delete()
+        await session.execute(delete(Child).where(Child.parent_id == parent.id))
         # Удаляем самого родителя
-        session.query(User).filter(User.id == parent.id).delete()
+        await session.execute(delete(User).where(User.id == parent.id))
         
-        session.commit()
+        await session.commit()
+        invalidate_identity(parent_tg_id)
+        invalidate_roster(*{child.class_name for child in children})
+        for pickup_id in pickup_ids:
+            cancel_announce(pickup_id)
+            discard_announcement(pickup_id)
+        pickup_board.remove(*pickup_ids)
 
         # Уведомляем родителя (если возможно)
         if bot:
@@ -232,7 +254,7 @@ async def delete_parent_by_id(message_or_callback, parent_id, callback=None, bot
         else:
             await message_or_callback.answer(text)
     finally:
-        session.close()
+        await session.close()
 
 
 @router.callback_query(F.data.startswith("admin_toggle_block:"))
@@ -244,15 +266,16 @@ async def admin_toggle_block(callback: CallbackQuery, state: FSMContext):
 
     parent_id = int(callback.data.split(":")[1])
     
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
-        parent = session.query(User).filter(User.id == parent_id, User.role == "parent").first()
+        parent = await session.scalar(select(User).where(User.id == parent_id, User.role == "parent"))
         if not parent:
             await callback.answer("Родитель не найден", show_alert=True)
             return
 
         parent.is_blocked = not parent.is_blocked
-        session.commit()
+        await session.commit()
+        invalidate_identity(parent.telegram_id)
 
         status_text = "заблокирован" if parent.is_blocked else "разблокирован"
         
@@ -270,7 +293,7 @@ async def admin_toggle_block(callback: CallbackQuery, state: FSMContext):
         # Обновляем сообщение с новыми кнопками
         await state.update_data(parent_id=parent.id)
         status = "ЗАБЛОКИРОВАН" if parent.is_blocked else "АКТИВЕН"
-        children_count = session.query(Child).filter(Child.parent_id == parent.id).count()
+        children_count = await session.scalar(select(func.count()).select_from(Child).where(Child.parent_id == parent.id))
 
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [
@@ -298,7 +321,7 @@ async def admin_toggle_block(callback: CallbackQuery, state: FSMContext):
             reply_markup=keyboard
         )
     finally:
-        session.close()
+        await session.close()
 
 
 # -----------------------------------
@@ -313,10 +336,10 @@ async def teacher_verify(callback: CallbackQuery):
 
     user_id = int(callback.data.split(":")[1])
 
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
-        user = session.query(User).filter(User.id == user_id).first()
-        teacher = session.query(Teacher).filter(Teacher.user_id == user_id).first()
+        user = await session.scalar(select(User).where(User.id == user_id))
+        teacher = await session.scalar(select(Teacher).where(Teacher.user_id == user_id))
 
         if not user or not teacher:
             await callback.answer("Пользователь/учитель не найден", show_alert=True)
@@ -324,18 +347,20 @@ async def teacher_verify(callback: CallbackQuery):
 
         teacher.status = "approved"
         teacher.is_verified = True  # для обратной совместимости
-        session.commit()
-
-        teacher_tg = user.telegram_id
+        # уведомляем учителя (через outbox, в той же транзакции)
+        enqueue_notification(
+            session,
+            user.telegram_id,
+            "✅ Ваша учётная запись учителя подтверждена.\nМеню учителя:",
+            reply_markup=teacher_main_keyboard(),
+        )
+        await session.commit()
+        notify_outbox()
+        invalidate_identity(user.telegram_id)
     finally:
-        session.close()
+        await session.close()
 
     await callback.message.edit_text("✅ Учитель подтверждён.")
-    await callback.bot.send_message(
-        teacher_tg,
-        "✅ Ваша учётная запись учителя подтверждена.\nМеню учителя:",
-        reply_markup=teacher_main_keyboard()
-    )
     await callback.answer()
 
     
@@ -349,21 +374,23 @@ async def teacher_reject(callback: CallbackQuery):
 
     user_id = int(callback.data.split(":")[1])
 
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
-        user = session.query(User).filter(User.id == user_id).first()
-        teacher = session.query(Teacher).filter(Teacher.user_id == user_id).first()
+        user = await session.scalar(select(User).where(User.id == user_id))
+        teacher = await session.scalar(select(Teacher).where(Teacher.user_id == user_id))
 
         if teacher:
-            session.delete(teacher)
+            await session.delete(teacher)
 
         # Возвращаем роль назад в parent (или оставь как есть — на твой выбор)
         if user:
             user.role = "parent"
 
-        session.commit()
+        await session.commit()
+        if user:
+            invalidate_identity(user.telegram_id)
     finally:
-        session.close()
+        await session.close()
 
     await callback.message.edit_text("❌ Заявка учителя отклонена.")
     await callback.answer()
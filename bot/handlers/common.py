@@ -1,14 +1,17 @@
-from aiogram import Router, F
+from aiogram import Router
 from aiogram.types import Message
 from aiogram.filters import CommandStart, Command
 from aiogram.fsm.context import FSMContext
-from bot.db.database import SessionLocal
-from bot.db.models import User, Teacher
+from sqlalchemy import select
+from bot.db.database import AsyncSessionLocal
+from bot.db.models import User
 from bot.config import ADMIN_IDS
 from bot.keyboards.common import role_selection_keyboard
 from bot.keyboards.parent import parent_main_keyboard
 from bot.keyboards.teacher import teacher_main_keyboard
+from bot.services import Identity, invalidate_identity
 import logging
+from bot.handlers.text_commands import text_commands
 
 router = Router()
 
@@ -21,8 +24,8 @@ def is_admin_user(user_id: int) -> bool:
 # Обработчики выбора роли должны быть ПЕРЕД обработчиком /start
 # чтобы они обрабатывались первыми и могли очистить состояние
 
-@router.message(F.text.in_(["👨‍🏫 Я учитель", "Я учитель"]))
-async def teacher_role_handler(message: Message, state: FSMContext):
+@text_commands.handler("👨‍🏫 Я учитель", "Я учитель")
+async def teacher_role_handler(message: Message, state: FSMContext, actor: Identity | None):
     """Обработчик выбора роли учителя"""
     from bot.states.teacher_registration import TeacherRegistrationState
     from bot.states.registration import RegistrationState
@@ -35,115 +38,97 @@ async def teacher_role_handler(message: Message, state: FSMContext):
     
     logging.info(f"Teacher role handler called for user {message.from_user.id}, text: '{message.text}'")
     
-    session = SessionLocal()
-    try:
-        user = session.query(User).filter(
-            User.telegram_id == message.from_user.id
-        ).first()
-        
-        logging.info(f"User found: {user is not None}, is_verified: {user.is_verified if user else None}")
-
-        # Если пользователя нет - сначала нужно зарегистрироваться как родитель
-        if not user:
-            await message.answer(
-                "👨‍🏫 Вы выбрали режим учителя.\n\n"
-                "Сначала необходимо зарегистрироваться как родитель.\n"
-                "Введите ваше ФИО:"
-            )
-            await state.set_state(RegistrationState.waiting_full_name)
-            return
-
-        if user.is_blocked:
-            await message.answer("❌ Ваш аккаунт заблокирован.")
-            return
+    logging.info(f"User found: {actor is not None}, is_verified: {actor.is_verified if actor else None}")
 
-        # Проверяем, есть ли учитель в таблице teachers
-        teacher = session.query(Teacher).filter(
-            Teacher.user_id == user.id
-        ).first()
+    # Если пользователя нет - сначала нужно зарегистрироваться как родитель
+    if not actor:
+        await message.answer(
+            "👨‍🏫 Вы выбрали режим учителя.\n\n"
+            "Сначала необходимо зарегистрироваться как родитель.\n"
+            "Введите ваше ФИО:"
+        )
+        await state.set_state(RegistrationState.waiting_full_name)
+        return
 
-        if not teacher:
-            # Нет учителя — нужно зарегистрироваться как учитель
-            # Разрешаем регистрацию учителя даже если родитель не подтвержден
-            await message.answer(
-                "👨‍🏫 Вы выбрали режим учителя.\n\n"
-                "Для работы в этом режиме необходимо пройти регистрацию учителя.\n"
-                "Введите ваше ФИО:"
-            )
-            await state.set_state(TeacherRegistrationState.waiting_full_name)
-            return
+    if actor.is_blocked:
+        await message.answer("❌ Ваш аккаунт заблокирован.")
+        return
 
-        # Проверяем статус учителя
-        if teacher.status != "approved" and not teacher.is_verified:
-            await message.answer(
-                "⏳ Ваша заявка учителя ожидает подтверждения администратора."
-            )
-            return
+    # Проверяем, есть ли учитель в таблице teachers
+    teacher = actor.teacher
 
-        # Учитель подтверждён — показываем меню
-        # Проверяем, подтвержден ли родитель (для доступа к функциям)
-        if not user.is_verified:
-            await message.answer(
-                "⏳ Ваша регистрация родителя ожидает подтверждения администратора.\n"
-                "После подтверждения вы сможете использовать функции учителя."
-            )
-            return
+    if not teacher:
+        # Нет учителя — нужно зарегистрироваться как учитель
+        # Разрешаем регистрацию учителя даже если родитель не подтвержден
+        await message.answer(
+            "👨‍🏫 Вы выбрали режим учителя.\n\n"
+            "Для работы в этом режиме необходимо пройти регистрацию учителя.\n"
+            "Введите ваше ФИО:"
+        )
+        await state.set_state(TeacherRegistrationState.waiting_full_name)
+        return
 
+    # Проверяем статус учителя
+    if not teacher.is_approved:
         await message.answer(
-            f"👨‍🏫 Режим учителя\n\n"
-            f"Здравствуйте, {user.full_name}!\n"
-            "Выберите действие:",
-            reply_markup=teacher_main_keyboard()
+            "⏳ Ваша заявка учителя ожидает подтверждения администратора."
         )
-    finally:
-        session.close()
+        return
 
+    # Учитель подтверждён — показываем меню
+    # Проверяем, подтвержден ли родитель (для доступа к функциям)
+    if not actor.is_verified:
+        await message.answer(
+            "⏳ Ваша регистрация родителя ожидает подтверждения администратора.\n"
+            "После подтверждения вы сможете использовать функции учителя."
+        )
+        return
 
-@router.message(CommandStart())
-async def start_handler(message: Message, state: FSMContext):
-    session = SessionLocal()
-    try:
-        user = session.query(User).filter(
-            User.telegram_id == message.from_user.id
-        ).first()
+    await message.answer(
+        f"👨‍🏫 Режим учителя\n\n"
+        f"Здравствуйте, {actor.full_name}!\n"
+        "Выберите действие:",
+        reply_markup=teacher_main_keyboard()
+    )
 
-        # Новый пользователь — показываем выбор роли
-        if not user:
-            await message.answer(
-                "👋 Добро пожаловать в школьный бот!\n\n"
-                "Выберите вашу роль:",
-                reply_markup=role_selection_keyboard(
-                    is_admin=is_admin_user(message.from_user.id)
-                )
-            )
-            return
 
-        # Заблокированный пользователь
-        if user.is_blocked:
-            await message.answer(
-                "❌ Ваш аккаунт заблокирован. Обратитесь к администратору."
+@router.message(CommandStart())
+async def start_handler(message: Message, state: FSMContext, actor: Identity | None):
+    # Новый пользователь — показываем выбор роли
+    if not actor:
+        await message.answer(
+            "👋 Добро пожаловать в школьный бот!\n\n"
+            "Выберите вашу роль:",
+            reply_markup=role_selection_keyboard(
+                is_admin=is_admin_user(message.from_user.id)
             )
-            return
+        )
+        return
 
-        # Есть, но не подтверждён
-        if not user.is_verified:
-            await message.answer(
-                "⏳ Ваша регистрация ожидает подтверждения администратора."
-            )
-            return
+    # Заблокированный пользователь
+    if actor.is_blocked:
+        await message.answer(
+            "❌ Ваш аккаунт заблокирован. Обратитесь к администратору."
+        )
+        return
 
-        # ✅ Подтверждённый пользователь — показываем выбор роли
-        admin_access = is_admin_user(message.from_user.id)
+    # Есть, но не подтверждён
+    if not actor.is_verified:
         await message.answer(
-            f"👋 Здравствуйте, {user.full_name}!\n\n"
-            "Выберите режим работы:",
-            reply_markup=role_selection_keyboard(is_admin=admin_access)
+            "⏳ Ваша регистрация ожидает подтверждения администратора."
         )
-    finally:
-        session.close()
+        return
+
+    # ✅ Подтверждённый пользователь — показываем выбор роли
+    admin_access = is_admin_user(message.from_user.id)
+    await message.answer(
+        f"👋 Здравствуйте, {actor.full_name}!\n\n"
+        "Выберите режим работы:",
+        reply_markup=role_selection_keyboard(is_admin=admin_access)
+    )
 
 
-@router.message(F.text == "👨‍👩‍👧 Я родитель")
+@text_commands.handler("👨‍👩‍👧 Я родитель")
 async def parent_role_handler(message: Message, state: FSMContext):
     """Обработчик выбора роли родителя"""
     from bot.states.registration import RegistrationState
@@ -153,11 +138,11 @@ async def parent_role_handler(message: Message, state: FSMContext):
     if current_state:
         await state.clear()
     
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
-        user = session.query(User).filter(
+        user = await session.scalar(select(User).where(
             User.telegram_id == message.from_user.id
-        ).first()
+        ))
 
         # Если пользователя нет - начинаем регистрацию
         if not user:
@@ -179,7 +164,8 @@ async def parent_role_handler(message: Message, state: FSMContext):
 
         # Переключаем роль на parent
         user.role = "parent"
-        session.commit()
+        await session.commit()
+        invalidate_identity(user.telegram_id)
 
         await message.answer(
             "👨‍👩‍👧 Режим родителя\n\n"
@@ -187,10 +173,10 @@ async def parent_role_handler(message: Message, state: FSMContext):
             reply_markup=parent_main_keyboard()
         )
     finally:
-        session.close()
+        await session.close()
 
 
-@router.message(F.text == "⚙️ Я администратор")
+@text_commands.handler("⚙️ Я администратор")
 async def admin_role_handler(message: Message, state: FSMContext):
     """Обработчик выбора роли администратора"""
     from bot.states.registration import RegistrationState
@@ -199,11 +185,11 @@ async def admin_role_handler(message: Message, state: FSMContext):
         await message.answer("❌ У вас нет доступа к админ-панели.")
         return
 
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
-        user = session.query(User).filter(
+        user = await session.scalar(select(User).where(
             User.telegram_id == message.from_user.id
-        ).first()
+        ))
 
         # Если пользователя нет - начинаем регистрацию
         if not user:
@@ -216,7 +202,8 @@ async def admin_role_handler(message: Message, state: FSMContext):
             return
 
         user.role = "admin"
-        session.commit()
+        await session.commit()
+        invalidate_identity(user.telegram_id)
 
         await message.answer(
             "⚙️ Режим администратора\n\n"
@@ -226,7 +213,7 @@ async def admin_role_handler(message: Message, state: FSMContext):
             "/teacher_approve - подтверждение учителей"
         )
     finally:
-        session.close()
+        await session.close()
 
 
 @router.message(Command("cancel"))
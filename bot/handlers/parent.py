@@ -11,22 +11,35 @@ from bot.states.registration import (
     UpdateChildNameState
 )
 
-from bot.db.database import SessionLocal
+from bot.db.database import AsyncSessionLocal
 from bot.db.models import User, Child, PickupRequest, Grade, Attendance, Homework, Comment, Subject
 from datetime import date, datetime, timedelta
-from sqlalchemy import func
+from sqlalchemy import select, func, case, update, Float
 
 from bot.keyboards.parent import (
     parent_main_keyboard,
     children_inline_keyboard,
+    children_multiselect_keyboard,
     time_inline_keyboard,
     children_edit_keyboard
 )
 
-from bot.keyboards.admin import guard_actions_keyboard
-from bot.config import GUARD_CHANNEL_ID
-from bot.services import is_auto_voice_active, PAAdapter
+from bot.keyboards.admin import guard_actions_keyboard, guard_group_keyboard
+from bot.config import GUARD_CHANNEL_ID, PICKUP_BOARD_ENABLED
+from bot.services import (
+    is_auto_voice_active,
+    Identity,
+    invalidate_identity,
+    invalidate_roster,
+    enqueue_announcement,
+    expiry_cutoff,
+    guard_messages,
+    render_pickup_message,
+    pickup_board,
+    make_board_entry,
+)
 import re
+from bot.handlers.text_commands import text_commands
 
 router = Router()
 
@@ -70,12 +83,12 @@ async def process_phone(message: Message, state: FSMContext):
         )
         return
 
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
         telegram_id = message.from_user.id
 
         # 2) Ищем пользователя по telegram_id
-        user = session.query(User).filter(User.telegram_id == telegram_id).first()
+        user = await session.scalar(select(User).where(User.telegram_id == telegram_id))
 
         if user:
             # Обновляем существующего (НЕ создаём нового)
@@ -94,9 +107,10 @@ async def process_phone(message: Message, state: FSMContext):
             )
             session.add(user)
 
-        session.commit()
+        await session.commit()
+        invalidate_identity(telegram_id)
     finally:
-        session.close()
+        await session.close()
 
     # После регистрации показываем меню выбора роли, чтобы пользователь мог выбрать роль учителя
     from bot.keyboards.common import role_selection_keyboard
@@ -116,7 +130,7 @@ async def process_phone(message: Message, state: FSMContext):
 # ДЕТИ
 # =========================
 
-@router.message(lambda m: m.text == "➕ Добавить ребёнка" or m.text == "Добавить ребёнка")
+@text_commands.handler("➕ Добавить ребёнка", "Добавить ребёнка")
 async def add_child_start(message: Message, state: FSMContext):
     await message.answer("Введите ФИО ребёнка:")
     await state.set_state(AddChildState.waiting_child_name)
@@ -130,28 +144,25 @@ async def process_child_name(message: Message, state: FSMContext):
 
 
 @router.message(AddChildState.waiting_class_name)
-async def process_child_class(message: Message, state: FSMContext):
+async def process_child_class(message: Message, state: FSMContext, actor: Identity | None):
     data = await state.get_data()
 
-    session = SessionLocal()
-    try:
-        parent = session.query(User).filter(
-            User.telegram_id == message.from_user.id
-        ).first()
-
-        if not parent:
-            await message.answer("Ошибка: пользователь не найден. Нажмите /start.")
-            await state.clear()
-            return
+    if not actor:
+        await message.answer("Ошибка: пользователь не найден. Нажмите /start.")
+        await state.clear()
+        return
 
+    session = AsyncSessionLocal()
+    try:
         child = Child(
-            parent_id=parent.id,
+            parent_id=actor.user_id,
             full_name=data["child_name"],
             class_name=message.text.strip()
         )
 
         session.add(child)
-        session.commit()
+        await session.commit()
+        invalidate_roster(child.class_name)
 
         # сохраняем строку ДО закрытия сессии
         child_name = child.full_name
@@ -162,24 +173,20 @@ async def process_child_class(message: Message, state: FSMContext):
         )
         await state.clear()
     finally:
-        session.close()
+        await session.close()
 
 
-@router.message(lambda m: m.text == "👶 Мои дети" or m.text == "Мои дети")
-async def list_children(message: Message):
-    session = SessionLocal()
-    try:
-        parent = session.query(User).filter(
-            User.telegram_id == message.from_user.id
-        ).first()
-
-        if not parent:
-            await message.answer("Вы ещё не зарегистрированы. Нажмите /start.")
-            return
+@text_commands.handler("👶 Мои дети", "Мои дети")
+async def list_children(message: Message, actor: Identity | None):
+    if not actor:
+        await message.answer("Вы ещё не зарегистрированы. Нажмите /start.")
+        return
 
-        children = session.query(Child).filter(
-            Child.parent_id == parent.id
-        ).all()
+    session = AsyncSessionLocal()
+    try:
+        children = (await session.scalars(select(Child).where(
+            Child.parent_id == actor.user_id
+        ))).all()
 
         if not children:
             await message.answer("У вас пока нет добавленных детей.")
@@ -191,9 +198,9 @@ async def list_children(message: Message):
 
         await message.answer(text)
     finally:
-        session.close()
+        await session.close()
 
-@router.message(lambda m: m.text == "Изменить номер телефона")
+@text_commands.handler("Изменить номер телефона")
 async def update_phone_start(message: Message, state: FSMContext):
     await message.answer(
         "Введите новый номер телефона\n"
@@ -212,10 +219,10 @@ async def update_phone_process(message: Message, state: FSMContext):
         )
         return
 
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
         telegram_id = message.from_user.id
-        user = session.query(User).filter(User.telegram_id == telegram_id).first()
+        user = await session.scalar(select(User).where(User.telegram_id == telegram_id))
 
         if not user:
             await message.answer("Вы ещё не зарегистрированы. Нажмите /start.")
@@ -223,9 +230,9 @@ async def update_phone_process(message: Message, state: FSMContext):
             return
 
         user.phone = phone
-        session.commit()
+        await session.commit()
     finally:
-        session.close()
+        await session.close()
 
     await message.answer(
         f"Номер обновлён: {phone}",
@@ -239,33 +246,38 @@ async def update_phone_process(message: Message, state: FSMContext):
 # Я ЕДУ ЗА РЕБЁНКОМ
 # =========================
 
-@router.message(lambda m: m.text == "🚗 Я еду за ребёнком" or m.text == "Я еду за ребёнком")
-async def pickup_start(message: Message, state: FSMContext):
-    session = SessionLocal()
-    try:
-        parent = session.query(User).filter(
-            User.telegram_id == message.from_user.id
-        ).first()
-
-        if not parent:
-            await message.answer("Вы ещё не зарегистрированы. Нажмите /start.")
-            return
+@text_commands.handler("🚗 Я еду за ребёнком", "Я еду за ребёнком")
+async def pickup_start(message: Message, state: FSMContext, actor: Identity | None):
+    if not actor:
+        await message.answer("Вы ещё не зарегистрированы. Нажмите /start.")
+        return
 
-        children = session.query(Child).filter(
-            Child.parent_id == parent.id
-        ).all()
+    session = AsyncSessionLocal()
+    try:
+        children = (await session.scalars(select(Child).where(
+            Child.parent_id == actor.user_id
+        ))).all()
 
         if not children:
             await message.answer("У вас нет добавленных детей.")
             return
 
-        await message.answer(
-            "Выберите ученика:",
-            reply_markup=children_inline_keyboard(children)
-        )
+        if len(children) == 1:
+            await message.answer(
+                "Выберите ученика:",
+                reply_markup=children_inline_keyboard(children)
+            )
+        else:
+            # Несколько детей: можно забрать сразу нескольких одной заявкой
+            choices = [[c.id, c.full_name, c.class_name] for c in children]
+            await state.update_data(pickup_children=choices, child_ids=[])
+            await message.answer(
+                "Выберите учеников (можно несколько):",
+                reply_markup=children_multiselect_keyboard(choices, [])
+            )
         await state.set_state(PickupState.choosing_child)
     finally:
-        session.close()
+        await session.close()
 
 
 @router.callback_query(
@@ -274,7 +286,7 @@ async def pickup_start(message: Message, state: FSMContext):
 )
 async def pickup_choose_child(callback: CallbackQuery, state: FSMContext):
     child_id = int(callback.data.split(":")[1])
-    await state.update_data(child_id=child_id)
+    await state.update_data(child_ids=[child_id])
 
     await callback.message.edit_text(
         "Через сколько минут вы приедете?",
@@ -283,129 +295,255 @@ async def pickup_choose_child(callback: CallbackQuery, state: FSMContext):
     await state.set_state(PickupState.choosing_time)
 
 
-from datetime import datetime, timedelta
-from sqlalchemy import and_
+@router.callback_query(
+    PickupState.choosing_child,
+    lambda c: c.data.startswith("pickup_toggle:")
+)
+async def pickup_toggle_child(callback: CallbackQuery, state: FSMContext):
+    child_id = int(callback.data.split(":")[1])
+    data = await state.get_data()
+    selected = list(data.get("child_ids", []))
+    if child_id in selected:
+        selected.remove(child_id)
+    else:
+        selected.append(child_id)
+    await state.update_data(child_ids=selected)
+
+    await callback.message.edit_reply_markup(
+        reply_markup=children_multiselect_keyboard(data.get("pickup_children", []), selected)
+    )
+    await callback.answer()
+
+
+@router.callback_query(
+    PickupState.choosing_child,
+    lambda c: c.data in ("pickup_all", "pickup_next")
+)
+async def pickup_confirm_children(callback: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    if callback.data == "pickup_all":
+        selected = [child_id for child_id, _, _ in data.get("pickup_children", [])]
+        await state.update_data(child_ids=selected)
+    else:
+        selected = data.get("child_ids", [])
+
+    if not selected:
+        await callback.answer("Выберите хотя бы одного ученика.", show_alert=True)
+        return
+
+    await callback.message.edit_text(
+        "Через сколько минут вы приедете?",
+        reply_markup=time_inline_keyboard()
+    )
+    await state.set_state(PickupState.choosing_time)
+    await callback.answer()
+
 
 @router.callback_query(PickupState.choosing_time, lambda c: c.data.startswith("pickup_time:"))
-async def pickup_choose_time(callback: CallbackQuery, state: FSMContext):
+async def pickup_choose_time(callback: CallbackQuery, state: FSMContext, actor: Identity | None):
     minutes = int(callback.data.split(":")[1])
     data = await state.get_data()
-    child_id = int(data["child_id"])
+    child_ids = [int(child_id) for child_id in data.get("child_ids", [])]
 
-    session = SessionLocal()
-    try:
-        parent = session.query(User).filter(User.telegram_id == callback.from_user.id).first()
-        
-        if not parent:
-            await callback.message.edit_text("Ошибка: пользователь не найден.")
-            await state.clear()
-            await callback.answer()
-            return
+    if not actor:
+        await callback.message.edit_text("Ошибка: пользователь не найден.")
+        await state.clear()
+        await callback.answer()
+        return
 
-        child = session.query(Child).filter(Child.id == child_id, Child.parent_id == parent.id).first()
+    session = AsyncSessionLocal()
+    try:
+        children = (await session.scalars(
+            select(Child)
+            .where(Child.id.in_(child_ids), Child.parent_id == actor.user_id)
+            .order_by(Child.id)
+        )).all()
 
-        if not child:
+        if not children:
             await callback.message.edit_text("Ошибка: ребёнок не найден или нет доступа.")
             await state.clear()
             await callback.answer()
             return
 
-        # 1) Авто-просрочка старых активных заявок (например, старше 2 часов)
-        expire_before = datetime.utcnow() - timedelta(hours=2)
-        session.query(PickupRequest).filter(
-            PickupRequest.status == "PENDING",
-            PickupRequest.created_at < expire_before
-        ).update({PickupRequest.status: "EXPIRED"}, synchronize_session=False)
-        session.commit()
-
-        # 2) Анти-дубли:
-        # если уже есть активная заявка для этого ребёнка от этого родителя -> обновляем время, а не создаём новую
-        existing = session.query(PickupRequest).filter(
-            PickupRequest.parent_id == parent.id,
-            PickupRequest.child_id == child.id,
-            PickupRequest.status.in_(["PENDING", "ANNOUNCED"])
-        ).order_by(PickupRequest.created_at.desc()).first()
-
-        if existing:
-            existing.arrival_minutes = minutes
-            existing.updated_at = datetime.utcnow()
-            session.commit()
-
-            pickup_id = existing.id
+        # Анти-дубли:
+        # если уже есть активная заявка для ребёнка от этого родителя -> обновляем время, а не создаём новую.
+        # Устаревшие заявки переводит в EXPIRED фоновый sweeper (pickup_expiry);
+        # до его прохода они не считаются активными благодаря условию по created_at.
+        active = (await session.scalars(
+            select(PickupRequest).where(
+                PickupRequest.parent_id == actor.user_id,
+                PickupRequest.child_id.in_([c.id for c in children]),
+                PickupRequest.status.in_(["PENDING", "ANNOUNCED"]),
+                PickupRequest.created_at >= expiry_cutoff(),
+            ).order_by(PickupRequest.created_at.desc())
+        )).all()
+        existing = {}
+        for pr in active:
+            existing.setdefault(pr.child_id, pr)
+
+        # Все заявки родителя создаются/обновляются одной транзакцией
+        now = datetime.utcnow()
+        pickups = []
+        for child in children:
+            pickup = existing.get(child.id)
+            if pickup:
+                pickup.arrival_minutes = minutes
+                pickup.updated_at = now
+            else:
+                pickup = PickupRequest(
+                    parent_id=actor.user_id,
+                    child_id=child.id,
+                    arrival_minutes=minutes,
+                    status="PENDING",
+                )
+                session.add(pickup)
+            pickups.append((pickup, child))
+        await session.commit()
+
+        if len(existing) == len(children):
             status_text = "Заявка обновлена (без дубля)."
-            pickup_obj = existing
         else:
-            pickup = PickupRequest(
-                parent_id=parent.id,
-                child_id=child.id,
-                arrival_minutes=minutes,
-                status="PENDING",
-            )
-            session.add(pickup)
-            session.commit()
-            session.refresh(pickup)
-
-            pickup_id = pickup.id
             status_text = "Заявка отправлена."
-            pickup_obj = pickup
 
         # Данные, которые будем использовать после закрытия session
-        child_name = child.full_name
-        class_name = child.class_name
-        parent_name = parent.full_name
+        group = [(pickup.id, child.full_name, child.class_name) for pickup, child in pickups]
+        pickup_ids = [pickup_id for pickup_id, _, _ in group]
+        parent_name = actor.full_name
+
+        # Сообщения охраны, на которых уже есть заявки этих детей, и активные
+        # заявки других детей на тех же сообщениях (они там и остаются)
+        group_message_ids = {pickup.channel_message_id for pickup, _ in pickups}
+        old_message_ids = list(dict.fromkeys(
+            pickup.channel_message_id for pickup, _ in pickups if pickup.channel_message_id is not None
+        ))
+        remaining = {}
+        if old_message_ids:
+            rows = (await session.execute(
+                select(PickupRequest, Child)
+                .join(Child, Child.id == PickupRequest.child_id)
+                .where(
+                    PickupRequest.channel_message_id.in_(old_message_ids),
+                    PickupRequest.id.notin_(pickup_ids),
+                    PickupRequest.status.in_(["PENDING", "ANNOUNCED"]),
+                    PickupRequest.created_at >= expiry_cutoff(),
+                )
+                .order_by(Child.id)
+            )).all()
+            for pickup, child in rows:
+                remaining.setdefault(pickup.channel_message_id, []).append(
+                    (pickup.id, child.full_name, child.class_name, pickup.arrival_minutes)
+                )
 
     finally:
-        session.close()
+        await session.close()
+
+    # Правим на месте только сообщение, все заявки которого подаются заново;
+    # иначе публикуем новое, а в старых оставляем детей, которых не выбрали
+    previous_message_id = next((mid for mid in old_message_ids if mid not in remaining), None)
 
     # Сообщение родителю
+    if len(group) == 1:
+        _, child_name, class_name = group[0]
+        who = f"Ребёнок: {child_name} ({class_name})"
+    else:
+        who = "Дети: " + ", ".join(f"{name} ({class_name})" for _, name, class_name in group)
     await callback.message.edit_text(
         f"{status_text}\n"
-        f"Ребёнок: {child_name} ({class_name})\n"
+        f"{who}\n"
         f"Прибытие через {minutes} мин."
     )
 
-    channel_message_id = None
-
-    # Сообщение в канал охраны
-    if GUARD_CHANNEL_ID:
-        guard_message = await callback.bot.send_message(
-            GUARD_CHANNEL_ID,
-            "📌 Выдача ученика\n"
-            f"🟡 ОЖИДАЕТ ПЕРЕДАЧИ\n"
-            f"Родитель: {parent_name}\n"
-            f"Ученик: {child_name} ({class_name})\n"
-            f"Ожидается через: {minutes} мин.",
-            reply_markup=guard_actions_keyboard(pickup_id),
+    channel_message_id = previous_message_id
+    moved_messages = {}
+
+    # Сообщение в канал охраны: при включённой доске выдачи заявки только
+    # попадают в её индекс (доска перерисуется сама, с троттлингом);
+    # иначе публикуем одно общее сообщение на всех детей родителя,
+    # а для обновлённой заявки правим уже опубликованное
+    if GUARD_CHANNEL_ID and PICKUP_BOARD_ENABLED:
+        for pickup_id, child_name, class_name in group:
+            pickup_board.upsert(make_board_entry(pickup_id, parent_name, child_name, class_name, minutes))
+    elif GUARD_CHANNEL_ID:
+        if len(group) == 1:
+            keyboard = guard_actions_keyboard(pickup_ids[0])
+        else:
+            keyboard = guard_group_keyboard(actor.user_id, [(pickup_id, name) for pickup_id, name, _ in group])
+        channel_message_id = await guard_messages.publish(
+            callback.bot,
+            pickup_ids[0],
+            previous_message_id,
+            render_pickup_message(
+                parent_name,
+                minutes,
+                [(name, class_name, False) for _, name, class_name in group],
+            ),
+            reply_markup=keyboard,
         )
-        channel_message_id = guard_message.message_id
 
-    # Обновляем заявку информацией о сообщении и, при необходимости, выполняем первую озвучку
-    session = SessionLocal()
-    try:
-        pr = session.query(PickupRequest).filter(PickupRequest.id == pickup_id).first()
-        if pr:
-            if channel_message_id is not None:
-                pr.channel_message_id = channel_message_id
-
-            # Автоматическая озвучка при создании/обновлении заявки
-            if is_auto_voice_active():
-                pa = PAAdapter()
-                announce_text = (
-                    f"Просьба вызвать ученика {child_name} "
-                    f"из класса {class_name} к выходу. "
-                    f"Родитель прибудет через {minutes} минут."
+        # Старые сообщения: оставшиеся дети — с их кнопками, пустые — закрываем
+        for old_message_id in old_message_ids:
+            if old_message_id == previous_message_id:
+                continue
+            rest = remaining.get(old_message_id)
+            if not rest:
+                await guard_messages.retire(
+                    callback.bot, old_message_id, "📌 Заявка перенесена в новое сообщение охраны."
                 )
-                ok = await pa.announce(announce_text)
-                if ok:
-                    now = datetime.utcnow()
-                    pr.last_announce_at = now
-                    pr.next_announce_at = now + timedelta(minutes=4)
-                    pr.announce_count = (pr.announce_count or 0) + 1
-                    pr.status = "ANNOUNCED"
-
-            session.commit()
-    finally:
-        session.close()
+                continue
+            if len(rest) == 1:
+                keyboard = guard_actions_keyboard(rest[0][0])
+            else:
+                keyboard = guard_group_keyboard(actor.user_id, [(pickup_id, name) for pickup_id, name, _, _ in rest])
+            new_message_id = await guard_messages.publish(
+                callback.bot,
+                rest[0][0],
+                old_message_id,
+                render_pickup_message(
+                    parent_name,
+                    rest[0][3],
+                    [(name, class_name, False) for _, name, class_name, _ in rest],
+                ),
+                reply_markup=keyboard,
+            )
+            if new_message_id is not None and new_message_id != old_message_id:
+                moved_messages[old_message_id] = new_message_id
+
+    # Обновляем заявки информацией о сообщении
+    store_group = channel_message_id is not None and group_message_ids != {channel_message_id}
+    if store_group or moved_messages:
+        session = AsyncSessionLocal()
+        try:
+            if store_group:
+                await session.execute(
+                    update(PickupRequest)
+                    .where(PickupRequest.id.in_(pickup_ids))
+                    .values(channel_message_id=channel_message_id)
+                    .execution_options(synchronize_session=False)
+                )
+            for old_message_id, new_message_id in moved_messages.items():
+                await session.execute(
+                    update(PickupRequest)
+                    .where(PickupRequest.channel_message_id == old_message_id)
+                    .values(channel_message_id=new_message_id)
+                    .execution_options(synchronize_session=False)
+                )
+            await session.commit()
+        finally:
+            await session.close()
+
+    # Автоматическая озвучка при создании/обновлении заявки — через очередь PA:
+    # хэндлер не ждёт громкоговоритель, а очередь после озвучки сама
+    # обновит заявку и поставит повтор в планировщик.
+    # Заявки одного родителя ставятся подряд и объединяются очередью в одну фразу.
+    if is_auto_voice_active():
+        for pickup_id, child_name, class_name in group:
+            enqueue_announcement(
+                pickup_id=pickup_id,
+                parent_id=actor.user_id,
+                child_name=child_name,
+                class_name=class_name,
+                arrival_minutes=minutes,
+            )
 
     await state.clear()
     await callback.answer()
@@ -418,29 +556,28 @@ async def pickup_choose_time(callback: CallbackQuery, state: FSMContext):
 # ПРОСМОТР ДАННЫХ РОДИТЕЛЕМ
 # =========================
 
-@router.message(lambda m: m.text == "📊 Оценки")
-async def parent_view_grades(message: Message):
+@text_commands.handler("📊 Оценки")
+async def parent_view_grades(message: Message, actor: Identity | None):
     """Просмотр оценок детей"""
-    session = SessionLocal()
-    try:
-        user = session.query(User).filter(User.telegram_id == message.from_user.id).first()
-        if not user:
-            await message.answer("Сначала зарегистрируйтесь через /start")
-            return
+    if not actor:
+        await message.answer("Сначала зарегистрируйтесь через /start")
+        return
 
-        children = session.query(Child).filter(Child.parent_id == user.id).all()
+    session = AsyncSessionLocal()
+    try:
+        children = (await session.scalars(select(Child).where(Child.parent_id == actor.user_id))).all()
         if not children:
             await message.answer("У вас нет добавленных детей.")
             return
 
         text = "📊 Оценки ваших детей:\n\n"
         for child in children:
-            grades = session.query(Grade).filter(Grade.child_id == child.id).order_by(Grade.date.desc()).limit(10).all()
+            grades = (await session.scalars(select(Grade).where(Grade.child_id == child.id).order_by(Grade.date.desc()).limit(10))).all()
             text += f"👤 {child.full_name} ({child.class_name}):\n"
             
             if grades:
                 for grade in grades:
-                    subject = session.query(Subject).filter(Subject.id == grade.subject_id).first()
+                    subject = await session.scalar(select(Subject).where(Subject.id == grade.subject_id))
                     text += f"  • {subject.name if subject else 'Не указан'}: {grade.grade} ({grade.date.strftime('%d.%m.%Y')})\n"
             else:
                 text += "  Нет оценок\n"
@@ -448,20 +585,19 @@ async def parent_view_grades(message: Message):
 
         await message.answer(text)
     finally:
-        session.close()
+        await session.close()
 
 
-@router.message(lambda m: m.text == "📅 Посещаемость")
-async def parent_view_attendance(message: Message):
+@text_commands.handler("📅 Посещаемость")
+async def parent_view_attendance(message: Message, actor: Identity | None):
     """Просмотр посещаемости детей"""
-    session = SessionLocal()
-    try:
-        user = session.query(User).filter(User.telegram_id == message.from_user.id).first()
-        if not user:
-            await message.answer("Сначала зарегистрируйтесь через /start")
-            return
+    if not actor:
+        await message.answer("Сначала зарегистрируйтесь через /start")
+        return
 
-        children = session.query(Child).filter(Child.parent_id == user.id).all()
+    session = AsyncSessionLocal()
+    try:
+        children = (await session.scalars(select(Child).where(Child.parent_id == actor.user_id))).all()
         if not children:
             await message.answer("У вас нет добавленных детей.")
             return
@@ -471,10 +607,10 @@ async def parent_view_attendance(message: Message):
         
         for child in children:
             # Посещаемость за последние 7 дней
-            attendance_list = session.query(Attendance).filter(
+            attendance_list = (await session.scalars(select(Attendance).where(
                 Attendance.child_id == child.id,
                 Attendance.date >= date(today.year, today.month, max(1, today.day - 7))
-            ).order_by(Attendance.date.desc()).all()
+            ).order_by(Attendance.date.desc()))).all()
             
             text += f"👤 {child.full_name} ({child.class_name}):\n"
             
@@ -492,35 +628,34 @@ async def parent_view_attendance(message: Message):
 
         await message.answer(text)
     finally:
-        session.close()
+        await session.close()
 
 
-@router.message(lambda m: m.text == "📝 Домашние задания")
-async def parent_view_homework(message: Message):
+@text_commands.handler("📝 Домашние задания")
+async def parent_view_homework(message: Message, actor: Identity | None):
     """Просмотр домашних заданий"""
-    session = SessionLocal()
-    try:
-        user = session.query(User).filter(User.telegram_id == message.from_user.id).first()
-        if not user:
-            await message.answer("Сначала зарегистрируйтесь через /start")
-            return
+    if not actor:
+        await message.answer("Сначала зарегистрируйтесь через /start")
+        return
 
-        children = session.query(Child).filter(Child.parent_id == user.id).all()
+    session = AsyncSessionLocal()
+    try:
+        children = (await session.scalars(select(Child).where(Child.parent_id == actor.user_id))).all()
         if not children:
             await message.answer("У вас нет добавленных детей.")
             return
 
         class_names = [c.class_name for c in children]
-        homeworks = session.query(Homework).filter(
+        homeworks = (await session.scalars(select(Homework).where(
             Homework.class_name.in_(class_names),
             Homework.due_date >= date.today()
-        ).order_by(Homework.due_date).all()
+        ).order_by(Homework.due_date))).all()
 
         text = "📝 Домашние задания:\n\n"
         
         if homeworks:
             for hw in homeworks:
-                subject = session.query(Subject).filter(Subject.id == hw.subject_id).first()
+                subject = await session.scalar(select(Subject).where(Subject.id == hw.subject_id))
                 text += f"📚 {hw.class_name} - {subject.name if subject else 'Не указан'}\n"
                 text += f"Сдать до: {hw.due_date.strftime('%d.%m.%Y')}\n"
                 text += f"{hw.text}\n\n"
@@ -529,34 +664,33 @@ async def parent_view_homework(message: Message):
 
         await message.answer(text)
     finally:
-        session.close()
+        await session.close()
 
 
-@router.message(lambda m: m.text == "💬 Комментарии учителей")
-async def parent_view_comments(message: Message):
+@text_commands.handler("💬 Комментарии учителей")
+async def parent_view_comments(message: Message, actor: Identity | None):
     """Просмотр комментариев учителей"""
-    session = SessionLocal()
-    try:
-        user = session.query(User).filter(User.telegram_id == message.from_user.id).first()
-        if not user:
-            await message.answer("Сначала зарегистрируйтесь через /start")
-            return
+    if not actor:
+        await message.answer("Сначала зарегистрируйтесь через /start")
+        return
 
-        children = session.query(Child).filter(Child.parent_id == user.id).all()
+    session = AsyncSessionLocal()
+    try:
+        children = (await session.scalars(select(Child).where(Child.parent_id == actor.user_id))).all()
         if not children:
             await message.answer("У вас нет добавленных детей.")
             return
 
         child_ids = [c.id for c in children]
-        comments = session.query(Comment).filter(
+        comments = (await session.scalars(select(Comment).where(
             Comment.child_id.in_(child_ids)
-        ).order_by(Comment.created_at.desc()).limit(20).all()
+        ).order_by(Comment.created_at.desc()).limit(20))).all()
 
         text = "💬 Комментарии учителей:\n\n"
         
         if comments:
             for comment in comments:
-                child = session.query(Child).filter(Child.id == comment.child_id).first()
+                child = await session.scalar(select(Child).where(Child.id == comment.child_id))
                 type_map = {
                     "behavior": "Поведение",
                     "attendance": "Посещаемость",
@@ -571,73 +705,130 @@ async def parent_view_comments(message: Message):
 
         await message.answer(text)
     finally:
-        session.close()
+        await session.close()
+
+
+def _rating_query(parent_id: int, month_start: date):
+    """
+    Рейтинг всех детей родителя одним запросом.
+
+    - средний балл считается для всех учеников классов, где учатся дети,
+      чтобы оконные функции дали место в классе и перцентиль;
+    - посещаемость за месяц — условная агрегация только по детям родителя.
+    Стоимость зависит от размера классов, а не от числа учеников в школе.
+    """
+    parent_classes = select(Child.class_name).where(Child.parent_id == parent_id)
+
+    class_grades = (
+        select(Grade.child_id, func.avg(Grade.grade).label("avg_grade"))
+        .join(Child, Child.id == Grade.child_id)
+        .where(Child.class_name.in_(parent_classes))
+        .group_by(Grade.child_id)
+        .subquery()
+    )
+    # Ученики без оценок — в отдельном окне и в место/перцентиль не входят
+    graded_window = (Child.class_name, class_grades.c.avg_grade.is_(None))
+    classmates = (
+        select(
+            Child.id,
+            Child.parent_id,
+            Child.full_name,
+            Child.class_name,
+            class_grades.c.avg_grade,
+            func.rank().over(
+                partition_by=graded_window, order_by=class_grades.c.avg_grade.desc()
+            ).label("class_rank"),
+            func.count(class_grades.c.avg_grade).over(partition_by=Child.class_name).label("class_graded"),
+            # Доля одноклассников со средним баллом ниже (0..1)
+            func.percent_rank(type_=Float).over(
+                partition_by=graded_window, order_by=class_grades.c.avg_grade
+            ).label("percentile"),
+        )
+        .outerjoin(class_grades, class_grades.c.child_id == Child.id)
+        .where(Child.class_name.in_(parent_classes))
+        .subquery()
+    )
 
+    month_attendance = (
+        select(
+            Attendance.child_id,
+            func.count().label("total_days"),
+            func.sum(case((Attendance.status == "present", 1), else_=0)).label("present_days"),
+        )
+        .join(Child, Child.id == Attendance.child_id)
+        .where(Child.parent_id == parent_id, Attendance.date >= month_start)
+        .group_by(Attendance.child_id)
+        .subquery()
+    )
 
-@router.message(lambda m: m.text == "🏆 Рейтинг ребёнка")
-async def parent_view_rating(message: Message):
-    """Просмотр рейтинга ребёнка (базовая версия)"""
-    session = SessionLocal()
-    try:
-        user = session.query(User).filter(User.telegram_id == message.from_user.id).first()
-        if not user:
-            await message.answer("Сначала зарегистрируйтесь через /start")
-            return
+    return (
+        select(
+            classmates.c.full_name,
+            classmates.c.class_name,
+            classmates.c.avg_grade,
+            classmates.c.class_rank,
+            classmates.c.class_graded,
+            classmates.c.percentile,
+            func.coalesce(month_attendance.c.total_days, 0),
+            func.coalesce(month_attendance.c.present_days, 0),
+        )
+        .outerjoin(month_attendance, month_attendance.c.child_id == classmates.c.id)
+        .where(classmates.c.parent_id == parent_id)
+        .order_by(classmates.c.id)
+    )
 
-        children = session.query(Child).filter(Child.parent_id == user.id).all()
-        if not children:
-            await message.answer("У вас нет добавленных детей.")
-            return
 
-        text = "🏆 Рейтинг ваших детей:\n\n"
-        
-        for child in children:
-            # Средний балл
-            avg_grade = session.query(func.avg(Grade.grade)).filter(
-                Grade.child_id == child.id
-            ).scalar()
-            
-            # Посещаемость за месяц
-            month_start = date.today().replace(day=1)
-            total_days = session.query(Attendance).filter(
-                Attendance.child_id == child.id,
-                Attendance.date >= month_start
-            ).count()
-            present_days = session.query(Attendance).filter(
-                Attendance.child_id == child.id,
-                Attendance.date >= month_start,
-                Attendance.status == "present"
-            ).count()
-            
-            text += f"👤 {child.full_name} ({child.class_name}):\n"
-            if avg_grade:
-                text += f"  Средний балл: {avg_grade:.2f}\n"
-            else:
-                text += f"  Средний балл: нет оценок\n"
-            
-            if total_days > 0:
-                attendance_percent = (present_days / total_days) * 100
-                text += f"  Посещаемость: {present_days}/{total_days} ({attendance_percent:.1f}%)\n"
-            else:
-                text += f"  Посещаемость: нет данных\n"
-            text += "\n"
+@text_commands.handler("🏆 Рейтинг ребёнка")
+async def parent_view_rating(message: Message, actor: Identity | None):
+    """Просмотр рейтинга ребёнка: средний балл, место в классе, посещаемость за месяц"""
+    if not actor:
+        await message.answer("Сначала зарегистрируйтесь через /start")
+        return
 
-        await message.answer(text)
+    session = AsyncSessionLocal()
+    try:
+        month_start = date.today().replace(day=1)
+        rows = (await session.execute(_rating_query(actor.user_id, month_start))).all()
     finally:
-        session.close()
+        await session.close()
 
+    if not rows:
+        await message.answer("У вас нет добавленных детей.")
+        return
 
-@router.message(lambda m: m.text == "🔔 Уведомления школы")
-async def parent_notifications(message: Message):
+    text = "🏆 Рейтинг ваших детей:\n\n"
+    for full_name, class_name, avg_grade, class_rank, class_graded, percentile, total_days, present_days in rows:
+        text += f"👤 {full_name} ({class_name}):\n"
+        if avg_grade:
+            text += f"  Средний балл: {avg_grade:.2f}\n"
+            if class_graded > 1:
+                text += (
+                    f"  Место в классе: {class_rank} из {class_graded}"
+                    f" (выше, чем у {percentile * 100:.0f}% класса)\n"
+                )
+        else:
+            text += f"  Средний балл: нет оценок\n"
+
+        if total_days > 0:
+            attendance_percent = (present_days / total_days) * 100
+            text += f"  Посещаемость: {present_days}/{total_days} ({attendance_percent:.1f}%)\n"
+        else:
+            text += f"  Посещаемость: нет данных\n"
+        text += "\n"
+
+    await message.answer(text)
+
+
+@text_commands.handler("🔔 Уведомления школы")
+async def parent_notifications(message: Message, actor: Identity | None):
     """Просмотр уведомлений школы"""
-    session = SessionLocal()
-    try:
-        user = session.query(User).filter(User.telegram_id == message.from_user.id).first()
-        if not user:
-            await message.answer("Сначала зарегистрируйтесь через /start")
-            return
+    if not actor:
+        await message.answer("Сначала зарегистрируйтесь через /start")
+        return
 
-        children = session.query(Child).filter(Child.parent_id == user.id).all()
+    session = AsyncSessionLocal()
+    try:
+        children = (await session.scalars(select(Child).where(Child.parent_id == actor.user_id))).all()
         if not children:
             await message.answer("У вас нет добавленных детей.")
             return
@@ -649,25 +840,25 @@ async def parent_notifications(message: Message):
         week_ago = datetime.utcnow() - timedelta(days=7)
         child_ids = [c.id for c in children]
         
-        recent_grades = session.query(Grade).filter(
+        recent_grades = (await session.scalars(select(Grade).where(
             Grade.child_id.in_(child_ids),
             Grade.created_at >= week_ago
-        ).order_by(Grade.created_at.desc()).limit(5).all()
+        ).order_by(Grade.created_at.desc()).limit(5))).all()
         
         if recent_grades:
             text += "📝 Последние оценки:\n"
             for grade in recent_grades:
                 child = next((c for c in children if c.id == grade.child_id), None)
-                subject = session.query(Subject).filter(Subject.id == grade.subject_id).first()
+                subject = await session.scalar(select(Subject).where(Subject.id == grade.subject_id))
                 if child and subject:
                     text += f"  • {child.full_name}: {subject.name} - {grade.grade} ({grade.date.strftime('%d.%m')})\n"
             text += "\n"
         
         # Последние комментарии (за последние 7 дней)
-        recent_comments = session.query(Comment).filter(
+        recent_comments = (await session.scalars(select(Comment).where(
             Comment.child_id.in_(child_ids),
             Comment.created_at >= week_ago
-        ).order_by(Comment.created_at.desc()).limit(5).all()
+        ).order_by(Comment.created_at.desc()).limit(5))).all()
         
         if recent_comments:
             text += "💬 Последние комментарии:\n"
@@ -684,15 +875,15 @@ async def parent_notifications(message: Message):
         
         # Активные домашние задания
         class_names = [c.class_name for c in children]
-        active_homework = session.query(Homework).filter(
+        active_homework = (await session.scalars(select(Homework).where(
             Homework.class_name.in_(class_names),
             Homework.due_date >= date.today()
-        ).order_by(Homework.due_date).limit(5).all()
+        ).order_by(Homework.due_date).limit(5))).all()
         
         if active_homework:
             text += "📚 Активные домашние задания:\n"
             for hw in active_homework:
-                subject = session.query(Subject).filter(Subject.id == hw.subject_id).first()
+                subject = await session.scalar(select(Subject).where(Subject.id == hw.subject_id))
                 if subject:
                     text += f"  • {hw.class_name}: {subject.name} - до {hw.due_date.strftime('%d.%m')}\n"
             text += "\n"
@@ -702,10 +893,10 @@ async def parent_notifications(message: Message):
         
         await message.answer(text)
     finally:
-        session.close()
+        await session.close()
 
 
-@router.message(lambda m: m.text == "⚙️ Настройки")
+@text_commands.handler("⚙️ Настройки")
 async def parent_settings(message: Message):
     """Настройки родителя"""
     from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
@@ -728,22 +919,17 @@ async def parent_settings(message: Message):
 # =========================
 
 @router.callback_query(lambda c: c.data == "edit_parent_name")
-async def edit_parent_name_start(callback: CallbackQuery, state: FSMContext):
+async def edit_parent_name_start(callback: CallbackQuery, state: FSMContext, actor: Identity | None):
     """Начало изменения ФИО родителя"""
-    session = SessionLocal()
-    try:
-        user = session.query(User).filter(User.telegram_id == callback.from_user.id).first()
-        if not user:
-            await callback.answer("Сначала зарегистрируйтесь", show_alert=True)
-            return
+    if not actor:
+        await callback.answer("Сначала зарегистрируйтесь", show_alert=True)
+        return
 
-        await callback.message.edit_text(
-            f"Текущее ФИО: {user.full_name}\n\n"
-            "Введите новое ФИО:"
-        )
-        await state.set_state(UpdateFullNameState.waiting_full_name)
-    finally:
-        session.close()
+    await callback.message.edit_text(
+        f"Текущее ФИО: {actor.full_name}\n\n"
+        "Введите новое ФИО:"
+    )
+    await state.set_state(UpdateFullNameState.waiting_full_name)
     await callback.answer()
 
 
@@ -756,9 +942,9 @@ async def edit_parent_name_process(message: Message, state: FSMContext):
         await message.answer("ФИО слишком короткое. Введите корректное ФИО (минимум 3 символа):")
         return
 
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
-        user = session.query(User).filter(User.telegram_id == message.from_user.id).first()
+        user = await session.scalar(select(User).where(User.telegram_id == message.from_user.id))
         if not user:
             await message.answer("Ошибка: пользователь не найден.")
             await state.clear()
@@ -766,7 +952,8 @@ async def edit_parent_name_process(message: Message, state: FSMContext):
 
         old_name = user.full_name
         user.full_name = new_full_name
-        session.commit()
+        await session.commit()
+        invalidate_identity(user.telegram_id)
 
         await message.answer(
             f"✅ ФИО успешно изменено:\n"
@@ -775,7 +962,7 @@ async def edit_parent_name_process(message: Message, state: FSMContext):
             reply_markup=parent_main_keyboard()
         )
     finally:
-        session.close()
+        await session.close()
     await state.clear()
 
 
@@ -784,16 +971,15 @@ async def edit_parent_name_process(message: Message, state: FSMContext):
 # =========================
 
 @router.callback_query(lambda c: c.data == "edit_child_name")
-async def edit_child_name_start(callback: CallbackQuery, state: FSMContext):
+async def edit_child_name_start(callback: CallbackQuery, state: FSMContext, actor: Identity | None):
     """Начало изменения ФИО ребёнка"""
-    session = SessionLocal()
-    try:
-        user = session.query(User).filter(User.telegram_id == callback.from_user.id).first()
-        if not user:
-            await callback.answer("Сначала зарегистрируйтесь", show_alert=True)
-            return
+    if not actor:
+        await callback.answer("Сначала зарегистрируйтесь", show_alert=True)
+        return
 
-        children = session.query(Child).filter(Child.parent_id == user.id).all()
+    session = AsyncSessionLocal()
+    try:
+        children = (await session.scalars(select(Child).where(Child.parent_id == actor.user_id))).all()
         if not children:
             await callback.message.edit_text("У вас нет добавленных детей.")
             await callback.answer()
@@ -805,22 +991,21 @@ async def edit_child_name_start(callback: CallbackQuery, state: FSMContext):
         )
         await state.set_state(UpdateChildNameState.choosing_child)
     finally:
-        session.close()
+        await session.close()
     await callback.answer()
 
 
 @router.callback_query(UpdateChildNameState.choosing_child, lambda c: c.data.startswith("edit_child:"))
-async def edit_child_name_choose(callback: CallbackQuery, state: FSMContext):
+async def edit_child_name_choose(callback: CallbackQuery, state: FSMContext, actor: Identity | None):
     """Выбор ребёнка для изменения ФИО"""
     child_id = int(callback.data.split(":")[1])
     
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
-        user = session.query(User).filter(User.telegram_id == callback.from_user.id).first()
-        child = session.query(Child).filter(
+        child = await session.scalar(select(Child).where(
             Child.id == child_id,
-            Child.parent_id == user.id
-        ).first()
+            Child.parent_id == (actor.user_id if actor else None)
+        ))
 
         if not child:
             await callback.message.edit_text("Ребёнок не найден.")
@@ -835,12 +1020,12 @@ async def edit_child_name_choose(callback: CallbackQuery, state: FSMContext):
         )
         await state.set_state(UpdateChildNameState.waiting_new_name)
     finally:
-        session.close()
+        await session.close()
     await callback.answer()
 
 
 @router.message(UpdateChildNameState.waiting_new_name)
-async def edit_child_name_process(message: Message, state: FSMContext):
+async def edit_child_name_process(message: Message, state: FSMContext, actor: Identity | None):
     """Обработка нового ФИО ребёнка"""
     new_full_name = " ".join((message.text or "").split())
     
@@ -851,13 +1036,12 @@ async def edit_child_name_process(message: Message, state: FSMContext):
     data = await state.get_data()
     child_id = data.get("child_id")
 
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
-        user = session.query(User).filter(User.telegram_id == message.from_user.id).first()
-        child = session.query(Child).filter(
+        child = await session.scalar(select(Child).where(
             Child.id == child_id,
-            Child.parent_id == user.id
-        ).first()
+            Child.parent_id == (actor.user_id if actor else None)
+        ))
 
         if not child:
             await message.answer("Ошибка: ребёнок не найден.")
@@ -866,7 +1050,8 @@ async def edit_child_name_process(message: Message, state: FSMContext):
 
         old_name = child.full_name
         child.full_name = new_full_name
-        session.commit()
+        await session.commit()
+        invalidate_roster(child.class_name)
 
         await message.answer(
             f"✅ ФИО ребёнка успешно изменено:\n"
@@ -876,7 +1061,7 @@ async def edit_child_name_process(message: Message, state: FSMContext):
             reply_markup=parent_main_keyboard()
         )
     finally:
-        session.close()
+        await session.close()
     await state.clear()
 
 
@@ -887,9 +1072,9 @@ async def edit_child_name_process(message: Message, state: FSMContext):
 @router.callback_query(lambda c: c.data == "edit_phone")
 async def edit_phone_start_callback(callback: CallbackQuery, state: FSMContext):
     """Начало изменения номера телефона через настройки"""
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
-        user = session.query(User).filter(User.telegram_id == callback.from_user.id).first()
+        user = await session.scalar(select(User).where(User.telegram_id == callback.from_user.id))
         if not user:
             await callback.answer("Сначала зарегистрируйтесь", show_alert=True)
             return
@@ -901,5 +1086,5 @@ async def edit_phone_start_callback(callback: CallbackQuery, state: FSMContext):
         )
         await state.set_state(UpdatePhoneState.waiting_phone)
     finally:
-        session.close()
+        await session.close()
     await callback.answer()
\ No newline at end of file
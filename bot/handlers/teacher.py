@@ -3,7 +3,9 @@ from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 
 from bot.config import ADMIN_IDS
-from bot.db.database import SessionLocal
+from sqlalchemy import select, delete
+
+from bot.db.database import AsyncSessionLocal
 from bot.db.models import User, Teacher, TeacherClass, Child, Subject, Grade, Comment, Homework
 from bot.states.grade import GradeState
 from bot.states.comment import CommentState
@@ -17,6 +19,15 @@ from bot.keyboards.teacher import (
     teacher_message_type_keyboard
 )
 from bot.keyboards.admin import teacher_verify_keyboard
+from bot.services import (
+    Identity,
+    invalidate_identity,
+    get_class_roster,
+    start_broadcast,
+    enqueue_notification,
+    notify_outbox,
+)
+from bot.handlers.text_commands import text_commands
 
 
 router = Router()
@@ -80,9 +91,9 @@ async def teacher_classes(message: Message, state: FSMContext):
         await message.answer("Не нашёл классы. Введите ещё раз, пример: 1А, 5В")
         return
 
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
-        user = session.query(User).filter(User.telegram_id == message.from_user.id).first()
+        user = await session.scalar(select(User).where(User.telegram_id == message.from_user.id))
         if not user:
             await message.answer("Сначала зарегистрируйтесь как родитель.")
             await state.clear()
@@ -90,18 +101,18 @@ async def teacher_classes(message: Message, state: FSMContext):
 
         # Обновляем ФИО
         user.full_name = full_name
-        session.commit()
+        await session.commit()
 
         # Находим или создаём предмет
-        subject = session.query(Subject).filter(Subject.name == subject_name).first()
+        subject = await session.scalar(select(Subject).where(Subject.name == subject_name))
         if not subject:
             subject = Subject(name=subject_name)
             session.add(subject)
-            session.commit()
-            session.refresh(subject)
+            await session.commit()
+            await session.refresh(subject)
 
         # Находим или создаём учителя
-        teacher = session.query(Teacher).filter(Teacher.user_id == user.id).first()
+        teacher = await session.scalar(select(Teacher).where(Teacher.user_id == user.id))
         if not teacher:
             teacher = Teacher(
                 user_id=user.id,
@@ -110,27 +121,28 @@ async def teacher_classes(message: Message, state: FSMContext):
                 is_verified=False
             )
             session.add(teacher)
-            session.commit()
-            session.refresh(teacher)
+            await session.commit()
+            await session.refresh(teacher)
         else:
             # Обновляем предмет, если заявка уже была
             teacher.subject_id = subject.id
             teacher.status = "pending"
-            session.commit()
+            await session.commit()
 
         # Обновляем классы
-        session.query(TeacherClass).filter(TeacherClass.teacher_id == teacher.id).delete()
-        session.commit()
+        await session.execute(delete(TeacherClass).where(TeacherClass.teacher_id == teacher.id))
+        await session.commit()
 
         for cls in classes:
             session.add(TeacherClass(teacher_id=teacher.id, class_name=cls))
-        session.commit()
+        await session.commit()
+        invalidate_identity(message.from_user.id)
 
         user_db_id = user.id
         teacher_name = user.full_name
 
     finally:
-        session.close()
+        await session.close()
 
     # Уведомляем админов
     for admin_tg in ADMIN_IDS:
@@ -154,7 +166,7 @@ async def teacher_classes(message: Message, state: FSMContext):
     await state.clear()
 
 
-@router.message(F.text == "🚪 Выйти из режима учителя")
+@text_commands.handler("🚪 Выйти из режима учителя")
 async def teacher_exit(message: Message, state: FSMContext):
     """Выход из режима учителя"""
     await state.clear()
@@ -170,55 +182,41 @@ async def teacher_exit(message: Message, state: FSMContext):
     )
 
 
-@router.message(F.text == "📚 Мои классы")
-async def teacher_my_classes(message: Message):
-    session = SessionLocal()
-    try:
-        user = session.query(User).filter(User.telegram_id == message.from_user.id).first()
-        if not user:
-            await message.answer("Сначала зарегистрируйтесь как родитель.")
-            return
+@text_commands.handler("📚 Мои классы")
+async def teacher_my_classes(message: Message, actor: Identity | None):
+    if not actor:
+        await message.answer("Сначала зарегистрируйтесь как родитель.")
+        return
 
-        teacher = session.query(Teacher).filter(Teacher.user_id == user.id).first()
-        if not teacher or not teacher.is_verified:
-            await message.answer("Доступ только для подтверждённых учителей.")
-            return
+    teacher = actor.teacher
+    if not teacher or not teacher.is_verified:
+        await message.answer("Доступ только для подтверждённых учителей.")
+        return
 
-        classes = session.query(TeacherClass).filter(TeacherClass.teacher_id == teacher.id).all()
-        if not classes:
-            await message.answer("Классы не назначены.")
-            return
+    if not teacher.classes:
+        await message.answer("Классы не назначены.")
+        return
 
-        cls_list = [c.class_name for c in classes]
-        await message.answer("Ваши классы:\n" + "\n".join([f"• {c}" for c in cls_list]))
-    finally:
-        session.close()
+    await message.answer("Ваши классы:\n" + "\n".join([f"• {c}" for c in teacher.classes]))
 
 
-@router.message(F.text == "✉️ Сообщение родителям")
-async def teacher_message_start(message: Message, state: FSMContext):
-    session = SessionLocal()
-    try:
-        user = session.query(User).filter(User.telegram_id == message.from_user.id).first()
-        if not user:
-            await message.answer("Сначала зарегистрируйтесь как родитель.")
-            return
+@text_commands.handler("✉️ Сообщение родителям")
+async def teacher_message_start(message: Message, state: FSMContext, actor: Identity | None):
+    if not actor:
+        await message.answer("Сначала зарегистрируйтесь как родитель.")
+        return
 
-        teacher = session.query(Teacher).filter(Teacher.user_id == user.id).first()
-        if not teacher or not teacher.is_verified:
-            await message.answer("Доступ только для подтверждённых учителей.")
-            return
+    teacher = actor.teacher
+    if not teacher or not teacher.is_verified:
+        await message.answer("Доступ только для подтверждённых учителей.")
+        return
 
-        classes = session.query(TeacherClass).filter(TeacherClass.teacher_id == teacher.id).all()
-        if not classes:
-            await message.answer("Вам не назначены классы. Обратитесь к администратору.")
-            return
+    if not teacher.classes:
+        await message.answer("Вам не назначены классы. Обратитесь к администратору.")
+        return
 
-        cls_list = [c.class_name for c in classes]
-        await message.answer("Выберите класс:", reply_markup=teacher_classes_keyboard(cls_list))
-        await state.set_state(TeacherMessageState.choosing_class)
-    finally:
-        session.close()
+    await message.answer("Выберите класс:", reply_markup=teacher_classes_keyboard(list(teacher.classes)))
+    await state.set_state(TeacherMessageState.choosing_class)
 
 
 @router.callback_query(TeacherMessageState.choosing_class, F.data.startswith("tmsg_class:"))
@@ -259,7 +257,7 @@ async def teacher_choose_type(callback: CallbackQuery, state: FSMContext):
 
 
 @router.message(TeacherMessageState.entering_text)
-async def teacher_enter_text(message: Message, state: FSMContext):
+async def teacher_enter_text(message: Message, state: FSMContext, actor: Identity | None):
     data = await state.get_data()
     class_name = (data.get("class_name") or "").strip().upper()
     msg_type = (data.get("message_type") or "").strip()
@@ -281,55 +279,46 @@ async def teacher_enter_text(message: Message, state: FSMContext):
     }
     type_title = type_map.get(msg_type, msg_type)
 
-    session = SessionLocal()
-    try:
-        user = session.query(User).filter(User.telegram_id == message.from_user.id).first()
-        if not user:
-            await message.answer("Сначала зарегистрируйтесь как родитель.")
-            await state.clear()
-            return
+    if not actor:
+        await message.answer("Сначала зарегистрируйтесь как родитель.")
+        await state.clear()
+        return
 
-        teacher = session.query(Teacher).filter(Teacher.user_id == user.id).first()
-        if not teacher or not teacher.is_verified:
-            await message.answer("Доступ только для подтверждённых учителей.")
-            await state.clear()
-            return
+    teacher = actor.teacher
+    if not teacher or not teacher.is_verified:
+        await message.answer("Доступ только для подтверждённых учителей.")
+        await state.clear()
+        return
 
-        allowed = session.query(TeacherClass).filter(
-            TeacherClass.teacher_id == teacher.id,
-            TeacherClass.class_name == class_name
-        ).first()
-        if not allowed:
-            await message.answer("Этот класс не назначен вам.")
-            await state.clear()
-            return
+    if class_name not in teacher.classes:
+        await message.answer("Этот класс не назначен вам.")
+        await state.clear()
+        return
 
-        children = session.query(Child).filter(Child.class_name == class_name).all()
-        if not children:
-            await message.answer("В этом классе пока нет добавленных детей у родителей.")
-            await state.clear()
-            return
+    children = await get_class_roster(class_name)
+    if not children:
+        await message.answer("В этом классе пока нет добавленных детей у родителей.")
+        await state.clear()
+        return
 
+    session = AsyncSessionLocal()
+    try:
         parent_ids = list({c.parent_id for c in children})
-        parents = session.query(User).filter(User.id.in_(parent_ids)).all()
+        parent_chat_ids = (await session.scalars(select(User.telegram_id).where(User.id.in_(parent_ids)))).all()
     finally:
-        session.close()
-
-    delivered, failed = 0, 0
-    for p in parents:
-        try:
-            await message.bot.send_message(
-                p.telegram_id,
-                "🏫 Сообщение от учителя\n"
-                f"Класс: {class_name}\n"
-                f"Тема: {type_title}\n\n"
-                f"{text}"
-            )
-            delivered += 1
-        except Exception:
-            failed += 1
-
-    await message.answer(f"Готово.\nОтправлено родителям: {delivered}\nНе доставлено: {failed}")
+        await session.close()
+
+    # Рассылка идёт в фоне, прогресс и итог приходят учителю отдельным сообщением
+    start_broadcast(
+        message.bot,
+        parent_chat_ids,
+        "🏫 Сообщение от учителя\n"
+        f"Класс: {class_name}\n"
+        f"Тема: {type_title}\n\n"
+        f"{text}",
+        report_chat_id=message.chat.id,
+        title=f"✉️ Сообщение родителям класса {class_name}",
+    )
     await state.clear()
 
 
@@ -337,34 +326,27 @@ async def teacher_enter_text(message: Message, state: FSMContext):
 # ОЦЕНКИ
 # =========================
 
-@router.message(F.text == "📝 Поставить оценку")
-async def grade_start(message: Message, state: FSMContext):
+@text_commands.handler("📝 Поставить оценку")
+async def grade_start(message: Message, state: FSMContext, actor: Identity | None):
     """Начало процесса выставления оценки"""
-    session = SessionLocal()
-    try:
-        user = session.query(User).filter(User.telegram_id == message.from_user.id).first()
-        if not user:
-            await message.answer("Сначала зарегистрируйтесь.")
-            return
+    if not actor:
+        await message.answer("Сначала зарегистрируйтесь.")
+        return
 
-        teacher = session.query(Teacher).filter(Teacher.user_id == user.id).first()
-        if not teacher or (teacher.status != "approved" and not teacher.is_verified):
-            await message.answer("Доступ только для подтверждённых учителей.")
-            return
+    teacher = actor.teacher
+    if not teacher or not teacher.is_approved:
+        await message.answer("Доступ только для подтверждённых учителей.")
+        return
 
-        classes = session.query(TeacherClass).filter(TeacherClass.teacher_id == teacher.id).all()
-        if not classes:
-            await message.answer("Вам не назначены классы.")
-            return
+    if not teacher.classes:
+        await message.answer("Вам не назначены классы.")
+        return
 
-        class_list = [c.class_name for c in classes]
-        await message.answer(
-            "Выберите класс:",
-            reply_markup=teacher_classes_keyboard(class_list)
-        )
-        await state.set_state(GradeState.choosing_class)
-    finally:
-        session.close()
+    await message.answer(
+        "Выберите класс:",
+        reply_markup=teacher_classes_keyboard(list(teacher.classes))
+    )
+    await state.set_state(GradeState.choosing_class)
 
 
 @router.callback_query(GradeState.choosing_class, F.data.startswith("tmsg_class:"))
@@ -373,61 +355,56 @@ async def grade_choose_class(callback: CallbackQuery, state: FSMContext):
     class_name = callback.data.split(":", 1)[1].strip().upper()
     await state.update_data(class_name=class_name)
     
-    session = SessionLocal()
-    try:
-        children = session.query(Child).filter(Child.class_name == class_name).all()
-        if not children:
-            await callback.message.edit_text("В этом классе нет учеников.")
-            await state.clear()
-            return
+    children = await get_class_roster(class_name)
+    if not children:
+        await callback.message.edit_text("В этом классе нет учеников.")
+        await state.clear()
+        return
 
-        from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-        keyboard = []
-        for child in children:
-            keyboard.append([InlineKeyboardButton(
-                text=child.full_name,
-                callback_data=f"grade_student:{child.id}"
-            )])
+    from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+    keyboard = []
+    for child in children:
+        keyboard.append([InlineKeyboardButton(
+            text=child.full_name,
+            callback_data=f"grade_student:{child.id}"
+        )])
 
-        await callback.message.edit_text(
-            f"Класс: {class_name}\nВыберите ученика:",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard)
-        )
-        await state.set_state(GradeState.choosing_student)
-    finally:
-        session.close()
+    await callback.message.edit_text(
+        f"Класс: {class_name}\nВыберите ученика:",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard)
+    )
+    await state.set_state(GradeState.choosing_student)
     await callback.answer()
 
 
 @router.callback_query(GradeState.choosing_student, F.data.startswith("grade_student:"))
-async def grade_choose_student(callback: CallbackQuery, state: FSMContext):
+async def grade_choose_student(callback: CallbackQuery, state: FSMContext, actor: Identity | None):
     """Выбор ученика для оценки"""
     child_id = int(callback.data.split(":")[1])
     await state.update_data(child_id=child_id)
     
-    session = SessionLocal()
+    teacher = actor.teacher if actor else None
+
+    session = AsyncSessionLocal()
     try:
-        user = session.query(User).filter(User.telegram_id == callback.from_user.id).first()
-        teacher = session.query(Teacher).filter(Teacher.user_id == user.id).first()
-        
         if not teacher or not teacher.subject_id:
             await callback.message.edit_text("У вас не назначен предмет.")
             await state.clear()
             return
 
-        subject = session.query(Subject).filter(Subject.id == teacher.subject_id).first()
+        subject = await session.scalar(select(Subject).where(Subject.id == teacher.subject_id))
         await callback.message.edit_text(
             f"Предмет: {subject.name if subject else 'Не указан'}\n"
             "Введите оценку (2, 3, 4, 5):"
         )
         await state.set_state(GradeState.entering_grade)
     finally:
-        session.close()
+        await session.close()
     await callback.answer()
 
 
 @router.message(GradeState.entering_grade)
-async def grade_enter(message: Message, state: FSMContext):
+async def grade_enter(message: Message, state: FSMContext, actor: Identity | None):
     """Ввод оценки"""
     try:
         grade_value = int(message.text.strip())
@@ -442,11 +419,11 @@ async def grade_enter(message: Message, state: FSMContext):
     child_id = data.get("child_id")
     class_name = data.get("class_name")
 
-    session = SessionLocal()
+    teacher = actor.teacher if actor else None
+
+    session = AsyncSessionLocal()
     try:
-        user = session.query(User).filter(User.telegram_id == message.from_user.id).first()
-        teacher = session.query(Teacher).filter(Teacher.user_id == user.id).first()
-        child = session.query(Child).filter(Child.id == child_id).first()
+        child = await session.scalar(select(Child).where(Child.id == child_id))
 
         if not teacher or not child or not teacher.subject_id:
             await message.answer("Ошибка данных.")
@@ -456,37 +433,37 @@ async def grade_enter(message: Message, state: FSMContext):
         # Создаём оценку
         grade = Grade(
             child_id=child_id,
-            teacher_id=teacher.id,
+            teacher_id=teacher.teacher_id,
             subject_id=teacher.subject_id,
             grade=grade_value,
             date=date.today()
         )
         session.add(grade)
-        session.commit()
 
-        # Уведомляем родителя
-        parent = session.query(User).filter(User.id == child.parent_id).first()
-        subject = session.query(Subject).filter(Subject.id == teacher.subject_id).first()
-        
+        # Уведомляем родителя (через outbox, в той же транзакции)
+        parent = await session.scalar(select(User).where(User.id == child.parent_id))
+        subject = await session.scalar(select(Subject).where(Subject.id == teacher.subject_id))
+
         if parent:
-            try:
-                await message.bot.send_message(
-                    parent.telegram_id,
-                    f"📝 Новая оценка\n\n"
-                    f"Ученик: {child.full_name}\n"
-                    f"Предмет: {subject.name if subject else 'Не указан'}\n"
-                    f"Оценка: {grade_value}\n"
-                    f"Дата: {date.today().strftime('%d.%m.%Y')}"
-                )
-            except:
-                pass
+            enqueue_notification(
+                session,
+                parent.telegram_id,
+                f"📝 Новая оценка\n\n"
+                f"Ученик: {child.full_name}\n"
+                f"Предмет: {subject.name if subject else 'Не указан'}\n"
+                f"Оценка: {grade_value}\n"
+                f"Дата: {date.today().strftime('%d.%m.%Y')}"
+            )
+
+        await session.commit()
+        notify_outbox()
 
         await message.answer(
             f"✅ Оценка {grade_value} выставлена ученику {child.full_name}",
             reply_markup=teacher_main_keyboard()
         )
     finally:
-        session.close()
+        await session.close()
     await state.clear()
 
 
@@ -494,34 +471,27 @@ async def grade_enter(message: Message, state: FSMContext):
 # КОММЕНТАРИИ
 # =========================
 
-@router.message(F.text == "💬 Добавить комментарий ученику")
-async def comment_start(message: Message, state: FSMContext):
+@text_commands.handler("💬 Добавить комментарий ученику")
+async def comment_start(message: Message, state: FSMContext, actor: Identity | None):
     """Начало процесса добавления комментария"""
-    session = SessionLocal()
-    try:
-        user = session.query(User).filter(User.telegram_id == message.from_user.id).first()
-        if not user:
-            await message.answer("Сначала зарегистрируйтесь.")
-            return
+    if not actor:
+        await message.answer("Сначала зарегистрируйтесь.")
+        return
 
-        teacher = session.query(Teacher).filter(Teacher.user_id == user.id).first()
-        if not teacher or (teacher.status != "approved" and not teacher.is_verified):
-            await message.answer("Доступ только для подтверждённых учителей.")
-            return
+    teacher = actor.teacher
+    if not teacher or not teacher.is_approved:
+        await message.answer("Доступ только для подтверждённых учителей.")
+        return
 
-        classes = session.query(TeacherClass).filter(TeacherClass.teacher_id == teacher.id).all()
-        if not classes:
-            await message.answer("Вам не назначены классы.")
-            return
+    if not teacher.classes:
+        await message.answer("Вам не назначены классы.")
+        return
 
-        class_list = [c.class_name for c in classes]
-        await message.answer(
-            "Выберите класс:",
-            reply_markup=teacher_classes_keyboard(class_list)
-        )
-        await state.set_state(CommentState.choosing_class)
-    finally:
-        session.close()
+    await message.answer(
+        "Выберите класс:",
+        reply_markup=teacher_classes_keyboard(list(teacher.classes))
+    )
+    await state.set_state(CommentState.choosing_class)
 
 
 @router.callback_query(CommentState.choosing_class, F.data.startswith("tmsg_class:"))
@@ -530,29 +500,25 @@ async def comment_choose_class(callback: CallbackQuery, state: FSMContext):
     class_name = callback.data.split(":", 1)[1].strip().upper()
     await state.update_data(class_name=class_name)
     
-    session = SessionLocal()
-    try:
-        children = session.query(Child).filter(Child.class_name == class_name).all()
-        if not children:
-            await callback.message.edit_text("В этом классе нет учеников.")
-            await state.clear()
-            return
+    children = await get_class_roster(class_name)
+    if not children:
+        await callback.message.edit_text("В этом классе нет учеников.")
+        await state.clear()
+        return
 
-        from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-        keyboard = []
-        for child in children:
-            keyboard.append([InlineKeyboardButton(
-                text=child.full_name,
-                callback_data=f"comment_student:{child.id}"
-            )])
+    from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+    keyboard = []
+    for child in children:
+        keyboard.append([InlineKeyboardButton(
+            text=child.full_name,
+            callback_data=f"comment_student:{child.id}"
+        )])
 
-        await callback.message.edit_text(
-            f"Класс: {class_name}\nВыберите ученика:",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard)
-        )
-        await state.set_state(CommentState.choosing_student)
-    finally:
-        session.close()
+    await callback.message.edit_text(
+        f"Класс: {class_name}\nВыберите ученика:",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard)
+    )
+    await state.set_state(CommentState.choosing_student)
     await callback.answer()
 
 
@@ -590,7 +556,7 @@ async def comment_choose_type(callback: CallbackQuery, state: FSMContext):
 
 
 @router.message(CommentState.entering_text)
-async def comment_enter_text(message: Message, state: FSMContext):
+async def comment_enter_text(message: Message, state: FSMContext, actor: Identity | None):
     """Ввод текста комментария"""
     text = (message.text or "").strip()
     if not text:
@@ -601,11 +567,11 @@ async def comment_enter_text(message: Message, state: FSMContext):
     child_id = data.get("child_id")
     comment_type = data.get("comment_type")
 
-    session = SessionLocal()
+    teacher = actor.teacher if actor else None
+
+    session = AsyncSessionLocal()
     try:
-        user = session.query(User).filter(User.telegram_id == message.from_user.id).first()
-        teacher = session.query(Teacher).filter(Teacher.user_id == user.id).first()
-        child = session.query(Child).filter(Child.id == child_id).first()
+        child = await session.scalar(select(Child).where(Child.id == child_id))
 
         if not teacher or not child:
             await message.answer("Ошибка данных.")
@@ -615,39 +581,39 @@ async def comment_enter_text(message: Message, state: FSMContext):
         # Создаём комментарий
         comment = Comment(
             child_id=child_id,
-            teacher_id=teacher.id,
+            teacher_id=teacher.teacher_id,
             comment_type=comment_type,
             text=text
         )
         session.add(comment)
-        session.commit()
 
-        # Уведомляем родителя
-        parent = session.query(User).filter(User.id == child.parent_id).first()
+        # Уведомляем родителя (через outbox, в той же транзакции)
+        parent = await session.scalar(select(User).where(User.id == child.parent_id))
         type_map = {
             "behavior": "Поведение",
             "attendance": "Посещаемость",
             "performance": "Успеваемость",
         }
-        
+
         if parent:
-            try:
-                await message.bot.send_message(
-                    parent.telegram_id,
-                    f"💬 Комментарий учителя\n\n"
-                    f"Ученик: {child.full_name}\n"
-                    f"Тип: {type_map.get(comment_type, comment_type)}\n\n"
-                    f"{text}"
-                )
-            except:
-                pass
+            enqueue_notification(
+                session,
+                parent.telegram_id,
+                f"💬 Комментарий учителя\n\n"
+                f"Ученик: {child.full_name}\n"
+                f"Тип: {type_map.get(comment_type, comment_type)}\n\n"
+                f"{text}"
+            )
+
+        await session.commit()
+        notify_outbox()
 
         await message.answer(
             f"✅ Комментарий добавлен для {child.full_name}",
             reply_markup=teacher_main_keyboard()
         )
     finally:
-        session.close()
+        await session.close()
     await state.clear()
 
 
@@ -655,53 +621,45 @@ async def comment_enter_text(message: Message, state: FSMContext):
 # ДОМАШНИЕ ЗАДАНИЯ
 # =========================
 
-@router.message(F.text == "📚 Домашнее задание")
-async def homework_start(message: Message, state: FSMContext):
+@text_commands.handler("📚 Домашнее задание")
+async def homework_start(message: Message, state: FSMContext, actor: Identity | None):
     """Начало процесса создания домашнего задания"""
-    session = SessionLocal()
-    try:
-        user = session.query(User).filter(User.telegram_id == message.from_user.id).first()
-        if not user:
-            await message.answer("Сначала зарегистрируйтесь.")
-            return
+    if not actor:
+        await message.answer("Сначала зарегистрируйтесь.")
+        return
 
-        teacher = session.query(Teacher).filter(Teacher.user_id == user.id).first()
-        if not teacher or (teacher.status != "approved" and not teacher.is_verified):
-            await message.answer("Доступ только для подтверждённых учителей.")
-            return
+    teacher = actor.teacher
+    if not teacher or not teacher.is_approved:
+        await message.answer("Доступ только для подтверждённых учителей.")
+        return
 
-        classes = session.query(TeacherClass).filter(TeacherClass.teacher_id == teacher.id).all()
-        if not classes:
-            await message.answer("Вам не назначены классы.")
-            return
+    if not teacher.classes:
+        await message.answer("Вам не назначены классы.")
+        return
 
-        class_list = [c.class_name for c in classes]
-        await message.answer(
-            "Выберите класс:",
-            reply_markup=teacher_classes_keyboard(class_list)
-        )
-        await state.set_state(HomeworkState.choosing_class)
-    finally:
-        session.close()
+    await message.answer(
+        "Выберите класс:",
+        reply_markup=teacher_classes_keyboard(list(teacher.classes))
+    )
+    await state.set_state(HomeworkState.choosing_class)
 
 
 @router.callback_query(HomeworkState.choosing_class, F.data.startswith("tmsg_class:"))
-async def homework_choose_class(callback: CallbackQuery, state: FSMContext):
+async def homework_choose_class(callback: CallbackQuery, state: FSMContext, actor: Identity | None):
     """Выбор класса для ДЗ"""
     class_name = callback.data.split(":", 1)[1].strip().upper()
     await state.update_data(class_name=class_name)
     
-    session = SessionLocal()
+    teacher = actor.teacher if actor else None
+
+    session = AsyncSessionLocal()
     try:
-        user = session.query(User).filter(User.telegram_id == callback.from_user.id).first()
-        teacher = session.query(Teacher).filter(Teacher.user_id == user.id).first()
-        
         if not teacher or not teacher.subject_id:
             await callback.message.edit_text("У вас не назначен предмет.")
             await state.clear()
             return
 
-        subject = session.query(Subject).filter(Subject.id == teacher.subject_id).first()
+        subject = await session.scalar(select(Subject).where(Subject.id == teacher.subject_id))
         await callback.message.edit_text(
             f"Класс: {class_name}\n"
             f"Предмет: {subject.name if subject else 'Не указан'}\n\n"
@@ -709,7 +667,7 @@ async def homework_choose_class(callback: CallbackQuery, state: FSMContext):
         )
         await state.set_state(HomeworkState.entering_text)
     finally:
-        session.close()
+        await session.close()
     await callback.answer()
 
 
@@ -730,7 +688,7 @@ async def homework_enter_text(message: Message, state: FSMContext):
 
 
 @router.message(HomeworkState.entering_due_date)
-async def homework_enter_due_date(message: Message, state: FSMContext):
+async def homework_enter_due_date(message: Message, state: FSMContext, actor: Identity | None):
     """Ввод даты сдачи ДЗ"""
     try:
         from datetime import datetime
@@ -743,11 +701,10 @@ async def homework_enter_due_date(message: Message, state: FSMContext):
     class_name = data.get("class_name")
     text = data.get("homework_text")
 
-    session = SessionLocal()
-    try:
-        user = session.query(User).filter(User.telegram_id == message.from_user.id).first()
-        teacher = session.query(Teacher).filter(Teacher.user_id == user.id).first()
+    teacher = actor.teacher if actor else None
 
+    session = AsyncSessionLocal()
+    try:
         if not teacher or not teacher.subject_id:
             await message.answer("Ошибка данных.")
             await state.clear()
@@ -755,40 +712,37 @@ async def homework_enter_due_date(message: Message, state: FSMContext):
 
         # Создаём ДЗ
         homework = Homework(
-            teacher_id=teacher.id,
+            teacher_id=teacher.teacher_id,
             class_name=class_name,
             subject_id=teacher.subject_id,
             text=text,
             due_date=due_date
         )
         session.add(homework)
-        session.commit()
+        await session.commit()
 
         # Отправляем родителям
-        children = session.query(Child).filter(Child.class_name == class_name).all()
+        children = await get_class_roster(class_name)
         parent_ids = list({c.parent_id for c in children})
-        parents = session.query(User).filter(User.id.in_(parent_ids)).all()
-        
-        subject = session.query(Subject).filter(Subject.id == teacher.subject_id).first()
-        delivered = 0
-        for p in parents:
-            try:
-                await message.bot.send_message(
-                    p.telegram_id,
-                    f"📚 Домашнее задание\n\n"
-                    f"Класс: {class_name}\n"
-                    f"Предмет: {subject.name if subject else 'Не указан'}\n"
-                    f"Сдать до: {due_date.strftime('%d.%m.%Y')}\n\n"
-                    f"{text}"
-                )
-                delivered += 1
-            except:
-                pass
+        parent_chat_ids = (await session.scalars(select(User.telegram_id).where(User.id.in_(parent_ids)))).all()
+
+        subject = await session.scalar(select(Subject).where(Subject.id == teacher.subject_id))
 
         await message.answer(
-            f"✅ Домашнее задание создано и отправлено родителям ({delivered} уведомлений)",
+            "✅ Домашнее задание создано, рассылка родителям запущена",
             reply_markup=teacher_main_keyboard()
         )
+        start_broadcast(
+            message.bot,
+            parent_chat_ids,
+            f"📚 Домашнее задание\n\n"
+            f"Класс: {class_name}\n"
+            f"Предмет: {subject.name if subject else 'Не указан'}\n"
+            f"Сдать до: {due_date.strftime('%d.%m.%Y')}\n\n"
+            f"{text}",
+            report_chat_id=message.chat.id,
+            title=f"📚 Домашнее задание для класса {class_name}",
+        )
     finally:
-        session.close()
+        await session.close()
     await state.clear()
@@ -0,0 +1,59 @@
+from typing import Any, Callable, Dict
+
+from aiogram import Router
+from aiogram.dispatcher.event.handler import CallableObject
+from aiogram.filters import Filter
+from aiogram.types import Message
+
+
+class TextCommandIndex(Filter):
+    """
+    Индекс кнопок главного меню: точный текст кнопки -> хэндлер.
+
+    Вместо десятков фильтров `m.text == "..."`, которые aiogram проверял бы
+    по очереди во всех роутерах, один фильтр находит хэндлер поиском в dict.
+    Хэндлеры получают зависимости (state, actor, bot, ...) так же, как обычные:
+    через CallableObject aiogram.
+
+    Роутер индекса подключается первым, поэтому кнопка меню срабатывает
+    в любом состоянии FSM, а не уходит как ввод (ФИО, текст задания и т.п.).
+    Это намеренно: ввод, совпадающий с подписью кнопки вместе с эмодзи,
+    тоже будет принят за кнопку.
+    """
+
+    def __init__(self):
+        self._handlers: Dict[str, CallableObject] = {}
+
+    def handler(self, *texts: str) -> Callable:
+        """Регистрирует хэндлер для кнопки и её вариантов без эмодзи."""
+
+        def decorator(callback: Callable) -> Callable:
+            for text in texts:
+                if text in self._handlers:
+                    raise ValueError(f"Кнопка {text!r} уже зарегистрирована")
+            handler = CallableObject(callback)
+            for text in texts:
+                self._handlers[text] = handler
+            return callback
+
+        return decorator
+
+    def __contains__(self, text: str) -> bool:
+        return text in self._handlers
+
+    async def __call__(self, message: Message) -> bool | Dict[str, Any]:
+        handler = self._handlers.get(message.text) if message.text else None
+        if handler is None:
+            return False
+        return {"text_command": handler}
+
+
+text_commands = TextCommandIndex()
+
+# Подключается первым (см. TextCommandIndex)
+router = Router(name="text_commands")
+
+
+@router.message(text_commands)
+async def dispatch_text_command(message: Message, text_command: CallableObject, **data: Any):
+    return await text_command.call(message, **data)
@@ -27,6 +27,31 @@ def guard_actions_keyboard(pickup_id: int):
     )
 
 
+def guard_group_keyboard(parent_id: int, pickups):
+    """
+    Кнопки для общей заявки на нескольких детей одного родителя.
+
+    pickups — список (pickup_id, ФИО ребёнка) ещё не переданных детей.
+    """
+    keyboard = [
+        [
+            InlineKeyboardButton(
+                text=f"Передан: {child_name}",
+                callback_data=f"pickup_done:{pickup_id}"
+            )
+        ]
+        for pickup_id, child_name in pickups
+    ]
+    if len(pickups) > 1:
+        keyboard.append([
+            InlineKeyboardButton(
+                text="Переданы все",
+                callback_data=f"pickup_done_all:{parent_id}"
+            )
+        ])
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+
 def teacher_verify_keyboard(user_id: int):
     return InlineKeyboardMarkup(
         inline_keyboard=[
@@ -30,6 +30,26 @@ def children_inline_keyboard(children):
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
 
+def children_multiselect_keyboard(children, selected):
+    """
+    Выбор нескольких детей для заявки на выдачу.
+
+    children — список (id, ФИО, класс), selected — id уже отмеченных детей.
+    """
+    keyboard = []
+    for child_id, full_name, class_name in children:
+        mark = "☑️" if child_id in selected else "⬜️"
+        keyboard.append([
+            InlineKeyboardButton(
+                text=f"{mark} {full_name} ({class_name})",
+                callback_data=f"pickup_toggle:{child_id}"
+            )
+        ])
+    keyboard.append([InlineKeyboardButton(text="👨‍👩‍👧 Все дети", callback_data="pickup_all")])
+    keyboard.append([InlineKeyboardButton(text="➡️ Далее", callback_data="pickup_next")])
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+
 def children_edit_keyboard(children):
     """Клавиатура для выбора ребёнка для редактирования"""
     keyboard = []
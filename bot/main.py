@@ -1,13 +1,36 @@
 import asyncio
-import sqlite3
 import logging
-from aiogram import Bot, Dispatcher
+from typing import Optional
 
-from bot.config import BOT_TOKEN
-from bot.db.database import engine, Base
-from bot.handlers import parent, admin, common, admin_manage, teacher, attendance
-from bot.middlewares import BlockCheckMiddleware
-from bot.services import PAAdapter
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from bot.config import (
+    BOT_TOKEN,
+    GUARD_CHANNEL_ID,
+    PICKUP_BOARD_ENABLED,
+    BOT_RUN_MODE,
+    WEBHOOK_BASE_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBAPP_HOST,
+    WEBAPP_PORT,
+    STARTUP_BACKLOG_MODE,
+    METRICS_ENABLED,
+)
+from bot.db.migrations import run_migrations
+from bot.db.fsm_storage import SQLiteStorage
+from bot.handlers import parent, admin, common, admin_manage, teacher, attendance, text_commands
+from bot.middlewares import (
+    ActorContextMiddleware,
+    BlockCheckMiddleware,
+    HandlerMetricsMiddleware,
+    PriorityLaneMiddleware,
+    UserSerialMiddleware,
+    UpdateMetricsMiddleware,
+)
+from bot.services import start_outbox_worker, start_pickup_expiry_sweeper, start_pickup_board, drain_backlog, start_metrics
 from bot.services.repeat_announce_job import start_repeat_announce_job
 
 
@@ -19,96 +42,100 @@ logging.basicConfig(
 # -----------------------------------------
 
 
-def ensure_sqlite_schema():
-    """
-    Минимальная миграция SQLite без Alembic:
-    - добавляет users.is_blocked
-    - добавляет pickup_requests.updated_at
-    - добавляет новые поля для автоголосовых объявлений
+def build_webhook_app(dp: Dispatcher, bot: Bot, secret_token: Optional[str] = WEBHOOK_SECRET) -> web.Application:
+    """aiohttp-приложение webhook: апдейты принимаются POST-запросами на WEBHOOK_PATH."""
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret_token).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot) -> None:
     """
-    db_path = "school.db"
+    Приём апдейтов через webhook: встроенный aiohttp-сервер на WEBAPP_HOST:WEBAPP_PORT.
 
-    conn = sqlite3.connect(db_path)
+    Webhook регистрируется при старте dispatcher; запросы без правильного
+    секрета отклоняет SimpleRequestHandler. При остановке (Ctrl+C/SIGTERM)
+    runner.cleanup() вызывает shutdown dispatcher — FSM и сессия бота закрываются.
+    """
+    if not WEBHOOK_BASE_URL:
+        raise RuntimeError("BOT_RUN_MODE=webhook, но WEBHOOK_BASE_URL не задан")
+
+    async def on_startup(bot: Bot) -> None:
+        # Накопившуюся очередь разбираем через getUpdates до установки webhook
+        if STARTUP_BACKLOG_MODE == "drain":
+            await drain_backlog(dp, bot)
+        await bot.set_webhook(
+            f"{WEBHOOK_BASE_URL}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            drop_pending_updates=STARTUP_BACKLOG_MODE != "drain",
+        )
+        logging.info("Webhook set: %s%s", WEBHOOK_BASE_URL, WEBHOOK_PATH)
+
+    dp.startup.register(on_startup)
+
+    app = build_webhook_app(dp, bot)
+    runner = web.AppRunner(app)
+    await runner.setup()
     try:
-        cur = conn.cursor()
-
-        # users.is_blocked
-        cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='users';")
-        if cur.fetchone() is not None:
-            cur.execute("PRAGMA table_info(users);")
-            cols = [row[1] for row in cur.fetchall()]
-            if "is_blocked" not in cols:
-                cur.execute("ALTER TABLE users ADD COLUMN is_blocked BOOLEAN DEFAULT 0;")
-                conn.commit()
-                logging.info("Column users.is_blocked added")
-
-        # pickup_requests: дополнительные поля
-        cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='pickup_requests';")
-        if cur.fetchone() is not None:
-            cur.execute("PRAGMA table_info(pickup_requests);")
-            cols = [row[1] for row in cur.fetchall()]
-            if "updated_at" not in cols:
-                cur.execute("ALTER TABLE pickup_requests ADD COLUMN updated_at DATETIME;")
-                conn.commit()
-                logging.info("Column pickup_requests.updated_at added")
-            if "last_announce_at" not in cols:
-                cur.execute("ALTER TABLE pickup_requests ADD COLUMN last_announce_at DATETIME;")
-                conn.commit()
-                logging.info("Column pickup_requests.last_announce_at added")
-            if "next_announce_at" not in cols:
-                cur.execute("ALTER TABLE pickup_requests ADD COLUMN next_announce_at DATETIME;")
-                conn.commit()
-                logging.info("Column pickup_requests.next_announce_at added")
-            if "announce_count" not in cols:
-                cur.execute("ALTER TABLE pickup_requests ADD COLUMN announce_count INTEGER DEFAULT 0;")
-                conn.commit()
-                logging.info("Column pickup_requests.announce_count added")
-            if "handed_over_at" not in cols:
-                cur.execute("ALTER TABLE pickup_requests ADD COLUMN handed_over_at DATETIME;")
-                conn.commit()
-                logging.info("Column pickup_requests.handed_over_at added")
-            if "handed_over_by" not in cols:
-                cur.execute("ALTER TABLE pickup_requests ADD COLUMN handed_over_by INTEGER;")
-                conn.commit()
-                logging.info("Column pickup_requests.handed_over_by added")
-            if "channel_message_id" not in cols:
-                cur.execute("ALTER TABLE pickup_requests ADD COLUMN channel_message_id INTEGER;")
-                conn.commit()
-                logging.info("Column pickup_requests.channel_message_id added")
-
+        await web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT).start()
+        logging.info("Webhook server listening on %s:%s", WEBAPP_HOST, WEBAPP_PORT)
+        await asyncio.Event().wait()
     finally:
-        conn.close()
-
-
+        await runner.cleanup()
 
 
 async def main():
     logging.info("Bot starting...")
 
     try:
-        # 1) Создание всех таблиц из SQLAlchemy моделей
-        Base.metadata.create_all(bind=engine)
-        logging.info("DB create_all done")
+        # 1) Версионированные миграции схемы
+        # (при актуальной версии — один SELECT без интроспекции)
+        schema_version = run_migrations()
+        logging.info("DB schema version: %s", schema_version)
 
-        # 2) Мини-миграция SQLite
-        ensure_sqlite_schema()
-        logging.info("SQLite schema ensured")
-
-        # 3) Проверка токена
+        # 2) Проверка токена
         logging.info("BOT_TOKEN present: %s", bool(BOT_TOKEN))
         if not BOT_TOKEN:
             raise RuntimeError("BOT_TOKEN is empty")
 
-        # 4) Инициализация бота
+        # 3) Инициализация бота
         bot = Bot(token=BOT_TOKEN)
-        dp = Dispatcher()
+        # FSM-состояния хранятся в БД и переживают перезапуск;
+        # при остановке dispatcher закрывает storage и дописывает очередь
+        storage = SQLiteStorage()
+        dp = Dispatcher(storage=storage)
+
+        # Метрики: время апдейта по хэндлерам, запросы к БД, вызовы Telegram API;
+        # внешним middleware регистрируется первым — время включает ожидание в очередях
+        if METRICS_ENABLED:
+            await start_metrics(bot)
+            dp.update.outer_middleware(UpdateMetricsMiddleware())
+            dp.message.middleware(HandlerMetricsMiddleware())
+            dp.callback_query.middleware(HandlerMetricsMiddleware())
+
+        # Апдейты одного пользователя — по очереди, разных — параллельно;
+        # регистрируется раньше полос, чтобы место в полосе и общее место
+        # воркера занимал только тот, чья очередь подошла
+        dp.update.outer_middleware(UserSerialMiddleware())
+
+        # Полосы выполнения: заявки на выдачу не ждут за отчётами,
+        # в часы выдачи отчёты при перегрузке сбрасываются
+        dp.update.outer_middleware(PriorityLaneMiddleware())
+
+        # Загружаем actor (пользователь/учитель/классы) один раз на апдейт
+        dp.message.middleware(ActorContextMiddleware())
+        dp.callback_query.middleware(ActorContextMiddleware())
 
         # Регистрируем middleware для проверки блокировки пользователей
         dp.message.middleware(BlockCheckMiddleware())
         dp.callback_query.middleware(BlockCheckMiddleware())
 
         # Регистрируем роутеры в правильном порядке
-        # common.router должен быть первым, так как содержит /start
+        # Кнопки меню (включая выбор роли) — один поиск по словарю текстов,
+        # поэтому их роутер первый и срабатывает в любом состоянии FSM;
+        # common.router следом, так как содержит /start
+        dp.include_router(text_commands.router)
         dp.include_router(common.router)
         dp.include_router(parent.router)
         dp.include_router(admin.router)
@@ -116,13 +143,36 @@ async def main():
         dp.include_router(teacher.router)
         dp.include_router(attendance.router)
 
-        # Инициализируем адаптер озвучки и запускаем фоновую задачу
-        pa_adapter = PAAdapter()
-        asyncio.create_task(start_repeat_announce_job(pa_adapter))
+        # Планировщик повторных озвучек (сама озвучка идёт через announce_queue)
+        asyncio.create_task(start_repeat_announce_job())
+
+        # Перевод устаревших заявок на выдачу в EXPIRED
+        asyncio.create_task(start_pickup_expiry_sweeper())
+
+        # Воркер outbox: уведомления родителям, записанные хэндлерами в БД
+        asyncio.create_task(start_outbox_worker(bot))
+
+        # Пакетная запись FSM-состояний и чистка брошенных диалогов
+        asyncio.create_task(storage.run())
+
+        # Закреплённая доска выдачи в канале охраны (вместо сообщения на заявку)
+        if PICKUP_BOARD_ENABLED and GUARD_CHANNEL_ID:
+            asyncio.create_task(start_pickup_board(bot))
+
+        if BOT_RUN_MODE == "webhook":
+            logging.info("Starting webhook server...")
+            await run_webhook(dp, bot)
+        else:
+            # Апдейты, накопившиеся за время простоя: по приоритету или отбросить
+            # (в aiogram 3.x у start_polling нет skip_updates)
+            if STARTUP_BACKLOG_MODE == "drain":
+                await drain_backlog(dp, bot)
+            else:
+                await bot.delete_webhook(drop_pending_updates=True)
 
-        logging.info("Starting polling...")
-        # В aiogram 3.x используется await dp.start_polling(bot)
-        await dp.start_polling(bot, skip_updates=True)
+            logging.info("Starting polling...")
+            # В aiogram 3.x используется await dp.start_polling(bot)
+            await dp.start_polling(bot)
 
     except Exception:
         logging.exception("Fatal error in main()")
@@ -1,3 +1,14 @@
+from .actor_context import ActorContextMiddleware
 from .block_check import BlockCheckMiddleware
+from .metrics import UpdateMetricsMiddleware, HandlerMetricsMiddleware
+from .priority_lanes import PriorityLaneMiddleware
+from .user_serial import UserSerialMiddleware
 
-__all__ = ["BlockCheckMiddleware"]
+__all__ = [
+    "ActorContextMiddleware",
+    "BlockCheckMiddleware",
+    "UpdateMetricsMiddleware",
+    "HandlerMetricsMiddleware",
+    "PriorityLaneMiddleware",
+    "UserSerialMiddleware",
+]
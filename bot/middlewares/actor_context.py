@@ -0,0 +1,24 @@
+from typing import Callable, Dict, Any, Awaitable
+from aiogram import BaseMiddleware
+from aiogram.types import Message, CallbackQuery
+from bot.services import get_identity
+
+
+class ActorContextMiddleware(BaseMiddleware):
+    """
+    Один раз на апдейт определяет, кто действует (actor):
+    пользователь, запись учителя, статус подтверждения и классы.
+
+    Результат (Identity или None для незарегистрированных) кладётся
+    в data["actor"] — хэндлеры получают его параметром `actor`
+    вместо повторных запросов User/Teacher/TeacherClass.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[Message | CallbackQuery, Dict[str, Any]], Awaitable[Any]],
+        event: Message | CallbackQuery,
+        data: Dict[str, Any]
+    ) -> Any:
+        data["actor"] = await get_identity(event.from_user.id)
+        return await handler(event, data)
@@ -1,9 +1,8 @@
 from typing import Callable, Dict, Any, Awaitable
 from aiogram import BaseMiddleware
 from aiogram.types import Message, CallbackQuery
-from bot.db.database import SessionLocal
-from bot.db.models import User
 from bot.config import ADMIN_IDS
+from bot.services import get_identity
 
 
 class BlockCheckMiddleware(BaseMiddleware):
@@ -41,34 +40,30 @@ class BlockCheckMiddleware(BaseMiddleware):
             if any(text.startswith(cmd) for cmd in self.ALLOWED_COMMANDS):
                 return await handler(event, data)
         
-        # Проверяем блокировку в БД
-        session = SessionLocal()
-        try:
-            user = session.query(User).filter(User.telegram_id == user_id).first()
-            
-            if user and user.is_blocked:
-                # Пользователь заблокирован - отправляем сообщение и не выполняем обработчик
-                if isinstance(event, CallbackQuery):
-                    await event.answer(
-                        "❌ Ваш аккаунт заблокирован администратором.",
-                        show_alert=True
-                    )
-                    # Также отправляем сообщение в чат
-                    try:
-                        await event.message.answer(
-                            "❌ Ваш аккаунт заблокирован администратором.\n"
-                            "Обратитесь к администратору для получения дополнительной информации."
-                        )
-                    except:
-                        pass
-                else:  # Message
-                    await event.answer(
+        # Проверяем блокировку: actor уже загружен ActorContextMiddleware,
+        # иначе берём из кэша identity (при промахе — БД)
+        identity = data["actor"] if "actor" in data else await get_identity(user_id)
+        if identity and identity.is_blocked:
+            # Пользователь заблокирован - отправляем сообщение и не выполняем обработчик
+            if isinstance(event, CallbackQuery):
+                await event.answer(
+                    "❌ Ваш аккаунт заблокирован администратором.",
+                    show_alert=True
+                )
+                # Также отправляем сообщение в чат
+                try:
+                    await event.message.answer(
                         "❌ Ваш аккаунт заблокирован администратором.\n"
                         "Обратитесь к администратору для получения дополнительной информации."
                     )
-                return  # Прерываем выполнение обработчика
-        finally:
-            session.close()
+                except:
+                    pass
+            else:  # Message
+                await event.answer(
+                    "❌ Ваш аккаунт заблокирован администратором.\n"
+                    "Обратитесь к администратору для получения дополнительной информации."
+                )
+            return  # Прерываем выполнение обработчика
         
         # Пользователь не заблокирован - продолжаем обработку
         return await handler(event, data)
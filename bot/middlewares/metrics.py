@@ -0,0 +1,44 @@
+from typing import Callable, Dict, Any, Awaitable
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+from bot.services import current_scope, open_scope, close_scope
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """
+    Внешний middleware на уровне Update (регистрируется первым): учитывает
+    время апдейта, запросы к БД и вызовы Telegram API за апдейт.
+
+    Имя хэндлера проставляет HandlerMetricsMiddleware; апдейт, не дошедший
+    до хэндлера, учитывается под своим типом (message, callback_query, ...).
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        scope, token = open_scope("update", event.event_type)
+        try:
+            return await handler(event, data)
+        finally:
+            close_scope(scope, token)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware: записывает в учёт апдейта имя выбранного хэндлера."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        scope = current_scope()
+        if scope is not None:
+            # Кнопки меню идут через общий dispatch_text_command
+            target = data.get("text_command") or data.get("handler")
+            if target is not None:
+                scope.name = getattr(target.callback, "__name__", scope.name)
+        return await handler(event, data)
@@ -0,0 +1,40 @@
+from typing import Callable, Dict, Any, Awaitable
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+from bot.services import classify_update, update_lanes, user_serial
+
+
+BUSY_TEXT = "Сейчас идёт выдача детей, бот занят. Попробуйте, пожалуйста, через минуту."
+
+
+class PriorityLaneMiddleware(BaseMiddleware):
+    """
+    Внешний middleware на уровне Update: выполняет хэндлер в полосе
+    его категории (выдача детей / действия / отчёты), а внутри полосы —
+    на одном из общих мест UPDATE_WORKERS.
+
+    Отчёт, пришедший во время автоозвучки при загруженной полосе выдачи,
+    не выполняется: пользователь получает просьбу повторить позже.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        category = classify_update(event)
+
+        if update_lanes.should_shed(category):
+            update_lanes.mark_shed(category)
+            if event.callback_query is not None:
+                await event.callback_query.answer(BUSY_TEXT)
+            elif event.message is not None:
+                await event.message.answer(BUSY_TEXT)
+            return None
+
+        # Общее место воркера берём только после места в полосе:
+        # отчёты, ждущие свою полосу, не занимают места заявок на выдачу
+        return await update_lanes.execute(
+            category, lambda: user_serial.run_worker(lambda: handler(event, data))
+        )
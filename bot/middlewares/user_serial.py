@@ -0,0 +1,33 @@
+from typing import Callable, Dict, Any, Awaitable
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+from bot.services import user_serial
+
+
+class UserSerialMiddleware(BaseMiddleware):
+    """
+    Внешний middleware на уровне Update: апдейты одного пользователя
+    выполняются по очереди, разных пользователей — параллельно
+    (общий лимит UPDATE_WORKERS берёт PriorityLaneMiddleware внутри полосы).
+
+    Точный повтор нажатия той же кнопки в пределах короткого окна
+    отбрасывается (отвечаем на callback, чтобы убрать «часики»).
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        user_id = user.id if user else None
+
+        callback = event.callback_query
+        if callback is not None and user_id is not None:
+            message_id = callback.message.message_id if callback.message else None
+            if user_serial.is_duplicate_callback(user_id, message_id, callback.data):
+                await callback.answer()
+                return None
+
+        return await user_serial.run(user_id, lambda: handler(event, data))
@@ -1,5 +1,27 @@
 from .voice_settings import VoiceMode, get_voice_mode, set_voice_mode, is_auto_voice_active
 from .pa_adapter import PAAdapter
+from .identity_cache import Identity, TeacherInfo, identity_cache, get_identity, invalidate_identity
+from .roster_cache import RosterEntry, roster_cache, get_class_roster, invalidate_roster
+from .broadcast import BroadcastResult, run_broadcast, start_broadcast
+from .announce_scheduler import announce_scheduler, schedule_announce, cancel_announce
+from .announce_queue import (
+    announce_queue,
+    enqueue_announcement,
+    discard_announcement,
+    PRIORITY_FIRST,
+    PRIORITY_REPEAT,
+)
+from .pickup_expiry import sweep_expired_pickups, start_pickup_expiry_sweeper, get_expiry_stats, expiry_cutoff
+from .guard_channel import guard_messages, render_pickup_message
+from .pickup_board import pickup_board, make_entry as make_board_entry, start_pickup_board
+from .idempotency import handled_callbacks
+from .update_priority import classify_update
+from .update_lanes import update_lanes
+from .user_serial import user_serial
+from .update_backlog import drain_backlog
+from .metrics import track_job, current_scope, open_scope, close_scope
+from .metrics_server import start_metrics
+from .outbox import enqueue_notification, notify_outbox, start_outbox_worker, get_outbox_stats
 
 __all__ = [
     "VoiceMode",
@@ -7,5 +29,48 @@ __all__ = [
     "set_voice_mode",
     "is_auto_voice_active",
     "PAAdapter",
+    "Identity",
+    "TeacherInfo",
+    "identity_cache",
+    "get_identity",
+    "invalidate_identity",
+    "RosterEntry",
+    "roster_cache",
+    "get_class_roster",
+    "invalidate_roster",
+    "BroadcastResult",
+    "run_broadcast",
+    "start_broadcast",
+    "announce_scheduler",
+    "schedule_announce",
+    "cancel_announce",
+    "announce_queue",
+    "enqueue_announcement",
+    "discard_announcement",
+    "PRIORITY_FIRST",
+    "PRIORITY_REPEAT",
+    "sweep_expired_pickups",
+    "start_pickup_expiry_sweeper",
+    "get_expiry_stats",
+    "expiry_cutoff",
+    "guard_messages",
+    "render_pickup_message",
+    "pickup_board",
+    "make_board_entry",
+    "start_pickup_board",
+    "handled_callbacks",
+    "classify_update",
+    "update_lanes",
+    "user_serial",
+    "drain_backlog",
+    "track_job",
+    "current_scope",
+    "open_scope",
+    "close_scope",
+    "start_metrics",
+    "enqueue_notification",
+    "notify_outbox",
+    "start_outbox_worker",
+    "get_outbox_stats",
 ]
 
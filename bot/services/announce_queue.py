@@ -0,0 +1,250 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, update
+
+from bot.db.database import AsyncSessionLocal
+from bot.db.models import PickupRequest
+from bot.services.pa_adapter import PAAdapter
+from bot.services.announce_scheduler import schedule_announce
+
+
+logger = logging.getLogger(__name__)
+
+
+ANNOUNCE_INTERVAL_MINUTES = 4
+# Через сколько повторить озвучку, если PA вернул ошибку
+RETRY_AFTER_FAILURE_SECONDS = 20
+
+# Приоритеты: первый вызов всегда раньше повторов
+PRIORITY_FIRST = 0
+PRIORITY_REPEAT = 1
+
+
+@dataclass
+class AnnounceItem:
+    """Объявление в очереди; может покрывать несколько детей одного родителя."""
+
+    parent_id: int
+    zone: Optional[str]
+    priority: int
+    arrival_minutes: int
+    seq: int
+    enqueued_at: float
+    # pickup_id -> (ФИО ребёнка, класс)
+    children: Dict[int, Tuple[str, str]] = field(default_factory=dict)
+
+    def text(self) -> str:
+        names = [f"{name} из класса {class_name}" for name, class_name in self.children.values()]
+        if len(names) == 1:
+            who = f"ученика {names[0]}"
+        else:
+            who = "учеников " + ", ".join(names)
+        return (
+            f"Просьба вызвать {who} к выходу. "
+            f"Родитель прибудет через {self.arrival_minutes} минут."
+        )
+
+
+@dataclass
+class AnnounceQueueStats:
+    played: int = 0
+    failed: int = 0
+    coalesced: int = 0
+    dropped: int = 0
+    wait_total_ms: float = 0.0
+    wait_max_ms: float = 0.0
+
+
+class AnnounceQueue:
+    """
+    Очередь объявлений PA.
+
+    - в каждой зоне одновременно звучит только одно объявление
+      (отдельный воркер на зону);
+    - первые вызовы идут раньше повторов, внутри приоритета — по порядку;
+    - ожидающие объявления для детей одного родителя в одной зоне
+      объединяются в одну фразу;
+    - заявки, переданные родителю до начала озвучки, выбрасываются (discard).
+    После озвучки воркер сам обновляет заявки в БД и ставит следующий повтор.
+    """
+
+    def __init__(self, pa: PAAdapter):
+        self.pa = pa
+        self._pending: Dict[Optional[str], List[AnnounceItem]] = {}
+        self._ready: Dict[Optional[str], asyncio.Event] = {}
+        self._workers: Dict[Optional[str], asyncio.Task] = {}
+        self._seq = itertools.count()
+        self.stats = AnnounceQueueStats()
+
+    def enqueue(
+        self,
+        pickup_id: int,
+        parent_id: int,
+        child_name: str,
+        class_name: str,
+        arrival_minutes: int,
+        priority: int = PRIORITY_FIRST,
+        zone: Optional[str] = None,
+    ) -> None:
+        pending = self._pending.setdefault(zone, [])
+
+        for item in pending:
+            if item.parent_id == parent_id:
+                if pickup_id not in item.children:
+                    self.stats.coalesced += 1
+                item.children[pickup_id] = (child_name, class_name)
+                item.priority = min(item.priority, priority)
+                # Время прибытия — из самой свежей заявки
+                item.arrival_minutes = arrival_minutes
+                return
+
+        pending.append(AnnounceItem(
+            parent_id=parent_id,
+            zone=zone,
+            priority=priority,
+            arrival_minutes=arrival_minutes,
+            seq=next(self._seq),
+            enqueued_at=time.monotonic(),
+            children={pickup_id: (child_name, class_name)},
+        ))
+        self._ensure_worker(zone)
+        self._ready[zone].set()
+
+    def discard(self, pickup_id: int) -> None:
+        """Убирает заявку из ещё не озвученных объявлений (ребёнок уже передан)."""
+        for pending in self._pending.values():
+            self._discard_in(pending, pickup_id)
+
+    def _discard_in(self, pending: List[AnnounceItem], pickup_id: int) -> None:
+        for item in list(pending):
+            if item.children.pop(pickup_id, None) is not None:
+                self.stats.dropped += 1
+                if not item.children:
+                    pending.remove(item)
+
+    def depth(self) -> int:
+        return sum(len(pending) for pending in self._pending.values())
+
+    def metrics(self) -> dict:
+        started = self.stats.played + self.stats.failed
+        return {
+            "depth": self.depth(),
+            "depth_by_zone": {zone or "-": len(p) for zone, p in self._pending.items()},
+            "played": self.stats.played,
+            "failed": self.stats.failed,
+            "coalesced": self.stats.coalesced,
+            "dropped": self.stats.dropped,
+            "wait_avg_ms": self.stats.wait_total_ms / started if started else 0.0,
+            "wait_max_ms": self.stats.wait_max_ms,
+        }
+
+    def _ensure_worker(self, zone: Optional[str]) -> None:
+        if zone not in self._ready:
+            self._ready[zone] = asyncio.Event()
+        worker = self._workers.get(zone)
+        if worker is None or worker.done():
+            self._workers[zone] = asyncio.create_task(self._run_zone(zone))
+
+    def _pop_next(self, zone: Optional[str]) -> Optional[AnnounceItem]:
+        pending = self._pending.get(zone)
+        if not pending:
+            return None
+        item = min(pending, key=lambda i: (i.priority, i.seq))
+        pending.remove(item)
+        return item
+
+    async def _run_zone(self, zone: Optional[str]) -> None:
+        ready = self._ready[zone]
+        while True:
+            item = self._pop_next(zone)
+            if item is None:
+                ready.clear()
+                await ready.wait()
+                continue
+
+            wait_ms = (time.monotonic() - item.enqueued_at) * 1000
+            self.stats.wait_total_ms += wait_ms
+            self.stats.wait_max_ms = max(self.stats.wait_max_ms, wait_ms)
+
+            try:
+                ok = await self.pa.announce(item.text(), zone=zone)
+            except Exception:
+                logger.exception("Ошибка озвучки (zone=%s)", zone)
+                ok = False
+
+            if ok:
+                self.stats.played += 1
+            else:
+                self.stats.failed += 1
+                logger.warning("Не удалось выполнить озвучку (pickup_ids=%s)", list(item.children))
+
+            try:
+                await _record_announcement(list(item.children), ok)
+            except Exception:
+                logger.exception("Не удалось сохранить результат озвучки")
+
+
+async def _record_announcement(pickup_ids: List[int], ok: bool) -> None:
+    """
+    Фиксирует озвучку в БД и ставит следующий повтор в планировщик.
+
+    Условие по статусу не даёт «оживить» заявку, закрытую во время озвучки.
+    """
+    now = datetime.utcnow()
+    if ok:
+        next_at = now + timedelta(minutes=ANNOUNCE_INTERVAL_MINUTES)
+        values = {
+            "last_announce_at": now,
+            "next_announce_at": next_at,
+            "announce_count": func.coalesce(PickupRequest.announce_count, 0) + 1,
+            "status": "ANNOUNCED",
+        }
+    else:
+        next_at = now + timedelta(seconds=RETRY_AFTER_FAILURE_SECONDS)
+        values = {"next_announce_at": next_at}
+
+    session = AsyncSessionLocal()
+    try:
+        await session.execute(
+            update(PickupRequest)
+            .where(
+                PickupRequest.id.in_(pickup_ids),
+                PickupRequest.status.in_(["PENDING", "ANNOUNCED"]),
+            )
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        await session.commit()
+    finally:
+        await session.close()
+
+    # Закрытые заявки планировщик отбросит при следующей проверке
+    for pickup_id in pickup_ids:
+        schedule_announce(pickup_id, next_at)
+
+
+announce_queue = AnnounceQueue(PAAdapter())
+
+
+def enqueue_announcement(
+    pickup_id: int,
+    parent_id: int,
+    child_name: str,
+    class_name: str,
+    arrival_minutes: int,
+    priority: int = PRIORITY_FIRST,
+    zone: Optional[str] = None,
+) -> None:
+    announce_queue.enqueue(pickup_id, parent_id, child_name, class_name, arrival_minutes, priority, zone)
+
+
+def discard_announcement(pickup_id: int) -> None:
+    announce_queue.discard(pickup_id)
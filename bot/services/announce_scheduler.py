@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+
+class AnnounceScheduler:
+    """
+    Очередь повторных озвучек: min-heap по next_announce_at.
+
+    Перенос и отмена не удаляют запись из кучи: актуальное время хранится
+    в _due, а устаревшие элементы отбрасываются при извлечении.
+    Все времена — naive UTC, как в pickup_requests.
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[datetime, int]] = []
+        self._due: Dict[int, datetime] = {}
+        self._wakeup = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def schedule(self, pickup_id: int, due_at: datetime) -> None:
+        """Назначает (или переносит) следующую озвучку заявки."""
+        if self._due.get(pickup_id) == due_at:
+            return
+        self._due[pickup_id] = due_at
+        heapq.heappush(self._heap, (due_at, pickup_id))
+        self._compact()
+        self._wakeup.set()
+
+    def cancel(self, pickup_id: int) -> None:
+        self._due.pop(pickup_id, None)
+
+    def clear(self) -> None:
+        self._heap.clear()
+        self._due.clear()
+        self._wakeup.set()
+
+    def _compact(self) -> None:
+        # Частые переносы копят устаревшие элементы — пересобираем кучу
+        if len(self._heap) > 2 * len(self._due) + 64:
+            self._heap = [(due_at, pickup_id) for pickup_id, due_at in self._due.items()]
+            heapq.heapify(self._heap)
+
+    def next_due_at(self) -> Optional[datetime]:
+        while self._heap:
+            due_at, pickup_id = self._heap[0]
+            if self._due.get(pickup_id) == due_at:
+                return due_at
+            heapq.heappop(self._heap)
+        return None
+
+    def pop_due(self, now: datetime) -> List[int]:
+        """Извлекает id всех заявок, время которых наступило."""
+        ready = []
+        while True:
+            due_at = self.next_due_at()
+            if due_at is None or due_at > now:
+                return ready
+            _, pickup_id = heapq.heappop(self._heap)
+            del self._due[pickup_id]
+            ready.append(pickup_id)
+
+    async def wait_next(self) -> None:
+        """
+        Ждёт, пока наступит время ближайшей озвучки.
+
+        schedule() будит ожидание, чтобы новая более ранняя заявка
+        не ждала окончания текущего таймера.
+        """
+        while True:
+            self._wakeup.clear()
+            due_at = self.next_due_at()
+            if due_at is None:
+                await self._wakeup.wait()
+                continue
+
+            delay = (due_at - datetime.utcnow()).total_seconds()
+            if delay <= 0:
+                return
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                return
+
+
+announce_scheduler = AnnounceScheduler()
+
+
+def schedule_announce(pickup_id: int, due_at: datetime) -> None:
+    announce_scheduler.schedule(pickup_id, due_at)
+
+
+def cancel_announce(pickup_id: int) -> None:
+    announce_scheduler.cancel(pickup_id)
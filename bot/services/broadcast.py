@@ -0,0 +1,217 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Set
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+from bot.config import (
+    BROADCAST_CONCURRENCY,
+    BROADCAST_RATE_PER_SECOND,
+    BROADCAST_PER_CHAT_INTERVAL_SECONDS,
+    BROADCAST_MAX_RETRIES,
+    BROADCAST_PROGRESS_INTERVAL_SECONDS,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """
+    Равномерный лимит: не больше rate_per_second вызовов wait() в секунду.
+
+    Слот резервируется синхронно (без await между чтением и записью),
+    поэтому блокировка не нужна.
+    """
+
+    def __init__(self, rate_per_second: float):
+        self.interval = 1.0 / rate_per_second
+        self._next_at = 0.0
+        self._paused_until = 0.0
+
+    async def wait(self) -> None:
+        while True:
+            now = time.monotonic()
+            slot = max(now, self._next_at)
+            self._next_at = slot + self.interval
+            if slot > now:
+                await asyncio.sleep(slot - now)
+            # Пауза объявлена, пока ждали слот, занятый до неё, — берём новый после паузы
+            if time.monotonic() >= self._paused_until:
+                return
+
+    def pause(self, seconds: float) -> None:
+        """Сдвигает все следующие слоты (после RetryAfter от Telegram)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._next_at = max(self._next_at, self._paused_until)
+
+
+class PerChatLimiter:
+    """Минимальный интервал между сообщениями в один и тот же чат."""
+
+    MAX_TRACKED_CHATS = 10_000
+
+    def __init__(self, interval_seconds: float):
+        self.interval = interval_seconds
+        self._next_at: Dict[int, float] = {}
+
+    async def wait(self, chat_id: int) -> None:
+        now = time.monotonic()
+        if len(self._next_at) > self.MAX_TRACKED_CHATS:
+            self._next_at = {k: v for k, v in self._next_at.items() if v > now}
+
+        slot = max(now, self._next_at.get(chat_id, 0.0))
+        self._next_at[chat_id] = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+# Общие для всех рассылок: лимиты Telegram действуют на бота целиком
+global_limiter = RateLimiter(BROADCAST_RATE_PER_SECOND)
+chat_limiter = PerChatLimiter(BROADCAST_PER_CHAT_INTERVAL_SECONDS)
+send_slots = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+
+# Ссылки на запущенные задачи, чтобы их не собрал GC
+_running: Set[asyncio.Task] = set()
+
+
+@dataclass
+class BroadcastResult:
+    total: int
+    delivered: int = 0
+    failed: int = 0
+
+    @property
+    def done(self) -> int:
+        return self.delivered + self.failed
+
+
+async def send_with_retry(bot: Bot, chat_id: int, text: str) -> bool:
+    """
+    Отправляет одно сообщение с учётом лимитов.
+
+    RetryAfter и сетевые/серверные ошибки повторяются до BROADCAST_MAX_RETRIES раз,
+    блокировка бота или неверный chat_id — сразу неудача.
+    """
+    attempt = 0
+    while True:
+        async with send_slots:
+            await chat_limiter.wait(chat_id)
+            await global_limiter.wait()
+            try:
+                await bot.send_message(chat_id, text)
+                return True
+            except TelegramRetryAfter as e:
+                # Флуд-контроль касается всего бота: притормаживаем все рассылки
+                global_limiter.pause(e.retry_after)
+                delay = e.retry_after
+            except (TelegramNetworkError, TelegramServerError):
+                delay = 2 ** attempt
+            except (TelegramForbiddenError, TelegramBadRequest):
+                return False
+            except Exception:
+                logger.exception("Broadcast: ошибка отправки в %s", chat_id)
+                return False
+
+        attempt += 1
+        if attempt > BROADCAST_MAX_RETRIES:
+            logger.warning("Broadcast: %s не доставлено после %s попыток", chat_id, attempt)
+            return False
+        await asyncio.sleep(delay)
+
+
+def _progress_text(title: str, result: BroadcastResult, finished: bool) -> str:
+    if finished:
+        return (
+            f"{title}\n"
+            "Готово.\n"
+            f"Отправлено родителям: {result.delivered}\n"
+            f"Не доставлено: {result.failed}"
+        )
+    return f"{title}\nОтправка: {result.done}/{result.total}…"
+
+
+async def _safe_edit(bot: Bot, chat_id: int, message_id: int, text: str) -> None:
+    try:
+        await bot.edit_message_text(text=text, chat_id=chat_id, message_id=message_id)
+    except Exception:
+        logger.debug("Broadcast: не удалось обновить прогресс", exc_info=True)
+
+
+async def run_broadcast(
+    bot: Bot,
+    chat_ids: Iterable[int],
+    text: str,
+    report_chat_id: Optional[int] = None,
+    title: str = "📤 Рассылка",
+) -> BroadcastResult:
+    """
+    Рассылает text по chat_ids с ограниченной параллельностью.
+
+    Если указан report_chat_id, туда отправляется сообщение с прогрессом,
+    которое обновляется не чаще BROADCAST_PROGRESS_INTERVAL_SECONDS
+    и в конце заменяется итогом.
+    """
+    targets = list(dict.fromkeys(chat_ids))
+    result = BroadcastResult(total=len(targets))
+
+    progress_message_id = None
+    if report_chat_id is not None and targets:
+        try:
+            sent = await bot.send_message(report_chat_id, _progress_text(title, result, False))
+            progress_message_id = sent.message_id
+        except Exception:
+            logger.debug("Broadcast: не удалось отправить прогресс", exc_info=True)
+
+    last_report = time.monotonic()
+
+    async def deliver(chat_id: int) -> None:
+        nonlocal last_report
+        if await send_with_retry(bot, chat_id, text):
+            result.delivered += 1
+        else:
+            result.failed += 1
+
+        now = time.monotonic()
+        if progress_message_id and now - last_report >= BROADCAST_PROGRESS_INTERVAL_SECONDS:
+            last_report = now
+            await _safe_edit(bot, report_chat_id, progress_message_id, _progress_text(title, result, False))
+
+    await asyncio.gather(*(deliver(chat_id) for chat_id in targets))
+
+    logger.info("Broadcast %r: %s/%s delivered", title, result.delivered, result.total)
+    if report_chat_id is not None:
+        final_text = _progress_text(title, result, True)
+        if progress_message_id:
+            await _safe_edit(bot, report_chat_id, progress_message_id, final_text)
+        else:
+            try:
+                await bot.send_message(report_chat_id, final_text)
+            except Exception:
+                logger.debug("Broadcast: не удалось отправить итог", exc_info=True)
+    return result
+
+
+def start_broadcast(
+    bot: Bot,
+    chat_ids: Iterable[int],
+    text: str,
+    report_chat_id: Optional[int] = None,
+    title: str = "📤 Рассылка",
+) -> asyncio.Task:
+    """Запускает run_broadcast() в фоне, чтобы хэндлер не ждал всей рассылки."""
+    task = asyncio.create_task(run_broadcast(bot, list(chat_ids), text, report_chat_id, title))
+    _running.add(task)
+    task.add_done_callback(_running.discard)
+    return task
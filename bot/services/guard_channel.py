@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup
+from sqlalchemy import or_, update
+
+from bot.config import GUARD_CHANNEL_ID, GUARD_EDIT_MIN_INTERVAL_SECONDS
+from bot.db.database import AsyncSessionLocal
+from bot.db.models import PickupRequest
+
+
+logger = logging.getLogger(__name__)
+
+
+class GuardMessagePublisher:
+    """
+    Одно сообщение в канале охраны на одну активную заявку.
+
+    - новая заявка — новое сообщение;
+    - обновление заявки — правка сохранённого сообщения, не чаще
+      GUARD_EDIT_MIN_INTERVAL_SECONDS на сообщение (промежуточные
+      версии схлопываются, применяется последняя);
+    - если правка не удалась (сообщение удалено и т.п.) — публикуем
+      новое и сохраняем его id в pickup_requests.channel_message_id.
+    """
+
+    MAX_TRACKED_MESSAGES = 1_000
+
+    def __init__(self, min_interval_seconds: float = GUARD_EDIT_MIN_INTERVAL_SECONDS):
+        self.min_interval = min_interval_seconds
+        self._last_write: Dict[int, float] = {}
+        # message_id -> (pickup_id, текст, клавиатура) для отложенной правки
+        self._pending: Dict[int, Tuple[int, str, Optional[InlineKeyboardMarkup]]] = {}
+        self._timers: Set[int] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def publish(
+        self,
+        bot: Bot,
+        pickup_id: int,
+        message_id: Optional[int],
+        text: str,
+        reply_markup: Optional[InlineKeyboardMarkup] = None,
+    ) -> Optional[int]:
+        """
+        Публикует или обновляет сообщение заявки; возвращает id сообщения.
+
+        Если id изменился (новое сообщение), вызывающий код сохраняет его сам.
+        Отложенная правка при неудаче сохраняет новый id в БД самостоятельно.
+        """
+        if message_id is None:
+            return await self._post(bot, text, reply_markup)
+
+        wait = self._last_write.get(message_id, 0.0) + self.min_interval - time.monotonic()
+        if wait > 0:
+            self._defer(bot, message_id, pickup_id, text, reply_markup, wait)
+            return message_id
+
+        if await self._edit(bot, message_id, pickup_id, text, reply_markup):
+            return message_id
+        return await self._post(bot, text, reply_markup)
+
+    def _defer(self, bot, message_id, pickup_id, text, reply_markup, delay: float) -> None:
+        self._pending[message_id] = (pickup_id, text, reply_markup)
+        if message_id in self._timers:
+            return
+        self._timers.add(message_id)
+        task = asyncio.create_task(self._flush_later(bot, message_id, delay))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush_later(self, bot: Bot, message_id: int, delay: float) -> None:
+        await asyncio.sleep(delay)
+        self._timers.discard(message_id)
+        pending = self._pending.pop(message_id, None)
+        if pending is None:
+            return
+
+        pickup_id, text, reply_markup = pending
+        try:
+            if await self._edit(bot, message_id, pickup_id, text, reply_markup):
+                return
+            new_message_id = await self._post(bot, text, reply_markup)
+            if new_message_id is not None:
+                await _store_message_id(pickup_id, new_message_id, message_id)
+        except Exception:
+            logger.exception("Не удалось обновить сообщение охраны (pickup_id=%s)", pickup_id)
+
+    async def _edit(self, bot, message_id, pickup_id, text, reply_markup) -> bool:
+        try:
+            await bot.edit_message_text(
+                text=text,
+                chat_id=GUARD_CHANNEL_ID,
+                message_id=message_id,
+                reply_markup=reply_markup,
+            )
+        except TelegramRetryAfter as e:
+            # Лимит правок: повторим позже той же правкой
+            self._defer(bot, message_id, pickup_id, text, reply_markup, e.retry_after)
+            return True
+        except TelegramBadRequest as e:
+            if "message is not modified" in str(e):
+                return True
+            logger.warning("Правка сообщения охраны %s не удалась: %s", message_id, e)
+            return False
+        except Exception:
+            logger.exception("Правка сообщения охраны %s не удалась", message_id)
+            return False
+
+        self._touch(message_id)
+        return True
+
+    async def _post(self, bot, text, reply_markup) -> Optional[int]:
+        message = await bot.send_message(GUARD_CHANNEL_ID, text, reply_markup=reply_markup)
+        self._touch(message.message_id)
+        return message.message_id
+
+    def _touch(self, message_id: int) -> None:
+        now = time.monotonic()
+        if len(self._last_write) > self.MAX_TRACKED_MESSAGES:
+            self._last_write = {
+                k: v for k, v in self._last_write.items() if now - v < self.min_interval
+            }
+        self._last_write[message_id] = now
+
+    def forget(self, message_id: int) -> None:
+        """Отменяет отложенную правку (например, сообщение уже закрыто кнопкой «Передан»)."""
+        self._pending.pop(message_id, None)
+
+    async def retire(self, bot: Bot, message_id: int, text: str) -> None:
+        """Закрывает сообщение без кнопок (его заявки перенесены в другое сообщение)."""
+        self.forget(message_id)
+        try:
+            await bot.edit_message_text(
+                text=text,
+                chat_id=GUARD_CHANNEL_ID,
+                message_id=message_id,
+                reply_markup=None,
+            )
+        except Exception as e:
+            logger.warning("Не удалось закрыть сообщение охраны %s: %s", message_id, e)
+            return
+        self._touch(message_id)
+
+
+async def _store_message_id(pickup_id: int, message_id: int, old_message_id: int) -> None:
+    """Переносит заявку (и все заявки её общего сообщения) на новое сообщение."""
+    session = AsyncSessionLocal()
+    try:
+        await session.execute(
+            update(PickupRequest)
+            .where(or_(
+                PickupRequest.id == pickup_id,
+                PickupRequest.channel_message_id == old_message_id,
+            ))
+            .values(channel_message_id=message_id)
+            .execution_options(synchronize_session=False)
+        )
+        await session.commit()
+    finally:
+        await session.close()
+
+
+def render_pickup_message(
+    parent_name: str,
+    arrival_minutes: int,
+    children: List[Tuple[str, str, bool]],
+) -> str:
+    """
+    Текст сообщения охраны для заявки родителя.
+
+    children — список (ФИО ребёнка, класс, передан ли); для нескольких
+    детей одного родителя публикуется одно общее сообщение.
+    """
+    if len(children) == 1:
+        child_name, class_name, handed_over = children[0]
+        if handed_over:
+            return (
+                "📌 Выдача ученика\n"
+                "🟢 РЕБЕНОК ПЕРЕДАН\n"
+                f"Родитель: {parent_name}\n"
+                f"Ученик: {child_name} ({class_name})\n"
+                f"Ожидался через: {arrival_minutes} мин."
+            )
+        return (
+            "📌 Выдача ученика\n"
+            "🟡 ОЖИДАЕТ ПЕРЕДАЧИ\n"
+            f"Родитель: {parent_name}\n"
+            f"Ученик: {child_name} ({class_name})\n"
+            f"Ожидается через: {arrival_minutes} мин."
+        )
+
+    all_handed_over = all(handed_over for _, _, handed_over in children)
+    lines = [
+        "📌 Выдача учеников",
+        "🟢 ВСЕ ДЕТИ ПЕРЕДАНЫ" if all_handed_over else "🟡 ОЖИДАЮТ ПЕРЕДАЧИ",
+        f"Родитель: {parent_name}",
+        "Ученики:",
+    ]
+    for child_name, class_name, handed_over in children:
+        lines.append(f"{'🟢' if handed_over else '🟡'} {child_name} ({class_name})")
+    lines.append(
+        f"Ожидался через: {arrival_minutes} мин." if all_handed_over
+        else f"Ожидается через: {arrival_minutes} мин."
+    )
+    return "\n".join(lines)
+
+
+guard_messages = GuardMessagePublisher()
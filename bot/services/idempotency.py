@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+
+
+HANDLED_CALLBACKS_TTL_SECONDS = 120
+HANDLED_CALLBACKS_MAX_SIZE = 10_000
+
+
+class HandledCallbacks:
+    """
+    Короткоживущий набор уже обработанных callback_query.id.
+
+    Telegram может доставить один и тот же callback повторно (повтор запроса,
+    двойное нажатие до ответа) — повтор не должен второй раз выполнять действие.
+    """
+
+    def __init__(self, ttl_seconds: float = HANDLED_CALLBACKS_TTL_SECONDS, max_size: int = HANDLED_CALLBACKS_MAX_SIZE):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._seen: "OrderedDict[str, float]" = OrderedDict()
+        self.duplicates = 0
+
+    def first_seen(self, callback_id: str) -> bool:
+        """Отмечает callback обработанным; False, если он уже встречался."""
+        now = time.monotonic()
+        # Записи упорядочены по времени добавления — устаревшие в начале
+        while self._seen:
+            added_at = next(iter(self._seen.values()))
+            if now - added_at < self.ttl_seconds and len(self._seen) < self.max_size:
+                break
+            self._seen.popitem(last=False)
+
+        if callback_id in self._seen:
+            self.duplicates += 1
+            return False
+        self._seen[callback_id] = now
+        return True
+
+    def forget(self, callback_id: str) -> None:
+        """Снимает отметку: действие не выполнилось, повтор нажатия нужно обработать."""
+        self._seen.pop(callback_id, None)
+
+
+handled_callbacks = HandledCallbacks()
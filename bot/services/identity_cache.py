@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from sqlalchemy import select
+
+from bot.db.database import AsyncSessionLocal
+from bot.db.models import User, Teacher, TeacherClass
+
+
+IDENTITY_CACHE_MAX_SIZE = 10_000
+IDENTITY_CACHE_TTL_SECONDS = 300
+
+_MISSING = object()
+
+
+@dataclass(frozen=True)
+class TeacherInfo:
+    """Запись учителя и назначенные ему классы."""
+
+    teacher_id: int
+    subject_id: Optional[int]
+    status: str
+    is_verified: bool
+    classes: Tuple[str, ...]
+
+    @property
+    def is_approved(self) -> bool:
+        return self.status == "approved" or self.is_verified
+
+
+@dataclass(frozen=True)
+class Identity:
+    """
+    Снимок пользователя (actor) для проверок доступа в хэндлерах.
+
+    teacher заполнен, только если у пользователя есть запись в teachers.
+    """
+
+    user_id: int
+    full_name: str
+    role: str
+    is_verified: bool
+    is_blocked: bool
+    teacher: Optional[TeacherInfo] = None
+
+
+class IdentityCache:
+    """
+    Ограниченный по размеру кэш с TTL: telegram_id -> Identity.
+
+    Хранит и отрицательные ответы (None — пользователь не зарегистрирован),
+    поэтому любое изменение пользователя, его записи учителя или классов
+    в БД должно сопровождаться вызовом invalidate(telegram_id).
+    """
+
+    def __init__(self, max_size: int = IDENTITY_CACHE_MAX_SIZE, ttl_seconds: float = IDENTITY_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._items: "OrderedDict[int, tuple[float, Optional[Identity]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Растёт при каждой инвалидации: загрузка, начатая до неё,
+        # не должна положить в кэш устаревшие данные.
+        self.generation = 0
+
+    def get(self, telegram_id: int):
+        """Возвращает Identity/None из кэша или _MISSING, если записи нет."""
+        item = self._items.get(telegram_id)
+        if item is None:
+            self.misses += 1
+            return _MISSING
+
+        expires_at, identity = item
+        if expires_at < time.monotonic():
+            del self._items[telegram_id]
+            self.misses += 1
+            return _MISSING
+
+        self._items.move_to_end(telegram_id)
+        self.hits += 1
+        return identity
+
+    def put(self, telegram_id: int, identity: Optional[Identity]) -> None:
+        self._items[telegram_id] = (time.monotonic() + self.ttl_seconds, identity)
+        self._items.move_to_end(telegram_id)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, telegram_id: int) -> None:
+        self._items.pop(telegram_id, None)
+        self.generation += 1
+
+    def clear(self) -> None:
+        self._items.clear()
+        self.generation += 1
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._items),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+identity_cache = IdentityCache()
+
+
+async def get_identity(telegram_id: int) -> Optional[Identity]:
+    """
+    Identity пользователя: из кэша, а при промахе — из БД
+    (один запрос для родителя, два — для учителя).
+    """
+    cached = identity_cache.get(telegram_id)
+    if cached is not _MISSING:
+        return cached
+
+    generation = identity_cache.generation
+    session = AsyncSessionLocal()
+    try:
+        row = (
+            await session.execute(
+                select(User, Teacher)
+                .outerjoin(Teacher, Teacher.user_id == User.id)
+                .where(User.telegram_id == telegram_id)
+            )
+        ).first()
+
+        teacher_info = None
+        if row and row.Teacher:
+            teacher = row.Teacher
+            classes = (
+                await session.scalars(
+                    select(TeacherClass.class_name).where(TeacherClass.teacher_id == teacher.id)
+                )
+            ).all()
+            teacher_info = TeacherInfo(
+                teacher_id=teacher.id,
+                subject_id=teacher.subject_id,
+                status=teacher.status,
+                is_verified=bool(teacher.is_verified),
+                classes=tuple(classes),
+            )
+    finally:
+        await session.close()
+
+    identity = None
+    if row:
+        user = row.User
+        identity = Identity(
+            user_id=user.id,
+            full_name=user.full_name,
+            role=user.role,
+            is_verified=bool(user.is_verified),
+            is_blocked=bool(user.is_blocked),
+            teacher=teacher_info,
+        )
+    if generation == identity_cache.generation:
+        identity_cache.put(telegram_id, identity)
+    return identity
+
+
+def invalidate_identity(telegram_id: int) -> None:
+    identity_cache.invalidate(telegram_id)
@@ -0,0 +1,342 @@
+from __future__ import annotations
+
+import logging
+import re
+import time
+from collections import Counter as _Counts
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from bot.config import METRICS_SLOW_QUERY_MS, METRICS_QUERY_BUDGET
+
+
+logger = logging.getLogger(__name__)
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value: float) -> str:
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+class Histogram:
+    """Гистограмма в формате Prometheus (накопительные бакеты, _sum, _count)."""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [счётчики бакетов..., sum, count]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, series in sorted(self._series.items()):
+            for bound, count in zip(self.buckets, series):
+                le = _format_labels(self.labels, labels, f'le="{_format_number(bound)}"')
+                yield f"{self.name}_bucket{le} {count}"
+            le = _format_labels(self.labels, labels, 'le="+Inf"')
+            yield f"{self.name}_bucket{le} {series[-1]}"
+            yield f"{self.name}_sum{_format_labels(self.labels, labels)} {series[-2]!r}"
+            yield f"{self.name}_count{_format_labels(self.labels, labels)} {series[-1]}"
+
+
+class Counter:
+    """Счётчик в формате Prometheus."""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labels, labels)} {_format_number(value)}"
+
+
+def render_gauges(name: str, help_text: str, labels: Sequence[str], values: Dict[Tuple[str, ...], float]) -> Iterable[str]:
+    """Gauge, значения которого снимаются в момент запроса /metrics."""
+    yield f"# HELP {name} {help_text}"
+    yield f"# TYPE {name} gauge"
+    for label_values, value in sorted(values.items()):
+        yield f"{name}{_format_labels(labels, label_values)} {_format_number(value)}"
+
+
+# ---------- метрики ----------
+
+update_seconds = Histogram(
+    "bot_update_seconds", "Время обработки апдейта, по хэндлерам", ("handler",)
+)
+update_db_queries = Histogram(
+    "bot_update_db_queries", "Число запросов к БД за апдейт", ("handler",), COUNT_BUCKETS
+)
+update_db_seconds = Histogram(
+    "bot_update_db_seconds", "Суммарное время запросов к БД за апдейт", ("handler",)
+)
+update_api_calls = Histogram(
+    "bot_update_telegram_calls", "Число вызовов Telegram API за апдейт", ("handler",), COUNT_BUCKETS
+)
+update_api_seconds = Histogram(
+    "bot_update_telegram_seconds", "Суммарное время вызовов Telegram API за апдейт", ("handler",)
+)
+job_seconds = Histogram(
+    "bot_job_seconds", "Время одного прохода фоновой задачи", ("job",)
+)
+job_db_queries = Histogram(
+    "bot_job_db_queries", "Число запросов к БД за проход фоновой задачи", ("job",), COUNT_BUCKETS
+)
+db_query_seconds = Histogram(
+    "bot_db_query_seconds", "Время запроса к БД (для записей включает ожидание блокировки)", ("operation",)
+)
+telegram_call_seconds = Histogram(
+    "bot_telegram_call_seconds", "Время вызова Telegram API", ("method",)
+)
+telegram_errors = Counter(
+    "bot_telegram_errors_total", "Вызовы Telegram API, завершившиеся ошибкой", ("method",)
+)
+slow_queries = Counter(
+    "bot_db_slow_queries_total", "Запросы к БД дольше METRICS_SLOW_QUERY_MS", ("fingerprint",)
+)
+budget_exceeded = Counter(
+    "bot_db_query_budget_exceeded_total", "Апдейты и проходы задач сверх METRICS_QUERY_BUDGET запросов", ("scope",)
+)
+
+REGISTRY = (
+    update_seconds,
+    update_db_queries,
+    update_db_seconds,
+    update_api_calls,
+    update_api_seconds,
+    job_seconds,
+    job_db_queries,
+    db_query_seconds,
+    telegram_call_seconds,
+    telegram_errors,
+    slow_queries,
+    budget_exceeded,
+)
+
+
+# ---------- отпечатки запросов ----------
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r"\bIN\s*\((?:\s*\?\s*,)*\s*\?\s*\)", re.IGNORECASE)
+_SPACE_RE = re.compile(r"\s+")
+
+FINGERPRINT_MAX_LENGTH = 160
+
+
+def fingerprint(statement: str) -> str:
+    """
+    «Отпечаток» запроса: текст без значений.
+
+    Литералы заменяются на ?, списки IN (?, ?, ...) сворачиваются в IN (...),
+    пробелы схлопываются — запросы, отличающиеся только параметрами,
+    получают один отпечаток.
+    """
+    text = _STRING_RE.sub("?", statement)
+    text = _NUMBER_RE.sub("?", text)
+    text = _IN_LIST_RE.sub("IN (...)", text)
+    text = _SPACE_RE.sub(" ", text).strip()
+    return text[:FINGERPRINT_MAX_LENGTH]
+
+
+# ---------- область учёта: апдейт или проход задачи ----------
+
+@dataclass
+class MetricsScope:
+    kind: str
+    name: str
+    started_at: float = field(default_factory=time.perf_counter)
+    db_queries: int = 0
+    db_seconds: float = 0.0
+    api_calls: int = 0
+    api_seconds: float = 0.0
+    fingerprints: _Counts = field(default_factory=_Counts)
+    # Задачи, запущенные из хэндлера, наследуют контекст — после
+    # завершения апдейта их запросы ему уже не засчитываются
+    closed: bool = False
+
+
+_current_scope: ContextVar[Optional[MetricsScope]] = ContextVar("metrics_scope", default=None)
+
+
+def current_scope() -> Optional[MetricsScope]:
+    scope = _current_scope.get()
+    if scope is None or scope.closed:
+        return None
+    return scope
+
+
+def open_scope(kind: str, name: str):
+    """Начинает учёт; возвращает (scope, token) для close_scope."""
+    scope = MetricsScope(kind=kind, name=name)
+    return scope, _current_scope.set(scope)
+
+
+def close_scope(scope: MetricsScope, token) -> None:
+    scope.closed = True
+    _current_scope.reset(token)
+
+    elapsed = time.perf_counter() - scope.started_at
+    if scope.kind == "update":
+        update_seconds.observe(elapsed, scope.name)
+        update_db_queries.observe(scope.db_queries, scope.name)
+        update_db_seconds.observe(scope.db_seconds, scope.name)
+        update_api_calls.observe(scope.api_calls, scope.name)
+        update_api_seconds.observe(scope.api_seconds, scope.name)
+    else:
+        job_seconds.observe(elapsed, scope.name)
+        job_db_queries.observe(scope.db_queries, scope.name)
+
+    if scope.db_queries > METRICS_QUERY_BUDGET:
+        _report_budget(scope)
+
+
+def _report_budget(scope: MetricsScope) -> None:
+    budget_exceeded.inc(f"{scope.kind}:{scope.name}")
+    repeated = [(text, count) for text, count in scope.fingerprints.most_common(3) if count > 1]
+    if repeated:
+        details = "повторы (возможный N+1): " + "; ".join(f"{count}× {text}" for text, count in repeated)
+    else:
+        details = "повторов нет"
+    logger.warning(
+        "Превышен бюджет запросов: %s %s сделал %s запросов к БД (бюджет %s), %.0f мс; %s",
+        scope.kind, scope.name, scope.db_queries, METRICS_QUERY_BUDGET, scope.db_seconds * 1000, details,
+    )
+
+
+@asynccontextmanager
+async def track_job(name: str):
+    """Учитывает один проход фоновой задачи (время и запросы к БД)."""
+    scope, token = open_scope("job", name)
+    try:
+        yield scope
+    finally:
+        close_scope(scope, token)
+
+
+# ---------- запросы к БД ----------
+
+def _operation(statement: str) -> str:
+    word = statement.lstrip()[:8].split(None, 1)
+    return word[0].upper() if word else "OTHER"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started_at", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("query_started_at")
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    db_query_seconds.observe(elapsed, _operation(statement))
+
+    scope = current_scope()
+    text = None
+    if scope is not None:
+        text = fingerprint(statement)
+        scope.db_queries += 1
+        scope.db_seconds += elapsed
+        scope.fingerprints[text] += 1
+
+    if elapsed * 1000 >= METRICS_SLOW_QUERY_MS:
+        text = text or fingerprint(statement)
+        slow_queries.inc(text)
+        logger.warning(
+            "Медленный запрос %.0f мс (%s): %s",
+            elapsed * 1000,
+            f"{scope.kind} {scope.name}" if scope is not None else "вне апдейта",
+            text,
+        )
+
+
+def _handle_error(exception_context) -> None:
+    conn = exception_context.connection
+    if conn is None:
+        return
+    started = conn.info.get("query_started_at")
+    if started:
+        started.pop()
+
+
+def install_query_metrics(engine: Engine) -> None:
+    """
+    Подключает учёт запросов к движку.
+
+    Для AsyncEngine нужно передавать async_engine.sync_engine.
+    """
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+# ---------- Telegram API ----------
+
+class TelegramApiMetrics(BaseRequestMiddleware):
+    """Middleware сессии бота: время каждого вызова Telegram API по методам."""
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            telegram_errors.inc(name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            telegram_call_seconds.observe(elapsed, name)
+            scope = current_scope()
+            if scope is not None:
+                scope.api_calls += 1
+                scope.api_seconds += elapsed
+
+
+def render_metrics() -> List[str]:
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return lines
@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import logging
+from typing import Iterable, List, Optional
+
+from aiogram import Bot
+from aiohttp import web
+
+from bot.config import METRICS_HOST, METRICS_PORT
+from bot.db.database import engine, async_engine
+from bot.db.sqlite_tuning import get_lock_wait_stats
+from bot.services.announce_queue import announce_queue
+from bot.services.metrics import TelegramApiMetrics, install_query_metrics, render_gauges, render_metrics
+from bot.services.outbox import get_outbox_stats
+from bot.services.pickup_board import pickup_board
+from bot.services.update_lanes import update_lanes
+from bot.services.user_serial import user_serial
+
+
+logger = logging.getLogger(__name__)
+
+
+def _runtime_gauges() -> Iterable[str]:
+    """Текущее состояние очередей и блокировок — снимается при каждом запросе."""
+    lock_stats = get_lock_wait_stats()
+    yield from render_gauges(
+        "bot_sqlite_lock_wait", "Записи в SQLite и ожидание блокировки (с запуска)", ("stat",),
+        {
+            ("writes",): lock_stats.writes,
+            ("total_ms",): lock_stats.total_ms,
+            ("max_ms",): lock_stats.max_ms,
+            ("slow_writes",): lock_stats.slow_writes,
+            ("lock_errors",): lock_stats.lock_errors,
+        },
+    )
+
+    lanes = update_lanes.metrics()
+    for stat in ("active", "waiting", "processed", "shed"):
+        yield from render_gauges(
+            f"bot_lane_{stat}", f"Полосы выполнения: {stat}", ("lane",),
+            {(lane,): values[stat] for lane, values in lanes.items()},
+        )
+
+    serial = user_serial.metrics()
+    yield from render_gauges(
+        "bot_user_queues", "Очереди апдейтов пользователей", ("stat",),
+        {(key,): serial[key] for key in ("users", "queued", "longest", "active", "duplicates")},
+    )
+
+    queue = announce_queue.metrics()
+    yield from render_gauges(
+        "bot_announce_queue_depth", "Озвучки в очереди PA", ("zone",),
+        {(zone,): depth for zone, depth in queue["depth_by_zone"].items()},
+    )
+
+    outbox = get_outbox_stats()
+    yield from render_gauges(
+        "bot_outbox_messages", "Уведомления outbox (с запуска)", ("status",),
+        {("sent",): outbox.sent, ("retried",): outbox.retried, ("dead",): outbox.dead},
+    )
+
+    yield from render_gauges(
+        "bot_pickup_board_entries", "Заявки на доске выдачи", (), {(): len(pickup_board)},
+    )
+
+
+def render_all() -> str:
+    lines: List[str] = render_metrics()
+    lines.extend(_runtime_gauges())
+    return "\n".join(lines) + "\n"
+
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render_all(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics(bot: Bot, host: str = METRICS_HOST, port: int = METRICS_PORT) -> Optional[web.AppRunner]:
+    """
+    Включает сбор метрик и поднимает GET /metrics на host:port.
+
+    Учёт запросов вешается на оба движка, учёт вызовов Telegram API —
+    на сессию бота. Если порт занят, бот работает дальше без эндпоинта.
+    """
+    install_query_metrics(engine)
+    install_query_metrics(async_engine.sync_engine)
+    bot.session.middleware(TelegramApiMetrics())
+
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError:
+        logger.exception("Не удалось запустить /metrics на %s:%s", host, port)
+        await runner.cleanup()
+        return None
+    logger.info("Метрики: http://%s:%s/metrics", host, port)
+    return runner
@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramRetryAfter,
+)
+from aiogram.types import InlineKeyboardMarkup, ReplyKeyboardMarkup
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from bot.config import OUTBOX_BATCH_SIZE, OUTBOX_POLL_INTERVAL_SECONDS, OUTBOX_MAX_ATTEMPTS
+from bot.db.database import AsyncSessionLocal
+from bot.db.models import OutboxMessage
+from bot.services.broadcast import global_limiter, chat_limiter, send_slots
+from bot.services.metrics import track_job
+
+
+logger = logging.getLogger(__name__)
+
+
+# Максимальная пауза между повторами при сетевых ошибках
+MAX_BACKOFF_SECONDS = 300
+
+
+@dataclass
+class OutboxStats:
+    sent: int = 0
+    retried: int = 0
+    dead: int = 0
+
+
+_stats = OutboxStats()
+_wakeup = asyncio.Event()
+
+
+def get_outbox_stats() -> OutboxStats:
+    return _stats
+
+
+def enqueue_notification(
+    session: AsyncSession,
+    chat_id: int,
+    text: str,
+    reply_markup: Optional[InlineKeyboardMarkup | ReplyKeyboardMarkup] = None,
+) -> None:
+    """
+    Добавляет уведомление в outbox в рамках текущей транзакции session.
+
+    Клавиатура (если есть) сохраняется в JSON и отправляется вместе с текстом.
+
+    После commit нужно вызвать notify_outbox(), чтобы воркер не ждал
+    следующего опроса.
+    """
+    session.add(OutboxMessage(
+        chat_id=chat_id,
+        text=text,
+        reply_markup=reply_markup.model_dump_json(exclude_none=True) if reply_markup is not None else None,
+        status="PENDING",
+        attempts=0,
+        next_attempt_at=datetime.utcnow(),
+    ))
+
+
+def notify_outbox() -> None:
+    _wakeup.set()
+
+
+async def _deliver(bot: Bot, item: OutboxMessage, now: datetime) -> None:
+    """Одна попытка отправки; результат записывается в поля item."""
+    retry_in = None
+    async with send_slots:
+        await chat_limiter.wait(item.chat_id)
+        await global_limiter.wait()
+        try:
+            await bot.send_message(
+                item.chat_id,
+                item.text,
+                reply_markup=json.loads(item.reply_markup) if item.reply_markup else None,
+            )
+        except TelegramRetryAfter as e:
+            # Ограничение частоты — не ошибка сообщения: попытку не засчитываем
+            global_limiter.pause(e.retry_after)
+            item.next_attempt_at = now + timedelta(seconds=e.retry_after)
+            item.last_error = str(e)[:500]
+            _stats.retried += 1
+            return
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # Бот заблокирован или чат не существует — повторять бесполезно
+            item.attempts = (item.attempts or 0) + 1
+            item.status = "DEAD"
+            item.last_error = str(e)[:500]
+            _stats.dead += 1
+            return
+        except Exception as e:
+            retry_in = min(2 ** (item.attempts or 0), MAX_BACKOFF_SECONDS)
+            item.last_error = f"{type(e).__name__}: {e}"[:500]
+
+    item.attempts = (item.attempts or 0) + 1
+    if retry_in is None:
+        item.status = "SENT"
+        item.sent_at = now
+        item.last_error = None
+        _stats.sent += 1
+    elif item.attempts >= OUTBOX_MAX_ATTEMPTS:
+        item.status = "DEAD"
+        _stats.dead += 1
+        logger.warning("Outbox: сообщение %s не доставлено: %s", item.id, item.last_error)
+    else:
+        item.next_attempt_at = now + timedelta(seconds=retry_in)
+        _stats.retried += 1
+
+
+async def drain_outbox_batch(bot: Bot) -> int:
+    """Отправляет одну пачку готовых к отправке сообщений; возвращает её размер."""
+    now = datetime.utcnow()
+    session = AsyncSessionLocal()
+    try:
+        batch = (
+            await session.scalars(
+                select(OutboxMessage)
+                .where(
+                    OutboxMessage.status == "PENDING",
+                    OutboxMessage.next_attempt_at <= now,
+                )
+                .order_by(OutboxMessage.id)
+                .limit(OUTBOX_BATCH_SIZE)
+            )
+        ).all()
+        # Возвращаем соединение в пул на время отправки; сам SELECT
+        # транзакцию SQLite не открывает, результаты пишутся отдельной.
+        await session.commit()
+        if not batch:
+            return 0
+
+        await asyncio.gather(*(_deliver(bot, item, now) for item in batch))
+        await session.commit()
+        return len(batch)
+    finally:
+        await session.close()
+
+
+async def start_outbox_worker(bot: Bot) -> None:
+    """
+    Фоновая задача, которую запускаем при старте бота.
+
+    Разбирает outbox пачками по OUTBOX_BATCH_SIZE; между пачками ждёт
+    notify_outbox() или OUTBOX_POLL_INTERVAL_SECONDS (для отложенных повторов
+    и сообщений, оставшихся после перезапуска).
+    """
+    logger.info("Запуск воркера outbox (batch=%s)", OUTBOX_BATCH_SIZE)
+    while True:
+        _wakeup.clear()
+        try:
+            async with track_job("outbox"):
+                processed = await drain_outbox_batch(bot)
+        except Exception:
+            logger.exception("Ошибка в outbox worker")
+            processed = 0
+
+        if processed >= OUTBOX_BATCH_SIZE:
+            continue
+        try:
+            await asyncio.wait_for(_wakeup.wait(), OUTBOX_POLL_INTERVAL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,255 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from sqlalchemy import func, select
+
+from bot.config import (
+    GUARD_CHANNEL_ID,
+    PICKUP_BOARD_EDIT_INTERVAL_SECONDS,
+    PICKUP_BOARD_PAGE_SIZE,
+)
+from bot.db.database import AsyncSessionLocal
+from bot.db.models import BotState, Child, PickupRequest, User
+
+
+logger = logging.getLogger(__name__)
+
+
+BOARD_MESSAGE_KEY = "pickup_board_message_id"
+# Запас до лимита Telegram в 4096 символов
+MAX_TEXT_LENGTH = 3800
+
+
+@dataclass
+class BoardEntry:
+    pickup_id: int
+    parent_name: str
+    child_name: str
+    class_name: str
+    arrival_minutes: int
+    # Ожидаемое время прибытия родителя, naive UTC
+    expected_at: datetime
+
+
+class PickupBoard:
+    """
+    Закреплённое сообщение в канале охраны со всеми активными заявками.
+
+    Источник данных — индекс в памяти (pickup_id -> BoardEntry), который
+    заполняется из БД при старте и обновляется хэндлерами. Любое изменение
+    только помечает доску «грязной»; сообщение перерисовывается не чаще
+    раза в PICKUP_BOARD_EDIT_INTERVAL_SECONDS, сколько бы заявок ни изменилось.
+    """
+
+    def __init__(self):
+        self.message_id: Optional[int] = None
+        self.page = 0
+        self._entries: Dict[int, BoardEntry] = {}
+        self._dirty = asyncio.Event()
+        self.edits = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, pickup_id: int) -> bool:
+        return pickup_id in self._entries
+
+    def upsert(self, entry: BoardEntry) -> None:
+        self._entries[entry.pickup_id] = entry
+        self._dirty.set()
+
+    def remove(self, *pickup_ids: int) -> None:
+        removed = [pid for pid in pickup_ids if self._entries.pop(pid, None) is not None]
+        if removed:
+            self._dirty.set()
+
+    def set_page(self, page: int) -> None:
+        self.page = page
+        self._dirty.set()
+
+    def is_board_message(self, message_id: int) -> bool:
+        return self.message_id is not None and message_id == self.message_id
+
+    # ---------- отрисовка ----------
+
+    def _sorted(self) -> List[BoardEntry]:
+        return sorted(self._entries.values(), key=lambda e: (e.expected_at, e.pickup_id))
+
+    def page_count(self) -> int:
+        return max(1, -(-len(self._entries) // PICKUP_BOARD_PAGE_SIZE))
+
+    def render(self) -> tuple[str, InlineKeyboardMarkup]:
+        entries = self._sorted()
+        pages = self.page_count()
+        self.page = min(max(self.page, 0), pages - 1)
+        chunk = entries[self.page * PICKUP_BOARD_PAGE_SIZE:(self.page + 1) * PICKUP_BOARD_PAGE_SIZE]
+
+        # Время в заявках хранится в UTC, на доске показываем локальное
+        utc_offset = datetime.now() - datetime.utcnow()
+
+        lines = [f"📋 Выдача учеников — ожидают: {len(entries)}"]
+        if pages > 1:
+            lines[0] += f" (стр. {self.page + 1}/{pages})"
+        if not entries:
+            lines.append("\nАктивных заявок нет.")
+        for entry in chunk:
+            expected = (entry.expected_at + utc_offset).strftime("%H:%M")
+            lines.append(
+                f"\n🟡 {expected} — {entry.child_name} ({entry.class_name})\n"
+                f"Родитель: {entry.parent_name}"
+            )
+        text = "\n".join(lines)
+        if len(text) > MAX_TEXT_LENGTH:
+            text = text[:MAX_TEXT_LENGTH] + "\n…"
+
+        keyboard = [
+            [InlineKeyboardButton(
+                text=f"✅ {entry.child_name} ({entry.class_name})",
+                callback_data=f"pickup_done:{entry.pickup_id}",
+            )]
+            for entry in chunk
+        ]
+        if pages > 1:
+            keyboard.append([
+                InlineKeyboardButton(text="◀️", callback_data=f"board_page:{(self.page - 1) % pages}"),
+                InlineKeyboardButton(text=f"{self.page + 1}/{pages}", callback_data=f"board_page:{self.page}"),
+                InlineKeyboardButton(text="▶️", callback_data=f"board_page:{(self.page + 1) % pages}"),
+            ])
+        return text, InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+    # ---------- публикация ----------
+
+    async def _publish(self, bot: Bot) -> None:
+        text, markup = self.render()
+        if self.message_id is not None:
+            try:
+                await bot.edit_message_text(
+                    text=text,
+                    chat_id=GUARD_CHANNEL_ID,
+                    message_id=self.message_id,
+                    reply_markup=markup,
+                )
+                self.edits += 1
+                return
+            except TelegramBadRequest as e:
+                if "message is not modified" in str(e):
+                    return
+                logger.warning("Доска выдачи: правка не удалась (%s), публикуем заново", e)
+
+        message = await bot.send_message(GUARD_CHANNEL_ID, text, reply_markup=markup)
+        self.message_id = message.message_id
+        await _save_message_id(message.message_id)
+        try:
+            await bot.pin_chat_message(GUARD_CHANNEL_ID, message.message_id, disable_notification=True)
+        except Exception:
+            logger.warning("Доска выдачи: не удалось закрепить сообщение", exc_info=True)
+
+    async def run(self, bot: Bot) -> None:
+        """Перерисовывает доску по изменениям, не чаще заданного интервала."""
+        self._dirty.set()
+        while True:
+            await self._dirty.wait()
+            self._dirty.clear()
+            try:
+                await self._publish(bot)
+            except TelegramRetryAfter as e:
+                self._dirty.set()
+                await asyncio.sleep(e.retry_after)
+            except Exception:
+                logger.exception("Ошибка обновления доски выдачи")
+            await asyncio.sleep(PICKUP_BOARD_EDIT_INTERVAL_SECONDS)
+
+
+def make_entry(
+    pickup_id: int,
+    parent_name: str,
+    child_name: str,
+    class_name: str,
+    arrival_minutes: int,
+    since: Optional[datetime] = None,
+) -> BoardEntry:
+    since = since or datetime.utcnow()
+    return BoardEntry(
+        pickup_id=pickup_id,
+        parent_name=parent_name,
+        child_name=child_name,
+        class_name=class_name,
+        arrival_minutes=arrival_minutes or 0,
+        expected_at=since + timedelta(minutes=arrival_minutes or 0),
+    )
+
+
+async def _load_entries() -> List[BoardEntry]:
+    session = AsyncSessionLocal()
+    try:
+        rows = (
+            await session.execute(
+                select(
+                    PickupRequest.id,
+                    User.full_name,
+                    Child.full_name,
+                    Child.class_name,
+                    PickupRequest.arrival_minutes,
+                    func.coalesce(PickupRequest.updated_at, PickupRequest.created_at),
+                )
+                .join(User, User.id == PickupRequest.parent_id)
+                .join(Child, Child.id == PickupRequest.child_id)
+                .where(PickupRequest.status.in_(["PENDING", "ANNOUNCED"]))
+            )
+        ).all()
+    finally:
+        await session.close()
+
+    entries = []
+    for pickup_id, parent_name, child_name, class_name, arrival_minutes, since in rows:
+        if isinstance(since, str):
+            since = datetime.fromisoformat(since)
+        entries.append(make_entry(pickup_id, parent_name, child_name, class_name, arrival_minutes, since))
+    return entries
+
+
+async def _load_message_id() -> Optional[int]:
+    session = AsyncSessionLocal()
+    try:
+        value = await session.scalar(select(BotState.value).where(BotState.key == BOARD_MESSAGE_KEY))
+    finally:
+        await session.close()
+    return int(value) if value else None
+
+
+async def _save_message_id(message_id: int) -> None:
+    session = AsyncSessionLocal()
+    try:
+        state = await session.get(BotState, BOARD_MESSAGE_KEY)
+        if state is None:
+            session.add(BotState(key=BOARD_MESSAGE_KEY, value=str(message_id)))
+        else:
+            state.value = str(message_id)
+        await session.commit()
+    finally:
+        await session.close()
+
+
+pickup_board = PickupBoard()
+
+
+async def start_pickup_board(bot: Bot) -> None:
+    """
+    Фоновая задача доски выдачи (только при PICKUP_BOARD_ENABLED).
+
+    Восстанавливает индекс и id закреплённого сообщения из БД
+    и дальше перерисовывает доску по изменениям.
+    """
+    pickup_board.message_id = await _load_message_id()
+    for entry in await _load_entries():
+        pickup_board.upsert(entry)
+    logger.info("Доска выдачи: активных заявок %s", len(pickup_board))
+    await pickup_board.run(bot)
@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from sqlalchemy import select, update
+
+from bot.config import (
+    PICKUP_EXPIRE_AFTER_MINUTES,
+    PICKUP_EXPIRY_SWEEP_INTERVAL_SECONDS,
+    PICKUP_EXPIRY_BATCH_SIZE,
+)
+from bot.db.database import AsyncSessionLocal
+from bot.db.models import PickupRequest
+from bot.services.announce_scheduler import cancel_announce
+from bot.services.announce_queue import discard_announcement
+from bot.services.metrics import track_job
+from bot.services.pickup_board import pickup_board
+
+
+logger = logging.getLogger(__name__)
+
+
+ACTIVE_STATUSES = ("PENDING", "ANNOUNCED")
+
+
+@dataclass
+class ExpiryStats:
+    runs: int = 0
+    expired_total: int = 0
+    last_expired: int = 0
+    last_run_at: Optional[datetime] = None
+
+
+_stats = ExpiryStats()
+
+
+def get_expiry_stats() -> ExpiryStats:
+    return _stats
+
+
+def expiry_cutoff(now: Optional[datetime] = None) -> datetime:
+    """Заявки, созданные раньше этого момента, считаются просроченными."""
+    return (now or datetime.utcnow()) - timedelta(minutes=PICKUP_EXPIRE_AFTER_MINUTES)
+
+
+async def _expire_batch(cutoff: datetime, now: datetime) -> Tuple[int, int]:
+    """Возвращает (сколько заявок выбрано, сколько из них просрочено)."""
+    session = AsyncSessionLocal()
+    try:
+        ids = (
+            await session.scalars(
+                select(PickupRequest.id)
+                .where(
+                    PickupRequest.status.in_(ACTIVE_STATUSES),
+                    PickupRequest.created_at < cutoff,
+                )
+                .order_by(PickupRequest.id)
+                .limit(PICKUP_EXPIRY_BATCH_SIZE)
+            )
+        ).all()
+        if not ids:
+            return 0, 0
+
+        # Повторная проверка статуса в WHERE: заявку могли передать
+        # между SELECT и UPDATE
+        result = await session.execute(
+            update(PickupRequest)
+            .where(
+                PickupRequest.id.in_(ids),
+                PickupRequest.status.in_(ACTIVE_STATUSES),
+            )
+            .values(status="EXPIRED", updated_at=now, next_announce_at=None)
+            .execution_options(synchronize_session=False)
+        )
+        await session.commit()
+    finally:
+        await session.close()
+
+    for pickup_id in ids:
+        cancel_announce(pickup_id)
+        discard_announcement(pickup_id)
+    pickup_board.remove(*ids)
+    return len(ids), result.rowcount or 0
+
+
+async def sweep_expired_pickups() -> int:
+    """Переводит все устаревшие активные заявки в EXPIRED пачками; возвращает их число."""
+    now = datetime.utcnow()
+    cutoff = expiry_cutoff(now)
+    expired = 0
+    while True:
+        selected, count = await _expire_batch(cutoff, now)
+        expired += count
+        if selected < PICKUP_EXPIRY_BATCH_SIZE:
+            break
+
+    _stats.runs += 1
+    _stats.last_run_at = now
+    _stats.last_expired = expired
+    _stats.expired_total += expired
+    if expired:
+        logger.info("Просрочено заявок на выдачу: %s", expired)
+    return expired
+
+
+async def start_pickup_expiry_sweeper() -> None:
+    """
+    Фоновая задача, которую запускаем при старте бота.
+
+    Раз в PICKUP_EXPIRY_SWEEP_INTERVAL_SECONDS переводит в EXPIRED заявки
+    (PENDING и ANNOUNCED) старше PICKUP_EXPIRE_AFTER_MINUTES
+    и убирает их из расписания озвучек.
+    """
+    logger.info(
+        "Запуск sweeper просроченных заявок (interval=%s сек.)",
+        PICKUP_EXPIRY_SWEEP_INTERVAL_SECONDS,
+    )
+    while True:
+        try:
+            async with track_job("pickup_expiry"):
+                await sweep_expired_pickups()
+        except Exception:
+            logger.exception("Ошибка в pickup_expiry sweeper")
+
+        await asyncio.sleep(PICKUP_EXPIRY_SWEEP_INTERVAL_SECONDS)
@@ -3,96 +3,171 @@ from __future__ import annotations
 import asyncio
 import logging
 from datetime import datetime, timedelta
+from typing import List
 
-from bot.db.database import SessionLocal
-from bot.db.models import PickupRequest
-from bot.services import PAAdapter, is_auto_voice_active
+from sqlalchemy import select, update
+
+from bot.db.database import AsyncSessionLocal
+from bot.db.models import PickupRequest, Child
+from bot.services import is_auto_voice_active
+from bot.services.metrics import track_job
+from bot.services.announce_scheduler import announce_scheduler, schedule_announce
+from bot.services.announce_queue import (
+    ANNOUNCE_INTERVAL_MINUTES,
+    PRIORITY_REPEAT,
+    RETRY_AFTER_FAILURE_SECONDS,
+    enqueue_announcement,
+)
 
 
 logger = logging.getLogger(__name__)
 
 
-ANNOUNCE_INTERVAL_MINUTES = 4
-POLL_INTERVAL_SECONDS = 20
+# Сколько заявок забирать одной транзакцией
+REPEAT_BATCH_SIZE = 100
+# Как часто перепроверять заявки, пока автоголос выключен (расписание/режим)
+VOICE_INACTIVE_RECHECK_SECONDS = 60
 
 
-async def _process_due_announcements(pa: PAAdapter) -> None:
-    """
-    Находит заявки, для которых пора повторить озвучку, и выполняет её.
+async def _load_schedule() -> int:
+    """Заполняет планировщик активными заявками из БД (при старте бота)."""
+    session = AsyncSessionLocal()
+    try:
+        rows = (
+            await session.execute(
+                select(PickupRequest.id, PickupRequest.next_announce_at).where(
+                    PickupRequest.status.in_(["PENDING", "ANNOUNCED"]),
+                    PickupRequest.next_announce_at != None,  # noqa: E711
+                )
+            )
+        ).all()
+    finally:
+        await session.close()
+
+    announce_scheduler.clear()
+    for pickup_id, next_announce_at in rows:
+        announce_scheduler.schedule(pickup_id, next_announce_at)
+    return len(rows)
 
-    Защита от гонок реализована на уровне условия WHERE:
-    - повторяем только заявки, у которых status != 'HANDED_OVER'
-      и next_announce_at <= now.
+
+async def _claim_batch(pickup_ids: List[int], now: datetime) -> None:
     """
-    now = datetime.utcnow()
+    Забирает пачку наступивших заявок и ставит их в очередь PA.
+
+    Одна короткая транзакция на пачку:
+    - UPDATE с compare-and-set (активный статус и next_announce_at <= now)
+      переносит next_announce_at на следующий круг — заявку, которую
+      хэндлер уже переозвучил или закрыл, повтор не тронет;
+    - тем же соединением читаем заявки вместе с ФИО и классом ребёнка.
+    Озвучка идёт после commit, вне транзакции.
+    """
+    claim_until = now + timedelta(minutes=ANNOUNCE_INTERVAL_MINUTES)
 
-    session = SessionLocal()
+    session = AsyncSessionLocal()
     try:
-        # Берём только те заявки, которым уже назначено время следующей озвучки
-        # и которые ещё не были закрыты.
-        candidates = (
-            session.query(PickupRequest)
-            .filter(
-                PickupRequest.status != "HANDED_OVER",
-                PickupRequest.next_announce_at != None,  # noqa: E711
+        await session.execute(
+            update(PickupRequest)
+            .where(
+                PickupRequest.id.in_(pickup_ids),
+                PickupRequest.status.in_(["PENDING", "ANNOUNCED"]),
                 PickupRequest.next_announce_at <= now,
             )
-            .all()
+            .values(next_announce_at=claim_until)
+            .execution_options(synchronize_session=False)
+        )
+        rows = (
+            await session.execute(
+                select(
+                    PickupRequest.id,
+                    PickupRequest.parent_id,
+                    PickupRequest.arrival_minutes,
+                    PickupRequest.next_announce_at,
+                    Child.full_name,
+                    Child.class_name,
+                )
+                .join(Child, Child.id == PickupRequest.child_id)
+                .where(
+                    PickupRequest.id.in_(pickup_ids),
+                    PickupRequest.status.in_(["PENDING", "ANNOUNCED"]),
+                    PickupRequest.next_announce_at != None,  # noqa: E711
+                )
+            )
+        ).all()
+        await session.commit()
+    finally:
+        await session.close()
+
+    for pickup_id, parent_id, arrival_minutes, next_announce_at, child_name, class_name in rows:
+        if next_announce_at != claim_until:
+            # Хэндлер перенёс озвучку — ждём нового времени
+            schedule_announce(pickup_id, next_announce_at)
+            continue
+
+        # Страховка, если очередь не успеет озвучить и записать результат
+        schedule_announce(pickup_id, claim_until)
+        enqueue_announcement(
+            pickup_id=pickup_id,
+            parent_id=parent_id,
+            child_name=child_name,
+            class_name=class_name,
+            arrival_minutes=arrival_minutes,
+            priority=PRIORITY_REPEAT,
         )
 
-        for req in candidates:
-            # Повторную озвучку делаем только если режим активен.
-            if not is_auto_voice_active():
-                continue
 
-            text = (
-                f"Просьба вызвать ученика {req.child_id} "
-                f"к выходу. Родитель прибудет через {req.arrival_minutes} минут."
-            )
+async def _process_due_announcements(pickup_ids: List[int]) -> None:
+    """
+    Ставит в очередь PA повторные озвучки заявок, время которых наступило,
+    пачками по REPEAT_BATCH_SIZE.
 
-            ok = await pa.announce(text)
-            if not ok:
-                # В случае ошибки просто логируем и попробуем ещё раз
-                # на следующей итерации.
-                logger.warning(
-                    "Не удалось выполнить повторную озвучку (pickup_id=%s)", req.id
-                )
-                continue
+    Закрытые заявки просто выпадают из расписания.
+    Саму озвучку и запись результата в БД выполняет announce_queue.
+    """
+    now = datetime.utcnow()
 
-            req.last_announce_at = now
-            req.next_announce_at = now + timedelta(minutes=ANNOUNCE_INTERVAL_MINUTES)
-            req.announce_count = (req.announce_count or 0) + 1
-            # Если ранее был PENDING, переводим в ANNOUNCED
-            if req.status == "PENDING":
-                req.status = "ANNOUNCED"
-
-        session.commit()
-    except Exception:
-        logger.exception("Ошибка в обработке повторных озвучек")
-        session.rollback()
-    finally:
-        session.close()
+    for start in range(0, len(pickup_ids), REPEAT_BATCH_SIZE):
+        batch = pickup_ids[start:start + REPEAT_BATCH_SIZE]
+        try:
+            await _claim_batch(batch, now)
+        except Exception:
+            logger.exception("Ошибка в обработке повторных озвучек")
+            # Не теряем заявки из расписания из-за ошибки БД
+            for pickup_id in batch:
+                schedule_announce(pickup_id, now + timedelta(seconds=RETRY_AFTER_FAILURE_SECONDS))
 
 
-async def start_repeat_announce_job(pa: PAAdapter) -> None:
+async def start_repeat_announce_job() -> None:
     """
     Фоновая задача, которую запускаем при старте бота.
 
-    Каждые POLL_INTERVAL_SECONDS секунд:
-    - проверяем, активен ли режим автоголоса;
-    - ищем заявки, для которых наступило время next_announce_at;
-    - выполняем повторные озвучки.
+    Вместо периодического опроса БД:
+    - при старте загружаем активные заявки в announce_scheduler;
+    - спим до ближайшего next_announce_at (или до schedule_announce()
+      из хэндлера, если новая заявка должна прозвучать раньше);
+    - передаём наступившие заявки в очередь PA (announce_queue),
+      которая после озвучки ставит их на следующий круг.
+    Пока активных заявок нет, запросов к БД не делается.
     """
-    logger.info(
-        "Запуск фоновой задачи повторных озвучек (interval=%s сек.)",
-        POLL_INTERVAL_SECONDS,
-    )
+    count = await _load_schedule()
+    logger.info("Запуск планировщика повторных озвучек (активных заявок: %s)", count)
+
     while True:
         try:
-            if is_auto_voice_active():
-                await _process_due_announcements(pa)
-        except Exception:
-            logger.exception("Ошибка в repeat_announce_job.loop")
+            await announce_scheduler.wait_next()
+            now = datetime.utcnow()
+            pickup_ids = announce_scheduler.pop_due(now)
+            if not pickup_ids:
+                continue
 
-        await asyncio.sleep(POLL_INTERVAL_SECONDS)
+            if not is_auto_voice_active():
+                # Повторную озвучку делаем только если режим активен
+                recheck_at = now + timedelta(seconds=VOICE_INACTIVE_RECHECK_SECONDS)
+                for pickup_id in pickup_ids:
+                    schedule_announce(pickup_id, recheck_at)
+                continue
 
+            async with track_job("repeat_announce"):
+                await _process_due_announcements(pickup_ids)
+        except Exception:
+            logger.exception("Ошибка в repeat_announce_job.loop")
+            await asyncio.sleep(RETRY_AFTER_FAILURE_SECONDS)
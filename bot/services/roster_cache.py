@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import time
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from sqlalchemy import select
+
+from bot.db.database import AsyncSessionLocal
+from bot.db.models import Child
+
+
+ROSTER_CACHE_TTL_SECONDS = 600
+
+
+class RosterEntry(NamedTuple):
+    """Ученик в составе класса."""
+
+    id: int
+    full_name: str
+    parent_id: int
+
+
+class RosterCache:
+    """
+    Кэш составов классов: class_name -> tuple[RosterEntry, ...].
+
+    Классов в школе немного, поэтому размер не ограничивается,
+    только TTL. Любое добавление, переименование, перевод или удаление
+    ребёнка должно сопровождаться invalidate(class_name).
+    """
+
+    def __init__(self, ttl_seconds: float = ROSTER_CACHE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._items: Dict[str, tuple[float, Tuple[RosterEntry, ...]]] = {}
+        self.hits = 0
+        self.misses = 0
+        # Как в IdentityCache: загрузка, начатая до инвалидации,
+        # не должна положить в кэш устаревший состав.
+        self.generation = 0
+
+    def get(self, class_name: str) -> Optional[Tuple[RosterEntry, ...]]:
+        item = self._items.get(class_name)
+        if item is None or item[0] < time.monotonic():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return item[1]
+
+    def put(self, class_name: str, roster: Tuple[RosterEntry, ...]) -> None:
+        self._items[class_name] = (time.monotonic() + self.ttl_seconds, roster)
+
+    def invalidate(self, class_name: str) -> None:
+        self._items.pop(class_name, None)
+        self.generation += 1
+
+    def clear(self) -> None:
+        self._items.clear()
+        self.generation += 1
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._items),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+roster_cache = RosterCache()
+
+
+async def get_class_roster(class_name: str) -> Tuple[RosterEntry, ...]:
+    """Состав класса из кэша, а при промахе — одним запросом к children."""
+    cached = roster_cache.get(class_name)
+    if cached is not None:
+        return cached
+
+    generation = roster_cache.generation
+    session = AsyncSessionLocal()
+    try:
+        rows = (
+            await session.execute(
+                select(Child.id, Child.full_name, Child.parent_id)
+                .where(Child.class_name == class_name)
+            )
+        ).all()
+    finally:
+        await session.close()
+
+    roster = tuple(RosterEntry(*row) for row in rows)
+    if generation == roster_cache.generation:
+        roster_cache.put(class_name, roster)
+    return roster
+
+
+def invalidate_roster(*class_names: str) -> None:
+    for class_name in class_names:
+        roster_cache.invalidate(class_name)
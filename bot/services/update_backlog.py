@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+import json
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, Hashable, List, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from sqlalchemy import select
+
+from bot.config import (
+    BACKLOG_MAX_AGE_PICKUP_SECONDS,
+    BACKLOG_MAX_AGE_ACTIONS_SECONDS,
+    BACKLOG_MAX_AGE_REPORTS_SECONDS,
+)
+from bot.db.database import AsyncSessionLocal
+from bot.db.models import BotState
+from bot.services.update_priority import (
+    CATEGORY_PICKUP,
+    CATEGORY_ACTIONS,
+    CATEGORY_REPORTS,
+    CATEGORY_ORDER,
+    classify_update,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+MAX_AGE_SECONDS = {
+    CATEGORY_PICKUP: BACKLOG_MAX_AGE_PICKUP_SECONDS,
+    CATEGORY_ACTIONS: BACKLOG_MAX_AGE_ACTIONS_SECONDS,
+    CATEGORY_REPORTS: BACKLOG_MAX_AGE_REPORTS_SECONDS,
+}
+
+# getUpdates отдаёт не больше 100 апдейтов за раз
+FETCH_LIMIT = 100
+
+# Полученные, но ещё не разобранные апдейты: запрос следующей пачки
+# подтверждает предыдущую в Telegram, поэтому до разбора они живут в bot_state
+BACKLOG_STATE_KEY = "update_backlog"
+
+
+@dataclass
+class BacklogStats:
+    fetched: int = 0
+    processed: Dict[str, int] = field(default_factory=lambda: dict.fromkeys(CATEGORY_ORDER, 0))
+    discarded: Dict[str, int] = field(default_factory=lambda: dict.fromkeys(CATEGORY_ORDER, 0))
+    failed: int = 0
+
+
+def _update_dates(updates: List[Update]) -> List[Optional[datetime]]:
+    """
+    Время каждого апдейта.
+
+    У callback_query времени нет: берём время ближайшего предыдущего
+    сообщения из очереди (update_id растут по порядку прихода), а если его
+    нет — ближайшего следующего. Если в очереди нет ни одного сообщения,
+    берём время сообщения с кнопкой: нажатие было не раньше него, так что
+    возраст только завышается. Без и этого времени — None (считаем устаревшим).
+    """
+    dates = [u.message.date if u.message is not None else None for u in updates]
+    result: List[Optional[datetime]] = list(dates)
+
+    previous = None
+    for i, date in enumerate(dates):
+        if date is not None:
+            previous = date
+        else:
+            result[i] = previous
+
+    following = None
+    for i in range(len(dates) - 1, -1, -1):
+        if dates[i] is not None:
+            following = dates[i]
+        elif result[i] is None:
+            result[i] = following
+
+    for i, update in enumerate(updates):
+        if result[i] is None and update.callback_query is not None and update.callback_query.message is not None:
+            result[i] = update.callback_query.message.date
+
+    # aiogram отдаёт aware-время в UTC; naive считаем UTC
+    return [d.replace(tzinfo=timezone.utc) if d is not None and d.tzinfo is None else d for d in result]
+
+
+def _user_key(update: Update) -> Hashable:
+    """Чей апдейт: апдейты одного пользователя разбираются строго по порядку."""
+    user = getattr(update.event, "from_user", None)
+    if user is not None:
+        return user.id
+    return ("update", update.update_id)
+
+
+async def _load_backlog(bot: Bot) -> List[Update]:
+    session = AsyncSessionLocal()
+    try:
+        value = await session.scalar(select(BotState.value).where(BotState.key == BACKLOG_STATE_KEY))
+    finally:
+        await session.close()
+    if not value:
+        return []
+    return [Update.model_validate(item, context={"bot": bot}) for item in json.loads(value)]
+
+
+async def _save_backlog(updates: List[Update]) -> None:
+    value = json.dumps(
+        [u.model_dump(mode="json", exclude_none=True, by_alias=True) for u in updates],
+        ensure_ascii=False,
+    ) if updates else None
+    session = AsyncSessionLocal()
+    try:
+        state = await session.get(BotState, BACKLOG_STATE_KEY)
+        if state is None:
+            if value is None:
+                return
+            session.add(BotState(key=BACKLOG_STATE_KEY, value=value))
+        else:
+            state.value = value
+        await session.commit()
+    finally:
+        await session.close()
+
+
+async def _fetch_backlog(bot: Bot, allowed_updates: List[str]) -> List[Update]:
+    """
+    Очередь апдейтов: не разобранные до падения плюс накопленные в Telegram.
+
+    Каждая пачка сохраняется в bot_state до запроса следующей — только
+    после этого Telegram считает её подтверждённой.
+    """
+    backlog = await _load_backlog(bot)
+    known = {u.update_id for u in backlog}
+    offset = None
+    while True:
+        batch = await bot.get_updates(
+            offset=offset,
+            limit=FETCH_LIMIT,
+            timeout=0,
+            allowed_updates=allowed_updates,
+        )
+        if not batch:
+            return sorted(backlog, key=lambda u: u.update_id)
+        # Последняя пачка до падения не подтверждена и придёт ещё раз
+        backlog.extend(u for u in batch if u.update_id not in known)
+        known.update(u.update_id for u in batch)
+        await _save_backlog(backlog)
+        offset = batch[-1].update_id + 1
+
+
+async def drain_backlog(dp: Dispatcher, bot: Bot) -> BacklogStats:
+    """
+    Обрабатывает апдейты, пришедшие пока бот был остановлен.
+
+    Апдейты одного пользователя разбираются подряд и строго по порядку
+    прихода: нажатие кнопки не обгоняет текст, введённый перед ним. Между
+    пользователями первым идёт тот, у кого есть апдейт важнее: заявки на
+    выдачу и «Передан», затем остальные действия (учителя, регистрация,
+    админ), затем отчёты; при равенстве — кто написал раньше. Устаревшие
+    для своей категории апдейты отбрасываются.
+
+    После каждого пользователя остаток очереди сохраняется в bot_state:
+    если бот упадёт посреди разбора, следующий запуск продолжит с него.
+    """
+    stats = BacklogStats()
+
+    # getUpdates не работает при установленном webhook
+    await bot.delete_webhook(drop_pending_updates=False)
+    backlog = await _fetch_backlog(bot, dp.resolve_used_update_types())
+    stats.fetched = len(backlog)
+    if not backlog:
+        return stats
+
+    now = datetime.now(timezone.utc)
+    rank = {category: i for i, category in enumerate(CATEGORY_ORDER)}
+    groups: Dict[Hashable, List[tuple]] = {}
+    for update, date in zip(backlog, _update_dates(backlog)):
+        category = classify_update(update)
+        age = (now - date).total_seconds() if date is not None else None
+        if age is None or age > MAX_AGE_SECONDS[category]:
+            stats.discarded[category] += 1
+            continue
+        groups.setdefault(_user_key(update), []).append((update, category))
+
+    # dict хранит порядок вставки, sorted устойчив: при равной важности — кто раньше
+    order = sorted(groups.values(), key=lambda group: min(rank[category] for _, category in group))
+    remaining = [update for group in order for update, _ in group]
+    for group in order:
+        for update, category in group:
+            try:
+                await dp.feed_update(bot, update)
+                stats.processed[category] += 1
+            except Exception:
+                stats.failed += 1
+                logger.exception("Ошибка обработки апдейта %s из очереди", update.update_id)
+        remaining = remaining[len(group):]
+        await _save_backlog(remaining)
+
+    # Подтверждаем всю очередь: polling/webhook начнёт со следующего апдейта
+    await bot.get_updates(offset=backlog[-1].update_id + 1, limit=1, timeout=0)
+    await _save_backlog([])
+
+    logger.info(
+        "Очередь апдейтов после простоя: получено %s, обработано %s, отброшено %s, ошибок %s",
+        stats.fetched, stats.processed, stats.discarded, stats.failed,
+    )
+    return stats
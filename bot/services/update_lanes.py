@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from bot.config import (
+    LANE_PICKUP_CONCURRENCY,
+    LANE_ACTIONS_CONCURRENCY,
+    LANE_REPORTS_CONCURRENCY,
+    LANE_PICKUP_SHED_THRESHOLD,
+)
+from bot.services.update_priority import (
+    CATEGORY_PICKUP,
+    CATEGORY_ACTIONS,
+    CATEGORY_REPORTS,
+)
+from bot.services.voice_settings import is_auto_voice_active
+
+
+class Lane:
+    """Полоса выполнения: не больше limit хэндлеров одновременно, остальные ждут."""
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self._slots = asyncio.Semaphore(limit)
+        self.active = 0
+        self.waiting = 0
+        self.processed = 0
+        self.shed = 0
+        self.wait_total_ms = 0.0
+        self.wait_max_ms = 0.0
+
+    def load(self) -> int:
+        return self.active + self.waiting
+
+    async def run(self, call: Callable[[], Awaitable[Any]]) -> Any:
+        started = time.monotonic()
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+
+        wait_ms = (time.monotonic() - started) * 1000
+        self.wait_total_ms += wait_ms
+        self.wait_max_ms = max(self.wait_max_ms, wait_ms)
+        self.active += 1
+        try:
+            return await call()
+        finally:
+            self.active -= 1
+            self.processed += 1
+            self._slots.release()
+
+    def metrics(self) -> dict:
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "processed": self.processed,
+            "shed": self.shed,
+            "wait_avg_ms": self.wait_total_ms / self.processed if self.processed else 0.0,
+            "wait_max_ms": self.wait_max_ms,
+        }
+
+
+class UpdateLanes:
+    """
+    Раздельные полосы для выдачи детей, прочих действий и отчётов.
+
+    Заявки и «Передан» не стоят в одной очереди с отчётами: у каждой
+    категории свой лимит одновременных хэндлеров. Во время автоозвучки,
+    если полоса выдачи загружена (LANE_PICKUP_SHED_THRESHOLD и больше),
+    новые отчёты сбрасываются — пользователь получает просьбу повторить позже.
+    """
+
+    def __init__(self):
+        self.lanes: Dict[str, Lane] = {
+            CATEGORY_PICKUP: Lane(CATEGORY_PICKUP, LANE_PICKUP_CONCURRENCY),
+            CATEGORY_ACTIONS: Lane(CATEGORY_ACTIONS, LANE_ACTIONS_CONCURRENCY),
+            CATEGORY_REPORTS: Lane(CATEGORY_REPORTS, LANE_REPORTS_CONCURRENCY),
+        }
+
+    def should_shed(self, category: str) -> bool:
+        if category != CATEGORY_REPORTS:
+            return False
+        if self.lanes[CATEGORY_PICKUP].load() < LANE_PICKUP_SHED_THRESHOLD:
+            return False
+        return is_auto_voice_active()
+
+    def mark_shed(self, category: str) -> None:
+        self.lanes[category].shed += 1
+
+    async def execute(self, category: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        return await self.lanes[category].run(call)
+
+    def metrics(self) -> Dict[str, dict]:
+        return {name: lane.metrics() for name, lane in self.lanes.items()}
+
+
+update_lanes = UpdateLanes()
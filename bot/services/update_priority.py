@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+from aiogram.types import Update
+
+
+# Категории апдейтов (по убыванию важности): по ним разбирается очередь
+# после простоя (update_backlog) и распределяются полосы выполнения (update_lanes)
+CATEGORY_PICKUP = "pickup"
+CATEGORY_ACTIONS = "actions"
+CATEGORY_REPORTS = "reports"
+
+CATEGORY_ORDER = (CATEGORY_PICKUP, CATEGORY_ACTIONS, CATEGORY_REPORTS)
+
+PICKUP_TEXTS = {"🚗 Я еду за ребёнком", "Я еду за ребёнком"}
+PICKUP_CALLBACK_PREFIXES = (
+    "pickup_child:",
+    "pickup_toggle:",
+    "pickup_all",
+    "pickup_next",
+    "pickup_time:",
+    "pickup_done:",
+    "pickup_done_all:",
+)
+
+# Отчёты только для чтения: при нагрузке и после простоя уступают остальным
+REPORT_TEXTS = {
+    "📊 Оценки",
+    "📅 Посещаемость",
+    "📝 Домашние задания",
+    "💬 Комментарии учителей",
+    "🏆 Рейтинг ребёнка",
+    "🔔 Уведомления школы",
+    "👶 Мои дети",
+    "Мои дети",
+    "📚 Мои классы",
+    "/dbstats",
+}
+REPORT_CALLBACK_PREFIXES = ("board_page:",)
+
+
+def classify_update(update: Update) -> str:
+    """Категория апдейта: выдача детей, прочие действия или отчёты."""
+    if update.callback_query is not None:
+        data = update.callback_query.data or ""
+        if data.startswith(PICKUP_CALLBACK_PREFIXES):
+            return CATEGORY_PICKUP
+        if data.startswith(REPORT_CALLBACK_PREFIXES):
+            return CATEGORY_REPORTS
+        # Учительские (tmsg_, att_, grade_, comment_) и админские кнопки
+        return CATEGORY_ACTIONS
+
+    if update.message is not None:
+        text = (update.message.text or "").strip()
+        if text in PICKUP_TEXTS:
+            return CATEGORY_PICKUP
+        if text in REPORT_TEXTS:
+            return CATEGORY_REPORTS
+    # Ввод в FSM (оценка, комментарий, ФИО), команды, прочие кнопки
+    return CATEGORY_ACTIONS
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from bot.config import UPDATE_WORKERS, DUPLICATE_CALLBACK_WINDOW_SECONDS
+
+
+class _UserQueue:
+    __slots__ = ("lock", "pending")
+
+    def __init__(self):
+        # asyncio.Lock будит ожидающих в порядке прихода (FIFO)
+        self.lock = asyncio.Lock()
+        # Апдейты пользователя: выполняющийся + ожидающие
+        self.pending = 0
+
+
+class UserSerialExecutor:
+    """
+    Апдейты одного пользователя — строго по очереди, разных — параллельно.
+
+    - у каждого пользователя своя очередь (FIFO-lock): двойное нажатие
+      не запускает два перехода FSM на одном состоянии одновременно;
+    - одновременно выполняется не больше UPDATE_WORKERS апдейтов всего;
+      место занимается в run_worker() уже внутри полосы приоритета
+      (PriorityLaneMiddleware), поэтому апдейты, ждущие полосу отчётов,
+      не держат места, нужные заявкам на выдачу;
+    - точный повтор нажатия (тот же пользователь, сообщение и callback_data)
+      в пределах DUPLICATE_CALLBACK_WINDOW_SECONDS отбрасывается.
+    """
+
+    MAX_TRACKED_CALLBACKS = 10_000
+
+    def __init__(
+        self,
+        workers: int = UPDATE_WORKERS,
+        duplicate_window_seconds: float = DUPLICATE_CALLBACK_WINDOW_SECONDS,
+    ):
+        self.workers = workers
+        self.duplicate_window = duplicate_window_seconds
+        self._slots = asyncio.Semaphore(workers)
+        self._queues: Dict[Hashable, _UserQueue] = {}
+        self._recent_callbacks: "OrderedDict[Tuple, float]" = OrderedDict()
+        self.active = 0
+        self.processed = 0
+        self.duplicates = 0
+        self.max_queue_length = 0
+
+    def is_duplicate_callback(self, user_id: int, message_id: Optional[int], data: Optional[str]) -> bool:
+        now = time.monotonic()
+        recent = self._recent_callbacks
+        while recent:
+            seen_at = next(iter(recent.values()))
+            if now - seen_at < self.duplicate_window and len(recent) < self.MAX_TRACKED_CALLBACKS:
+                break
+            recent.popitem(last=False)
+
+        key = (user_id, message_id, data)
+        if key in recent:
+            self.duplicates += 1
+            return True
+        recent[key] = now
+        return False
+
+    async def run(self, user_key: Optional[Hashable], call: Callable[[], Awaitable[Any]]) -> Any:
+        """Выполняет call в очереди пользователя (без учёта общего лимита)."""
+        if user_key is None:
+            return await call()
+
+        queue = self._queues.get(user_key)
+        if queue is None:
+            queue = self._queues[user_key] = _UserQueue()
+        queue.pending += 1
+        self.max_queue_length = max(self.max_queue_length, queue.pending)
+        try:
+            async with queue.lock:
+                return await call()
+        finally:
+            queue.pending -= 1
+            if queue.pending == 0:
+                del self._queues[user_key]
+
+    async def run_worker(self, call: Callable[[], Awaitable[Any]]) -> Any:
+        """Выполняет call на одном из UPDATE_WORKERS мест."""
+        async with self._slots:
+            self.active += 1
+            try:
+                return await call()
+            finally:
+                self.active -= 1
+                self.processed += 1
+
+    def metrics(self) -> dict:
+        lengths = [queue.pending for queue in self._queues.values()]
+        return {
+            "users": len(lengths),
+            "queued": sum(lengths),
+            "longest": max(lengths, default=0),
+            "longest_ever": self.max_queue_length,
+            "active": self.active,
+            "workers": self.workers,
+            "processed": self.processed,
+            "duplicates": self.duplicates,
+        }
+
+
+user_serial = UserSerialExecutor()
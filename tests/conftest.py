@@ -0,0 +1,97 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# bot.config требует токен, а bot.db.database открывает ./school.db
+# относительно текущего каталога — тесты работают во временном каталоге
+os.environ.setdefault("BOT_TOKEN", "123456:TEST")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.chdir(tempfile.mkdtemp(prefix="school-bot-tests-"))
+
+import datetime as dt  # noqa: E402
+
+import pytest  # noqa: E402
+from aiogram import Bot  # noqa: E402
+from sqlalchemy import create_engine  # noqa: E402
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.types import Message, Chat  # noqa: E402
+
+from bot.db.migrations import run_migrations  # noqa: E402
+
+
+class FakeSession(BaseSession):
+    """Сессия бота без сети: запоминает вызовы Telegram API."""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+        # Имя метода -> функция(method), подменяющая ответ Telegram
+        self.responses = {}
+        self._message_id = 1000
+
+    async def make_request(self, bot, method, timeout=None):
+        name = type(method).__name__
+        self.calls.append((name, method.model_dump(exclude_none=True)))
+        if name in self.responses:
+            return self.responses[name](method)
+        if name in ("SendMessage", "EditMessageText"):
+            self._message_id += 1
+            return Message(
+                message_id=getattr(method, "message_id", None) or self._message_id,
+                date=dt.datetime.now(),
+                chat=Chat(id=method.chat_id or 1, type="private"),
+                text=method.text,
+            )
+        return True
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, *args, **kwargs):
+        if False:
+            yield b""
+
+
+@pytest.fixture(scope="session", autouse=True)
+def schema():
+    run_migrations()
+
+
+@pytest.fixture
+def bot():
+    return Bot("123456:TEST", session=FakeSession())
+
+
+# БД первых версий бота: без schema_version, индексов, users.is_blocked,
+# полей автоповторов в pickup_requests и таблицы teacher_classes
+LEGACY_SCHEMA = (
+    "CREATE TABLE subjects (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL UNIQUE, created_at DATETIME)",
+    "CREATE TABLE users (id INTEGER PRIMARY KEY, telegram_id INTEGER NOT NULL UNIQUE, full_name VARCHAR NOT NULL,"
+    " phone VARCHAR, role VARCHAR, is_verified BOOLEAN, created_at DATETIME)",
+    "CREATE TABLE children (id INTEGER PRIMARY KEY, parent_id INTEGER NOT NULL, full_name VARCHAR NOT NULL,"
+    " class_name VARCHAR NOT NULL, created_at DATETIME)",
+    "CREATE TABLE teachers (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL UNIQUE, subject_id INTEGER,"
+    " status VARCHAR, is_verified BOOLEAN, created_at DATETIME)",
+    "CREATE TABLE attendance (id INTEGER PRIMARY KEY, child_id INTEGER NOT NULL, teacher_id INTEGER NOT NULL,"
+    " date DATE NOT NULL, status VARCHAR NOT NULL, created_at DATETIME, UNIQUE (child_id, date))",
+    "CREATE TABLE comments (id INTEGER PRIMARY KEY, child_id INTEGER NOT NULL, teacher_id INTEGER NOT NULL,"
+    " comment_type VARCHAR NOT NULL, text TEXT NOT NULL, created_at DATETIME)",
+    "CREATE TABLE grades (id INTEGER PRIMARY KEY, child_id INTEGER NOT NULL, teacher_id INTEGER NOT NULL,"
+    " subject_id INTEGER NOT NULL, grade INTEGER NOT NULL, comment VARCHAR, date DATE NOT NULL, created_at DATETIME)",
+    "CREATE TABLE homework (id INTEGER PRIMARY KEY, teacher_id INTEGER NOT NULL, class_name VARCHAR NOT NULL,"
+    " subject_id INTEGER NOT NULL, text TEXT NOT NULL, due_date DATE NOT NULL, created_at DATETIME)",
+    "CREATE TABLE pickup_requests (id INTEGER PRIMARY KEY, parent_id INTEGER, child_id INTEGER,"
+    " arrival_minutes INTEGER, status VARCHAR, created_at DATETIME)",
+)
+
+
+@pytest.fixture
+def legacy_engine(tmp_path):
+    """Движок старой БД (схема до миграций) в отдельном файле."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with engine.begin() as conn:
+        for ddl in LEGACY_SCHEMA:
+            conn.exec_driver_sql(ddl)
+    yield engine
+    engine.dispose()
@@ -0,0 +1,110 @@
+import asyncio
+import selectors
+import types
+
+from aiogram.exceptions import TelegramRetryAfter
+
+from bot.services import broadcast
+from bot.services.broadcast import PerChatLimiter, RateLimiter, start_broadcast
+
+
+RATE = 25
+PER_CHAT_INTERVAL = 1.0
+
+
+class _InstantSelector(selectors.SelectSelector):
+    """Вместо ожидания таймера сдвигает виртуальные часы цикла."""
+
+    def __init__(self):
+        super().__init__()
+        self.loop = None
+
+    def select(self, timeout=None):
+        events = super().select(0)
+        if not events and timeout:
+            self.loop.now += timeout
+        return events
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    """Цикл событий с виртуальным временем: asyncio.sleep не ждёт по-настоящему."""
+
+    def __init__(self):
+        selector = _InstantSelector()
+        super().__init__(selector)
+        selector.loop = self
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+
+def _run(monkeypatch, scenario):
+    loop = VirtualClockLoop()
+    monkeypatch.setattr(broadcast, "time", types.SimpleNamespace(monotonic=loop.time))
+    monkeypatch.setattr(broadcast, "global_limiter", RateLimiter(RATE))
+    monkeypatch.setattr(broadcast, "chat_limiter", PerChatLimiter(PER_CHAT_INTERVAL))
+    monkeypatch.setattr(broadcast, "send_slots", asyncio.Semaphore(8))
+    try:
+        return loop.run_until_complete(scenario(loop))
+    finally:
+        loop.close()
+
+
+def _sends(bot, loop, flood=None):
+    """Время каждой отправки по виртуальным часам: [(время, chat_id)]."""
+    sends = []
+    flood = dict(flood or {})
+
+    def send_message(method):
+        if flood.get(method.chat_id):
+            raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=flood.pop(method.chat_id))
+        sends.append((loop.time(), method.chat_id))
+        return True
+
+    bot.session.responses["SendMessage"] = send_message
+    return sends
+
+
+def test_broadcasts_respect_rate_and_per_chat_interval(bot, monkeypatch):
+    chats = list(range(900_000, 900_100))
+
+    async def scenario(loop):
+        sends = _sends(bot, loop)
+        # Две рассылки одновременно, половина получателей общая
+        tasks = [start_broadcast(bot, chats, "Собрание в пятницу"), start_broadcast(bot, chats[50:], "Экскурсия")]
+        results = await asyncio.gather(*tasks)
+        return sends, results, loop.time()
+
+    sends, results, finished_at = _run(monkeypatch, scenario)
+
+    assert [r.delivered for r in results] == [100, 50]
+    times = [t for t, _ in sends]
+    # В любом окне в 1 секунду — не больше RATE отправок
+    assert all(later - earlier >= 1.0 - 1e-9 for earlier, later in zip(times, times[RATE:]))
+    # В один чат — не чаще раза в PER_CHAT_INTERVAL
+    by_chat = {}
+    for t, chat_id in sends:
+        by_chat.setdefault(chat_id, []).append(t)
+    for chat_times in by_chat.values():
+        assert all(b - a >= PER_CHAT_INTERVAL - 1e-9 for a, b in zip(chat_times, chat_times[1:]))
+    # Лимит не тормозит сильнее нужного: 150 сообщений при 25/с — около 6 секунд
+    assert finished_at < 150 / RATE + 1
+
+
+def test_retry_after_pauses_every_send(bot, monkeypatch):
+    chats = list(range(910_000, 910_040))
+
+    async def scenario(loop):
+        sends = _sends(bot, loop, flood={chats[10]: 5})
+        result = await start_broadcast(bot, chats, "Родительское собрание")
+        return sends, result
+
+    sends, result = _run(monkeypatch, scenario)
+
+    assert result.delivered == 40
+    times = [t for t, _ in sends]
+    flood_at = times[9]
+    # После RetryAfter ни одной отправки, пока не истечёт пауза
+    assert not [t for t in times if flood_at + 0.1 < t < flood_at + 5]
+    assert max(times) >= flood_at + 5
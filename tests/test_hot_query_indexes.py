@@ -0,0 +1,158 @@
+import asyncio
+import datetime as dt
+import itertools
+from contextlib import contextmanager
+
+import pytest
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import CallbackQuery, Message
+from sqlalchemy import event
+
+from bot.config import ADMIN_IDS
+from bot.db.database import AsyncSessionLocal, async_engine
+from bot.db.migrations import run_migrations
+from bot.db.models import User, Child, Subject, Teacher, Grade, Attendance, Homework, Comment, PickupRequest
+from bot.handlers import parent
+from bot.handlers.admin_manage import admin_find_parent
+from bot.services.identity_cache import Identity
+from bot.services.pickup_expiry import sweep_expired_pickups
+from bot.services.repeat_announce_job import _load_schedule
+from bot.services.roster_cache import get_class_roster, roster_cache
+
+
+# Таблицы, которые растут вместе со школой: полный проход по ним недопустим
+HOT_TABLES = ("users", "children", "grades", "attendance", "comments", "homework", "pickup_requests")
+
+PHONE = "+998901112233"
+CLASS_NAME = "7Д"
+
+_message_ids = itertools.count(1)
+
+
+async def _seed():
+    session = AsyncSessionLocal()
+    try:
+        user = User(telegram_id=750_001, full_name="Родитель индексов", phone=PHONE, role="parent", is_verified=True)
+        teacher_user = User(telegram_id=750_002, full_name="Учитель индексов", role="teacher")
+        subject = Subject(name="Индексы: история")
+        session.add_all([user, teacher_user, subject])
+        await session.flush()
+        teacher = Teacher(user_id=teacher_user.id, subject_id=subject.id, status="approved")
+        child = Child(parent_id=user.id, full_name="Ученик индексов", class_name=CLASS_NAME)
+        session.add_all([teacher, child])
+        await session.flush()
+        today = dt.date.today()
+        session.add_all([
+            Grade(child_id=child.id, teacher_id=teacher.id, subject_id=subject.id, grade=5, date=today),
+            Attendance(child_id=child.id, teacher_id=teacher.id, date=today, status="present"),
+            Homework(teacher_id=teacher.id, class_name=CLASS_NAME, subject_id=subject.id, text="§5", due_date=today),
+            Comment(child_id=child.id, teacher_id=teacher.id, comment_type="behavior", text="Молодец"),
+            PickupRequest(parent_id=user.id, child_id=child.id, arrival_minutes=5, status="PENDING"),
+        ])
+        await session.commit()
+        actor = Identity(user_id=user.id, full_name=user.full_name, role="parent", is_verified=True, is_blocked=False)
+        return actor, child.id
+    finally:
+        await session.close()
+
+
+def _time_chosen(bot, user_id, minutes):
+    return CallbackQuery.model_validate(
+        {
+            "id": f"indexes-{next(_message_ids)}",
+            "chat_instance": "chat",
+            "from": {"id": user_id, "is_bot": False, "first_name": "Тест"},
+            "data": f"pickup_time:{minutes}",
+            "message": {
+                "message_id": next(_message_ids),
+                "date": dt.datetime.now(),
+                "chat": {"id": user_id, "type": "private"},
+                "text": "Через сколько минут вы приедете?",
+            },
+        },
+        context={"bot": bot},
+    )
+
+
+def _message(bot, user_id, text):
+    return Message.model_validate(
+        {
+            "message_id": next(_message_ids),
+            "date": dt.datetime.now(),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Тест"},
+            "text": text,
+        },
+        context={"bot": bot},
+    )
+
+
+@contextmanager
+def _captured_statements():
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+            statements.append((statement, tuple(parameters)))
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", capture)
+    try:
+        yield statements
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", capture)
+
+
+async def _run_hot_paths(bot):
+    """Горячие пути хэндлеров и фоновых задач — как они выполняются в боте."""
+    actor, child_id = await _seed()
+    for handler in (
+        parent.parent_view_grades,
+        parent.parent_view_attendance,
+        parent.parent_view_homework,
+        parent.parent_view_comments,
+        parent.parent_view_rating,
+        parent.parent_notifications,
+    ):
+        await handler(_message(bot, 750_001, "меню"), actor)
+
+    state = FSMContext(storage=MemoryStorage(), key=StorageKey(bot_id=bot.id, chat_id=1, user_id=1))
+    await state.update_data(child_ids=[child_id])
+    await parent.pickup_choose_time(_time_chosen(bot, 750_001, 10), state, actor)
+
+    await admin_find_parent(_message(bot, ADMIN_IDS[0], PHONE), state)
+
+    roster_cache.clear()
+    await get_class_roster(CLASS_NAME)
+
+    await _load_schedule()
+    await sweep_expired_pickups()
+
+
+@pytest.fixture
+def hot_statements(bot, monkeypatch):
+    monkeypatch.setattr(parent, "is_auto_voice_active", lambda: False)
+    with _captured_statements() as statements:
+        asyncio.run(_run_hot_paths(bot))
+    return statements
+
+
+def _query_plan(engine, statement, parameters):
+    with engine.connect() as conn:
+        return [row[3] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)]
+
+
+def test_hot_queries_use_indexes_after_migrating_legacy_database(legacy_engine, hot_statements):
+    # Индексы появляются у старой БД только через миграции
+    run_migrations(legacy_engine)
+
+    searched = set()
+    for statement, parameters in hot_statements:
+        plan = _query_plan(legacy_engine, statement, parameters)
+        scans = [step for step in plan if step.startswith(tuple(f"SCAN {table}" for table in HOT_TABLES))]
+        assert not scans, (statement, plan)
+        searched.update(table for step in plan for table in HOT_TABLES if step.startswith(f"SEARCH {table} USING"))
+
+    # Горячие пути действительно читают каждую из таблиц
+    assert searched == set(HOT_TABLES)
@@ -0,0 +1,44 @@
+from sqlalchemy import create_engine
+
+from bot.db.migrations import LATEST_VERSION, run_migrations
+
+
+def _schema(engine):
+    """Таблицы с колонками и индексы с колонками — без типов и порядка."""
+    with engine.connect() as conn:
+        tables = [row[0] for row in conn.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+        )]
+        columns = {
+            table: {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")}
+            for table in tables
+        }
+        indexes = {
+            name: (table, tuple(row[2] for row in conn.exec_driver_sql(f"PRAGMA index_info({name})")))
+            for name, table in conn.exec_driver_sql(
+                "SELECT name, tbl_name FROM sqlite_master WHERE type = 'index' AND name NOT LIKE 'sqlite_%'"
+            )
+        }
+    return columns, indexes
+
+
+def test_legacy_database_migrates_to_the_fresh_schema(legacy_engine, tmp_path):
+    fresh_engine = create_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+    try:
+        assert run_migrations(fresh_engine) == LATEST_VERSION
+        assert run_migrations(legacy_engine) == LATEST_VERSION
+
+        assert _schema(legacy_engine) == _schema(fresh_engine)
+    finally:
+        fresh_engine.dispose()
+
+
+def test_migrations_are_not_repeated(legacy_engine):
+    run_migrations(legacy_engine)
+    with legacy_engine.begin() as conn:
+        conn.exec_driver_sql("INSERT INTO users (telegram_id, full_name) VALUES (1, 'Родитель')")
+
+    assert run_migrations(legacy_engine) == LATEST_VERSION
+    with legacy_engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT version FROM schema_version").scalar() == LATEST_VERSION
+        assert conn.exec_driver_sql("SELECT count(*) FROM users").scalar() == 1
@@ -0,0 +1,37 @@
+import asyncio
+import datetime as dt
+
+from aiogram.exceptions import TelegramRetryAfter
+
+from bot.config import OUTBOX_MAX_ATTEMPTS
+from bot.db.models import OutboxMessage
+from bot.services import outbox
+from bot.services.broadcast import PerChatLimiter
+from bot.services.outbox import _deliver
+
+
+def test_retry_after_is_not_counted_as_attempt(bot, monkeypatch):
+    # Попытки в один чат подряд: интервал между сообщениями чату здесь не проверяем
+    monkeypatch.setattr(outbox, "chat_limiter", PerChatLimiter(0))
+
+    def flood(method):
+        raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=0)
+
+    bot.session.responses["SendMessage"] = flood
+    item = OutboxMessage(chat_id=900_001, text="Ваш ребёнок передан", status="PENDING", attempts=0)
+    now = dt.datetime.utcnow()
+
+    async def scenario():
+        for _ in range(OUTBOX_MAX_ATTEMPTS + 2):
+            await _deliver(bot, item, now)
+
+    asyncio.run(scenario())
+
+    assert item.status == "PENDING"
+    assert item.attempts == 0
+    assert item.next_attempt_at == now
+
+    del bot.session.responses["SendMessage"]
+    asyncio.run(_deliver(bot, item, now))
+    assert item.status == "SENT"
+    assert item.attempts == 1
@@ -0,0 +1,145 @@
+import asyncio
+import datetime as dt
+import itertools
+
+from aiogram.types import CallbackQuery
+from sqlalchemy import func, select
+
+from bot.config import ADMIN_IDS, GUARD_CHANNEL_ID
+from bot.db.database import AsyncSessionLocal
+from bot.db.models import User, Child, PickupRequest, OutboxMessage
+from bot.handlers import admin
+from bot.handlers.admin import pickup_done
+from bot.services.announce_queue import _record_announcement
+
+
+_ids = itertools.count(1)
+
+
+async def _create_pickup(channel_message_id: int) -> PickupRequest:
+    session = AsyncSessionLocal()
+    try:
+        n = next(_ids)
+        parent = User(telegram_id=500_000 + n, full_name=f"Родитель {n}", is_verified=True)
+        session.add(parent)
+        await session.flush()
+        child = Child(parent_id=parent.id, full_name=f"Ребёнок {n}", class_name="5А")
+        session.add(child)
+        await session.flush()
+        pickup = PickupRequest(
+            parent_id=parent.id,
+            child_id=child.id,
+            arrival_minutes=5,
+            status="PENDING",
+            channel_message_id=channel_message_id,
+        )
+        session.add(pickup)
+        await session.commit()
+        return pickup
+    finally:
+        await session.close()
+
+
+def _tap(bot, pickup: PickupRequest, callback_id: str) -> CallbackQuery:
+    return CallbackQuery.model_validate(
+        {
+            "id": callback_id,
+            "chat_instance": "guard",
+            "from": {"id": ADMIN_IDS[0], "is_bot": False, "first_name": "Охрана"},
+            "data": f"pickup_done:{pickup.id}",
+            "message": {
+                "message_id": pickup.channel_message_id,
+                "date": dt.datetime.now(),
+                "chat": {"id": GUARD_CHANNEL_ID, "type": "channel"},
+                "text": "📌 Выдача ученика",
+            },
+        },
+        context={"bot": bot},
+    )
+
+
+async def _state(pickup: PickupRequest):
+    session = AsyncSessionLocal()
+    try:
+        status = await session.scalar(select(PickupRequest.status).where(PickupRequest.id == pickup.id))
+        parent_chat = await session.scalar(select(User.telegram_id).where(User.id == pickup.parent_id))
+        notifications = await session.scalar(
+            select(func.count()).select_from(OutboxMessage).where(OutboxMessage.chat_id == parent_chat)
+        )
+        return status, notifications
+    finally:
+        await session.close()
+
+
+def _answers(bot):
+    return [data.get("text") for name, data in bot.session.calls if name == "AnswerCallbackQuery"]
+
+
+def test_parallel_taps_and_announcer_hand_over_once(bot):
+    async def scenario():
+        pickup = await _create_pickup(channel_message_id=7001)
+        taps = [_tap(bot, pickup, f"parallel-{pickup.id}-{i}") for i in range(5)]
+        await asyncio.gather(
+            *(pickup_done(tap) for tap in taps),
+            *(_record_announcement([pickup.id], True) for _ in range(5)),
+        )
+        return pickup
+
+    pickup = asyncio.run(scenario())
+
+    status, notifications = asyncio.run(_state(pickup))
+    assert status == "HANDED_OVER"
+    assert notifications == 1
+    answers = _answers(bot)
+    assert len(answers) == 5
+    assert answers.count("Готово.") == 1
+
+
+def test_redelivered_tap_is_answered_without_side_effects(bot):
+    async def scenario():
+        pickup = await _create_pickup(channel_message_id=7002)
+        await pickup_done(_tap(bot, pickup, f"redelivered-{pickup.id}"))
+        await pickup_done(_tap(bot, pickup, f"redelivered-{pickup.id}"))
+        return pickup
+
+    pickup = asyncio.run(scenario())
+
+    status, notifications = asyncio.run(_state(pickup))
+    assert status == "HANDED_OVER"
+    assert notifications == 1
+    # Повтор убирает «часики» пустым ответом
+    assert _answers(bot) == ["Готово.", None]
+
+
+def test_tap_redelivered_after_failed_attempt_hands_over(bot, monkeypatch):
+    enqueue = admin.enqueue_notification
+    failures = [RuntimeError("database is locked")]
+
+    def flaky_enqueue(*args, **kwargs):
+        if failures:
+            raise failures.pop()
+        return enqueue(*args, **kwargs)
+
+    monkeypatch.setattr(admin, "enqueue_notification", flaky_enqueue)
+
+    async def scenario():
+        pickup = await _create_pickup(channel_message_id=7003)
+        tap_id = f"failed-{pickup.id}"
+        try:
+            await pickup_done(_tap(bot, pickup, tap_id))
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError("первая попытка должна упасть")
+        assert (await _state(pickup)) == ("PENDING", 0)
+
+        # Telegram доставляет то же нажатие ещё раз — его нужно выполнить
+        await pickup_done(_tap(bot, pickup, tap_id))
+        return pickup
+
+    pickup = asyncio.run(scenario())
+
+    status, notifications = asyncio.run(_state(pickup))
+    assert status == "HANDED_OVER"
+    assert notifications == 1
+    assert _answers(bot) == ["Готово."]
@@ -0,0 +1,174 @@
+import asyncio
+import datetime as dt
+import itertools
+
+import pytest
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import CallbackQuery
+from sqlalchemy import select
+
+from bot.config import ADMIN_IDS, GUARD_CHANNEL_ID
+from bot.db.database import AsyncSessionLocal
+from bot.db.models import User, Child, PickupRequest
+from bot.handlers import parent
+from bot.handlers.admin import pickup_done_all
+from bot.handlers.parent import pickup_choose_time
+from bot.services.guard_channel import guard_messages
+from bot.services.identity_cache import Identity
+
+
+_callback_ids = itertools.count(1)
+_families = itertools.count(1)
+
+
+async def _create_family():
+    session = AsyncSessionLocal()
+    try:
+        user = User(telegram_id=740_000 + next(_families), full_name="Каримов Рустам", is_verified=True)
+        session.add(user)
+        await session.flush()
+        children = [
+            Child(parent_id=user.id, full_name=name, class_name=class_name)
+            for name, class_name in (("Аня", "2А"), ("Боря", "4Б"), ("Вова", "6В"))
+        ]
+        session.add_all(children)
+        await session.commit()
+        actor = Identity(user_id=user.id, full_name=user.full_name, role="parent", is_verified=True, is_blocked=False)
+        return actor, {child.full_name: child.id for child in children}
+    finally:
+        await session.close()
+
+
+def _callback(bot, user_id, data, chat_id, message_id, chat_type="private"):
+    return CallbackQuery.model_validate(
+        {
+            "id": f"regroup-{next(_callback_ids)}",
+            "chat_instance": "chat",
+            "from": {"id": user_id, "is_bot": False, "first_name": "Тест"},
+            "data": data,
+            "message": {
+                "message_id": message_id,
+                "date": dt.datetime.now(),
+                "chat": {"id": chat_id, "type": chat_type},
+                "text": "Через сколько минут вы приедете?",
+            },
+        },
+        context={"bot": bot},
+    )
+
+
+async def _request(bot, actor, child_ids, minutes):
+    """Родитель выбрал детей и время: как после pickup_next в FSM."""
+    state = FSMContext(storage=MemoryStorage(), key=StorageKey(bot_id=bot.id, chat_id=1, user_id=1))
+    await state.update_data(child_ids=child_ids)
+    await pickup_choose_time(_callback(bot, 1, f"pickup_time:{minutes}", 1, 1), state, actor)
+
+
+async def _messages(child_ids):
+    """Ребёнок -> (статус заявки, сообщение охраны)."""
+    return {name: (status, message_id) for name, (_, status, message_id) in (await _pickups(child_ids)).items()}
+
+
+async def _pickups(child_ids):
+    """Ребёнок -> (id заявки, статус, сообщение охраны)."""
+    session = AsyncSessionLocal()
+    try:
+        rows = (await session.execute(
+            select(PickupRequest.child_id, PickupRequest.id, PickupRequest.status, PickupRequest.channel_message_id)
+            .where(PickupRequest.child_id.in_(child_ids.values()))
+        )).all()
+    finally:
+        await session.close()
+    names = {child_id: name for name, child_id in child_ids.items()}
+    return {names[child_id]: (pickup_id, status, message_id) for child_id, pickup_id, status, message_id in rows}
+
+
+@pytest.fixture(autouse=True)
+def immediate_edits(monkeypatch):
+    # Без автоозвучки и без паузы между правками одного сообщения охраны
+    monkeypatch.setattr(parent, "is_auto_voice_active", lambda: False)
+    monkeypatch.setattr(guard_messages, "min_interval", 0)
+
+
+def _guard_calls(bot, start):
+    """Вызовы в канал охраны: (метод, message_id, кнопки)."""
+    calls = []
+    for name, data in bot.session.calls[start:]:
+        if data.get("chat_id") != GUARD_CHANNEL_ID:
+            continue
+        buttons = [b["callback_data"] for row in (data.get("reply_markup") or {}).get("inline_keyboard", []) for b in row]
+        calls.append((name, data.get("message_id"), buttons))
+    return calls
+
+
+def test_reselecting_one_child_splits_the_guard_message(bot):
+    async def scenario():
+        actor, ids = await _create_family()
+        steps = []
+
+        start = len(bot.session.calls)
+        await _request(bot, actor, [ids["Аня"], ids["Боря"]], 5)
+        steps.append((_guard_calls(bot, start), await _messages(ids)))
+
+        # Аня приедет позже: её заявка уходит в новое сообщение, Боря остаётся в старом
+        start = len(bot.session.calls)
+        await _request(bot, actor, [ids["Аня"]], 10)
+        steps.append((_guard_calls(bot, start), await _messages(ids)))
+
+        # Аня и Вова вместе: сообщение Ани правится на месте, Вова добавляется в него
+        start = len(bot.session.calls)
+        await _request(bot, actor, [ids["Аня"], ids["Вова"]], 15)
+        steps.append((_guard_calls(bot, start), await _messages(ids)))
+        pickup = {name: pickup_id for name, (pickup_id, _, _) in (await _pickups(ids)).items()}
+        return actor, pickup, steps
+
+    actor, pickup, steps = asyncio.run(scenario())
+
+    calls, state = steps[0]
+    first = state["Аня"][1]
+    assert state == {"Аня": ("PENDING", first), "Боря": ("PENDING", first)}
+    assert calls == [
+        ("SendMessage", None, [
+            f"pickup_done:{pickup['Аня']}", f"pickup_done:{pickup['Боря']}", f"pickup_done_all:{actor.user_id}",
+        ]),
+    ]
+
+    calls, state = steps[1]
+    second = state["Аня"][1]
+    assert second != first
+    assert state == {"Аня": ("PENDING", second), "Боря": ("PENDING", first)}
+    assert calls == [
+        ("SendMessage", None, [f"pickup_done:{pickup['Аня']}"]),
+        ("EditMessageText", first, [f"pickup_done:{pickup['Боря']}"]),
+    ]
+
+    calls, state = steps[2]
+    assert state == {"Аня": ("PENDING", second), "Боря": ("PENDING", first), "Вова": ("PENDING", second)}
+    assert calls == [
+        ("EditMessageText", second, [
+            f"pickup_done:{pickup['Аня']}", f"pickup_done:{pickup['Вова']}", f"pickup_done_all:{actor.user_id}",
+        ]),
+    ]
+
+
+def test_handed_over_all_touches_only_the_tapped_message(bot):
+    async def scenario():
+        actor, ids = await _create_family()
+        await _request(bot, actor, [ids["Аня"], ids["Боря"]], 5)
+        await _request(bot, actor, [ids["Вова"]], 10)
+        before = await _messages(ids)
+
+        tapped = before["Аня"][1]
+        await pickup_done_all(_callback(
+            bot, ADMIN_IDS[0], f"pickup_done_all:{actor.user_id}", GUARD_CHANNEL_ID, tapped, chat_type="channel",
+        ))
+        return before, await _messages(ids)
+
+    before, after = asyncio.run(scenario())
+
+    assert before["Вова"][1] != before["Аня"][1]
+    assert after["Аня"][0] == "HANDED_OVER"
+    assert after["Боря"][0] == "HANDED_OVER"
+    assert after["Вова"] == before["Вова"]
@@ -0,0 +1,129 @@
+import asyncio
+import datetime as dt
+
+import pytest
+
+from bot.db.database import AsyncSessionLocal
+from bot.db.models import User, Child, Subject, Teacher, Grade, Attendance
+from bot.handlers.parent import _rating_query
+
+
+MONTH_START = dt.date(2026, 3, 1)
+
+# Класс -> [(ученик, родитель, оценки)]; «A»/«B» — родители, чей рейтинг проверяем
+SCHOOL = {
+    "9Р1": [
+        ("Алиев Азиз", "A", [5, 5, 4]),
+        ("Борисова Вера", "B", [5, 4, 5]),    # делит место с Алиевым
+        ("Власов Глеб", None, [3, 4]),
+        ("Гусейнова Дина", "B", []),           # без оценок
+        ("Егоров Жан", None, [2]),
+        ("Зайцева Ирина", None, []),
+    ],
+    "9Р2": [
+        ("Алиева Камила", "A", [4]),
+        ("Ким Лев", None, []),
+    ],
+    "9Р3": [
+        ("Алиев Марат", "A", []),
+    ],
+}
+
+# Ученик -> [(день от начала месяца, статус)]; отрицательные дни — прошлый месяц
+ATTENDANCE = {
+    "Алиев Азиз": [(-3, "present"), (0, "present"), (1, "absent"), (2, "late"), (3, "present")],
+    "Алиева Камила": [(-1, "absent")],
+    "Гусейнова Дина": [(4, "present")],
+}
+
+
+async def _seed():
+    session = AsyncSessionLocal()
+    try:
+        teacher_user = User(telegram_id=810_000, full_name="Учитель рейтинга", role="teacher")
+        parents = {key: User(telegram_id=810_000 + i, full_name=f"Родитель {key}") for i, key in enumerate("AB", 1)}
+        subject = Subject(name="Рейтинг: математика")
+        session.add_all([teacher_user, subject, *parents.values()])
+        await session.flush()
+        teacher = Teacher(user_id=teacher_user.id, subject_id=subject.id, status="approved")
+        # Родители одноклассников — отдельные, в рейтинг не попадают
+        others = User(telegram_id=810_100, full_name="Другие родители")
+        session.add_all([teacher, others])
+        await session.flush()
+
+        for class_name, students in SCHOOL.items():
+            for full_name, parent_key, grades in students:
+                parent = parents[parent_key] if parent_key else others
+                child = Child(parent_id=parent.id, full_name=full_name, class_name=class_name)
+                session.add(child)
+                await session.flush()
+                session.add_all(
+                    Grade(child_id=child.id, teacher_id=teacher.id, subject_id=subject.id, grade=grade, date=MONTH_START)
+                    for grade in grades
+                )
+                session.add_all(
+                    Attendance(
+                        child_id=child.id, teacher_id=teacher.id,
+                        date=MONTH_START + dt.timedelta(days=day), status=status,
+                    )
+                    for day, status in ATTENDANCE.get(full_name, [])
+                )
+        await session.commit()
+        return {key: parent.id for key, parent in parents.items()}
+    finally:
+        await session.close()
+
+
+async def _rating(parent_id):
+    session = AsyncSessionLocal()
+    try:
+        return (await session.execute(_rating_query(parent_id, MONTH_START))).all()
+    finally:
+        await session.close()
+
+
+def _expected(parent_key):
+    """Рейтинг «по определению»: перебор одноклассников в Python."""
+    rows = []
+    for class_name, students in SCHOOL.items():
+        averages = [sum(grades) / len(grades) for _, _, grades in students if grades]
+        for full_name, key, grades in students:
+            if key != parent_key:
+                continue
+            days = [status for day, status in ATTENDANCE.get(full_name, []) if day >= 0]
+            avg = sum(grades) / len(grades) if grades else None
+            row = {
+                "name": full_name,
+                "class": class_name,
+                "avg": pytest.approx(avg) if avg is not None else None,
+                "graded": len(averages),
+                "total": len(days),
+                "present": days.count("present"),
+            }
+            if avg is not None:
+                # Место — 1 + число учеников с баллом выше (равные делят место),
+                # перцентиль — доля остальных оценённых с баллом ниже
+                row["rank"] = 1 + sum(other > avg for other in averages)
+                others = len(averages) - 1
+                row["percentile"] = pytest.approx(sum(other < avg for other in averages) / others if others else 0.0)
+            rows.append(row)
+    return rows
+
+
+def _actual(rows):
+    result = []
+    for name, class_name, avg, rank, graded, percentile, total, present in rows:
+        row = {"name": name, "class": class_name, "avg": avg, "graded": graded, "total": total, "present": present}
+        if avg is not None:
+            row["rank"] = rank
+            row["percentile"] = percentile
+        result.append(row)
+    return result
+
+
+def test_rating_query_matches_ranking_by_definition():
+    parent_ids = asyncio.run(_seed())
+
+    for key, parent_id in parent_ids.items():
+        rows = asyncio.run(_rating(parent_id))
+        assert _actual(rows) == _expected(key), key
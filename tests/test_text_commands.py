@@ -0,0 +1,114 @@
+import asyncio
+import datetime as dt
+
+import pytest
+from aiogram import Dispatcher, Router
+from aiogram.filters import StateFilter
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.types import Update
+
+from bot.handlers.text_commands import TextCommandIndex, dispatch_text_command
+
+
+USER_ID = 720_001
+
+
+class Homework(StatesGroup):
+    text = State()
+
+
+def _text(update_id: int, text: str) -> Update:
+    return Update.model_validate({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": dt.datetime.now(dt.timezone.utc),
+            "chat": {"id": USER_ID, "type": "private"},
+            "from": {"id": USER_ID, "is_bot": False, "first_name": "Учитель"},
+            "text": text,
+        },
+    })
+
+
+def _dispatcher(seen):
+    """Как в main.py: индекс кнопок первым, за ним обычные роутеры."""
+    index = TextCommandIndex()
+    commands = Router()
+    commands.message(index)(dispatch_text_command)
+
+    @index.handler("📊 Оценки", "Оценки")
+    async def grades(message, state):
+        seen.append(("grades", message.text, await state.get_state()))
+
+    handlers = Router()
+
+    @handlers.message(StateFilter(Homework.text))
+    async def homework_text(message, state):
+        seen.append(("homework", message.text))
+        await state.clear()
+
+    @handlers.message()
+    async def fallback(message):
+        seen.append(("fallback", message.text))
+
+    dp = Dispatcher()
+    dp.include_routers(commands, handlers)
+    return dp
+
+
+def test_exact_button_text_dispatches_and_other_text_falls_through(bot):
+    seen = []
+    dp = _dispatcher(seen)
+
+    async def scenario():
+        for update_id, text in enumerate(["📊 Оценки", "Оценки", "📊 оценки", " 📊 Оценки", "Привет"], 1):
+            await dp.feed_update(bot, _text(update_id, text))
+
+    asyncio.run(scenario())
+
+    assert seen == [
+        ("grades", "📊 Оценки", None),
+        ("grades", "Оценки", None),
+        ("fallback", "📊 оценки"),
+        ("fallback", " 📊 Оценки"),
+        ("fallback", "Привет"),
+    ]
+
+
+def test_button_pre_empts_fsm_input(bot):
+    seen = []
+    dp = _dispatcher(seen)
+
+    async def scenario():
+        state = dp.fsm.get_context(bot, chat_id=USER_ID, user_id=USER_ID)
+        await state.set_state(Homework.text)
+        # Кнопка меню в состоянии ввода — это кнопка, а не текст задания;
+        # состояние остаётся, следующий ввод попадает в него
+        await dp.feed_update(bot, _text(1, "📊 Оценки"))
+        await dp.feed_update(bot, _text(2, "Параграф 12, задачи 1–5"))
+        await dp.feed_update(bot, _text(3, "Параграф 13"))
+
+    asyncio.run(scenario())
+
+    assert seen == [
+        ("grades", "📊 Оценки", Homework.text.state),
+        ("homework", "Параграф 12, задачи 1–5"),
+        ("fallback", "Параграф 13"),
+    ]
+
+
+def test_button_text_registered_twice_is_rejected():
+    index = TextCommandIndex()
+
+    @index.handler("📊 Оценки")
+    async def first(message):
+        pass
+
+    with pytest.raises(ValueError):
+        @index.handler("Оценки", "📊 Оценки")
+        async def second(message):
+            pass
+
+    assert "📊 Оценки" in index
+    # Неудачная регистрация не оставляет половину вариантов
+    assert "Оценки" not in index
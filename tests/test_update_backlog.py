@@ -0,0 +1,147 @@
+import asyncio
+import datetime as dt
+
+import pytest
+from aiogram import Dispatcher, F, Router
+from aiogram.types import Update
+
+from bot.services.update_backlog import _load_backlog, _save_backlog, drain_backlog
+
+
+class Crash(BaseException):
+    """Падение процесса посреди разбора очереди."""
+
+
+class FakeTelegram:
+    """Очередь getUpdates: offset подтверждает всё, что меньше него."""
+
+    def __init__(self, updates):
+        self.updates = list(updates)
+
+    def get_updates(self, method):
+        if method.offset is not None:
+            self.updates = [u for u in self.updates if u.update_id >= method.offset]
+        return self.updates[: method.limit]
+
+
+def _message(update_id, user_id, text, date=None):
+    return Update.model_validate({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": date or dt.datetime.now(dt.timezone.utc),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"U{user_id}"},
+            "text": text,
+        },
+    })
+
+
+def _callback(update_id, user_id, data, message_date=None):
+    callback = {
+        "id": f"cb-{update_id}",
+        "chat_instance": "chat",
+        "from": {"id": user_id, "is_bot": False, "first_name": f"U{user_id}"},
+        "data": data,
+    }
+    if message_date is not None:
+        callback["message"] = {
+            "message_id": 1,
+            "date": message_date,
+            "chat": {"id": user_id, "type": "private"},
+            "text": "кнопки",
+        }
+    return Update.model_validate({"update_id": update_id, "callback_query": callback})
+
+
+def _dispatcher(seen, crash_on=None):
+    router = Router()
+
+    @router.message(F.text)
+    async def on_message(message):
+        seen.append(message.message_id)
+
+    @router.callback_query()
+    async def on_callback(callback):
+        update_id = int(callback.id.removeprefix("cb-"))
+        if update_id == crash_on:
+            raise Crash
+        seen.append(update_id)
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    return dp
+
+
+def _drain(bot, telegram, seen, crash_on=None):
+    bot.session.responses["GetUpdates"] = telegram.get_updates
+    return drain_backlog(_dispatcher(seen, crash_on), bot)
+
+
+def test_one_user_keeps_order_and_users_go_by_priority(bot):
+    telegram = FakeTelegram([
+        _message(1, 10, "📊 Оценки"),
+        _message(2, 20, "Привет"),
+        _message(3, 10, "pickup_time:5"),
+        _callback(4, 10, "pickup_time:5"),
+        _callback(5, 20, "board_page:1"),
+    ])
+    seen = []
+
+    stats = asyncio.run(_drain(bot, telegram, seen))
+
+    # У пользователя 10 есть заявка на выдачу — он первый, но его отчёт
+    # и введённый текст не обгоняются нажатием кнопки
+    assert seen == [1, 3, 4, 2, 5]
+    assert stats.failed == 0
+    assert telegram.updates == []
+
+
+def test_undated_callbacks_use_button_message_time(bot):
+    now = dt.datetime.now(dt.timezone.utc)
+    telegram = FakeTelegram([
+        _callback(11, 30, "pickup_done:1", message_date=now - dt.timedelta(days=1)),
+        _callback(12, 31, "pickup_done:2", message_date=now - dt.timedelta(seconds=5)),
+        _callback(13, 32, "pickup_done:3"),
+    ])
+    seen = []
+
+    stats = asyncio.run(_drain(bot, telegram, seen))
+
+    assert seen == [12]
+    assert stats.discarded["pickup"] == 2
+
+
+def test_crash_while_draining_resumes_from_saved_backlog(bot):
+    updates = [_message(update_id, 1000 + update_id, "Привет") for update_id in range(21, 26)]
+    updates.append(_callback(26, 99, "tmsg_1"))
+    updates += [_message(update_id, 1000 + update_id, "Привет") for update_id in range(27, 250)]
+    telegram = FakeTelegram(updates)
+    seen = []
+
+    # Очередь больше одной пачки getUpdates: к началу разбора Telegram
+    # уже считает её подтверждённой, апдейты остались только в bot_state
+    with pytest.raises(Crash):
+        asyncio.run(_drain(bot, telegram, seen, crash_on=26))
+    assert telegram.updates == []
+    assert seen == list(range(21, 26))
+
+    stats = asyncio.run(_drain(bot, telegram, seen))
+
+    assert seen == list(range(21, 26)) + [26] + list(range(27, 250))
+    assert stats.processed["actions"] == len(updates) - 5
+    assert asyncio.run(_load_backlog(bot)) == []
+
+
+def test_saved_backlog_round_trips(bot):
+    updates = [_message(51, 60, "Привет"), _callback(52, 60, "pickup_all")]
+
+    async def scenario():
+        await _save_backlog(updates)
+        loaded = await _load_backlog(bot)
+        await _save_backlog([])
+        return loaded
+
+    loaded = asyncio.run(scenario())
+    assert [u.update_id for u in loaded] == [51, 52]
+    assert loaded[1].callback_query.data == "pickup_all"
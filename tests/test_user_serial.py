@@ -0,0 +1,108 @@
+import asyncio
+import datetime as dt
+
+from aiogram import Dispatcher, Router
+from aiogram.types import Update
+
+from bot.middlewares import PriorityLaneMiddleware, UserSerialMiddleware
+
+
+ALICE, BORIS = 730_001, 730_002
+
+
+def _text(update_id: int, user_id: int, text: str) -> Update:
+    return Update.model_validate({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": dt.datetime.now(dt.timezone.utc),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": str(user_id)},
+            "text": text,
+        },
+    })
+
+
+def _tap(update_id: int, user_id: int, data: str) -> Update:
+    return Update.model_validate({
+        "update_id": update_id,
+        "callback_query": {
+            "id": f"tap-{update_id}",
+            "chat_instance": "chat",
+            "from": {"id": user_id, "is_bot": False, "first_name": str(user_id)},
+            "data": data,
+            "message": {
+                "message_id": 1,
+                "date": dt.datetime.now(dt.timezone.utc),
+                "chat": {"id": user_id, "type": "private"},
+                "text": "Выберите время",
+            },
+        },
+    })
+
+
+def _dispatcher(events):
+    """Как в main.py: очередь пользователя, затем полосы приоритета."""
+    router = Router()
+
+    async def work(user_id, label):
+        events.append(("start", user_id, label))
+        await asyncio.sleep(0.02)
+        events.append(("end", user_id, label))
+
+    @router.message()
+    async def on_message(message):
+        await work(message.from_user.id, message.text)
+
+    @router.callback_query()
+    async def on_callback(callback):
+        await work(callback.from_user.id, callback.data)
+        await callback.answer()
+
+    dp = Dispatcher()
+    dp.update.outer_middleware(UserSerialMiddleware())
+    dp.update.outer_middleware(PriorityLaneMiddleware())
+    dp.include_router(router)
+    return dp
+
+
+def test_user_order_cross_user_concurrency_and_repeated_tap(bot):
+    events = []
+    dp = _dispatcher(events)
+    updates = [
+        _text(1, ALICE, "Добавить ребёнка"),
+        _text(2, BORIS, "📊 Оценки"),
+        _text(3, ALICE, "Иванов Иван"),
+        _tap(4, BORIS, "pickup_time:5"),
+        _tap(5, ALICE, "pickup_time:10"),
+        _tap(6, BORIS, "pickup_time:5"),  # двойное нажатие той же кнопки
+        _text(7, BORIS, "Спасибо"),
+    ]
+
+    async def scenario():
+        # Апдейты приходят одновременно, как при webhook/polling под нагрузкой
+        await asyncio.gather(*(dp.feed_update(bot, update) for update in updates))
+
+    asyncio.run(scenario())
+
+    def handled(user_id):
+        return [label for kind, uid, label in events if kind == "start" and uid == user_id]
+
+    assert handled(ALICE) == ["Добавить ребёнка", "Иванов Иван", "pickup_time:10"]
+    assert handled(BORIS) == ["📊 Оценки", "pickup_time:5", "Спасибо"]
+
+    # У одного пользователя следующий апдейт начинается только после предыдущего
+    for user_id in (ALICE, BORIS):
+        own = [kind for kind, uid, _ in events if uid == user_id]
+        assert own == ["start", "end"] * 3
+
+    # Разные пользователи выполняются параллельно
+    running = peak = 0
+    for kind, _, _ in events:
+        running += 1 if kind == "start" else -1
+        peak = max(peak, running)
+    assert peak == 2
+
+    # Повтор нажатия отброшен, но «часики» на нём убраны
+    answers = [data["callback_query_id"] for name, data in bot.session.calls if name == "AnswerCallbackQuery"]
+    assert sorted(answers) == ["tap-4", "tap-5", "tap-6"]
@@ -0,0 +1,61 @@
+import asyncio
+import datetime as dt
+
+from aiogram import Dispatcher, Router
+from aiohttp.test_utils import TestClient, TestServer
+
+from bot.config import WEBHOOK_PATH
+from bot.main import build_webhook_app
+
+
+SECRET = "webhook-test-secret"
+
+
+def _update(update_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(dt.datetime.now(dt.timezone.utc).timestamp()),
+            "chat": {"id": 700_001, "type": "private"},
+            "from": {"id": 700_001, "is_bot": False, "first_name": "Родитель"},
+            "text": "Привет",
+        },
+    }
+
+
+def _dispatcher(handled: asyncio.Queue) -> Dispatcher:
+    router = Router()
+
+    @router.message()
+    async def on_message(message):
+        await handled.put(message.message_id)
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    return dp
+
+
+def test_webhook_runs_handler_and_rejects_wrong_secret(bot):
+    async def scenario():
+        handled = asyncio.Queue()
+        app = build_webhook_app(_dispatcher(handled), bot, secret_token=SECRET)
+        async with TestClient(TestServer(app)) as client:
+            rejected = await client.post(
+                WEBHOOK_PATH, json=_update(1), headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"}
+            )
+            missing = await client.post(WEBHOOK_PATH, json=_update(2))
+            accepted = await client.post(
+                WEBHOOK_PATH, json=_update(3), headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}
+            )
+            message_id = await asyncio.wait_for(handled.get(), timeout=5)
+            return rejected.status, missing.status, accepted.status, message_id, handled.qsize()
+
+    rejected, missing, accepted, message_id, extra = asyncio.run(scenario())
+
+    assert rejected == 401
+    assert missing == 401
+    assert accepted == 200
+    # Обработан только апдейт с правильным секретом
+    assert message_id == 3
+    assert extra == 0